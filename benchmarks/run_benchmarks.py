@@ -0,0 +1,250 @@
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import platform
+import tempfile
+import statistics
+import subprocess
+import contextlib
+from typing import Callable, List, Tuple, Union
+import click
+
+# make the stan_playground package and the cmdstanpy stub importable, also in
+# the processes that are spawned by the service and the worker
+_this_dir = os.path.dirname(os.path.abspath(__file__))
+_repo_dir = os.path.dirname(_this_dir)
+_stubs_dir = f'{_this_dir}/stubs'
+sys.path.insert(0, _repo_dir)
+sys.path.insert(0, _stubs_dir)
+os.environ['PYTHONPATH'] = os.pathsep.join([_stubs_dir, _repo_dir] + ([os.environ['PYTHONPATH']] if os.environ.get('PYTHONPATH') else []))
+
+from stan_playground import create_summary, update_analysis_summary, rebuild_index, queue_analysis, generate_access_code
+from stan_playground.RtcsharePlugin import StanPlaygroundService
+from stan_playground.metadata_store import read_analysis_info, update_analysis_info
+from stan_playground.jobs import get_job_status
+from synthetic_data import create_synthetic_data_dir
+
+
+# makefile of the stub cmdstan installation: "compiling" a model writes an empty executable
+STUB_MAKEFILE = '%/main:\n\t@echo "stub compile $@"\n\t@printf "#!/bin/sh\\n" > $@ && chmod +x $@\n'
+
+@click.command(help='Benchmark the service queries, the summary and the worker loop on synthetic data directories')
+@click.option('--sizes', default='100,1000,10000', help='Comma-separated numbers of analyses (e.g. 100,1000,10000,100000)')
+@click.option('--repeats', default=20, help='Number of times each query is timed')
+@click.option('--latency-samples', default=10, help='Number of analyses run by the worker to measure the enqueue-to-start latency (0 to skip)')
+@click.option('--output', default=None, help='Write the results as JSON to this file (default: stdout)')
+@click.option('--keep', is_flag=True, help='Keep the synthetic data directories')
+def main(sizes: str, repeats: int, latency_samples: int, output: Union[str, None], keep: bool):
+    results = {
+        'timestamp': time.time(),
+        'git_commit': _get_git_commit(),
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'repeats': repeats,
+        'sizes': []
+    }
+    for num_analyses in [int(s) for s in sizes.split(',')]:
+        num_projects = max(1, num_analyses // 10)
+        work_dir = tempfile.mkdtemp(prefix=f'stan_playground_benchmark_{num_analyses}_')
+        data_dir = f'{work_dir}/data'
+        try:
+            _log(f'Creating synthetic data directory with {num_analyses} analyses and {num_projects} projects')
+            timer = time.time()
+            synthetic = create_synthetic_data_dir(data_dir, num_analyses=num_analyses, num_projects=num_projects, num_users=max(1, num_analyses // 20))
+            _log(f'  created in {time.time() - timer:.1f} sec')
+            stub_cmdstan_dir = f'{work_dir}/cmdstan-stub'
+            os.makedirs(stub_cmdstan_dir)
+            with open(f'{stub_cmdstan_dir}/makefile', 'w') as f:
+                f.write(STUB_MAKEFILE)
+            os.environ['STUB_CMDSTAN_DIR'] = stub_cmdstan_dir
+            os.environ['RTCSHARE_DIR'] = data_dir
+            r = {
+                'num_analyses': num_analyses,
+                'num_projects': num_projects
+            }
+            r['rebuild_index_sec'] = _time_once(lambda: rebuild_index(dir=data_dir))
+            r['create_summary_sec'] = _time_once(lambda: create_summary(dir=data_dir))
+            a = synthetic['analyses'][0]['analysis_id']
+            def touch_and_update():
+                update_analysis_info(a, dir=data_dir, update={'timestamp_modified': time.time()})
+                update_analysis_summary(a, dir=data_dir)
+            r['update_analysis_summary'] = _time_repeated(lambda i: touch_and_update(), repeats=repeats)
+            r['queries'] = _benchmark_queries(synthetic, data_dir=data_dir, repeats=repeats)
+            if latency_samples > 0:
+                r['worker'] = _benchmark_worker(synthetic, data_dir=data_dir, num_samples=latency_samples)
+            results['sizes'].append(r)
+        finally:
+            if keep:
+                _log(f'Keeping {work_dir}')
+            else:
+                shutil.rmtree(work_dir)
+    text = json.dumps(results, indent=4)
+    if output is not None:
+        with open(output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+def _benchmark_queries(synthetic: dict, *, data_dir: str, repeats: int) -> dict:
+    analyses = synthetic['analyses']
+    projects = synthetic['projects']
+    none_analyses = [a for a in analyses if a['status'] == 'none']
+    # analyses that can be moved to a project of their owner
+    projects_by_owner = {}
+    for p in projects:
+        projects_by_owner.setdefault(p['owner_id'], []).append(p)
+    movable = [(a, projects_by_owner[a['owner_id']][0]) for a in analyses if a['owner_id'] in projects_by_owner]
+    access_code = generate_access_code(dir=data_dir)
+    state = {'created_projects': [], 'job_ids': []}
+
+    def a_(i: int) -> dict:
+        return analyses[i % len(analyses)]
+    def p_(i: int) -> dict:
+        return projects[i % len(projects)]
+
+    # each entry makes the i-th query of a type, as (query, user_id). The
+    # queries that change state alternate so that every query succeeds.
+    query_makers: List[Tuple[str, Callable[[int], Tuple[dict, Union[str, None]]]]] = [
+        ('test', lambda i: ({}, None)),
+        ('get_listed_projects', lambda i: ({}, None)),
+        ('get_projects_for_user', lambda i: ({}, p_(i)['owner_id'])),
+        ('get_project_analyses', lambda i: ({'project_id': p_(i)['project_id']}, None)),
+        ('get_analyses_summary', lambda i: ({'offset': 0, 'limit': 100, 'sort_by': 'timestamp_modified', 'sort_order': 'desc'}, None)),
+        ('set_analysis_text_file', lambda i: ({'analysis_id': a_(i)['analysis_id'], 'name': 'description.md', 'text': f'# Analysis\n\nEdit {i}\n', 'edit_token': a_(i)['edit_token']}, a_(i)['owner_id'])),
+        ('set_analysis_status', lambda i: ({'analysis_id': none_analyses[0]['analysis_id'], 'status': 'queued' if i % 2 == 0 else 'none', 'edit_token': none_analyses[0]['edit_token']}, none_analyses[0]['owner_id'])),
+        ('delete_analysis', lambda i: ({'analysis_id': a_(i)['analysis_id'], 'edit_token': a_(i)['edit_token']}, a_(i)['owner_id'])),
+        ('undelete_analysis', lambda i: ({'analysis_id': a_(i)['analysis_id'], 'edit_token': a_(i)['edit_token']}, a_(i)['owner_id'])),
+        ('create_analysis', lambda i: ({}, a_(i)['owner_id'])),
+        ('clone_analysis', lambda i: ({'analysis_id': a_(i)['analysis_id']}, a_(i)['owner_id'])),
+        ('set_analysis_project', lambda i: ({'analysis_id': movable[i % len(movable)][0]['analysis_id'], 'project_id': movable[i % len(movable)][1]['project_id']}, movable[i % len(movable)][0]['owner_id'])),
+        ('set_project_text_file', lambda i: ({'project_id': p_(i)['project_id'], 'name': 'description.md', 'text': f'# Project\n\nEdit {i}\n'}, p_(i)['owner_id'])),
+        ('set_project_listed', lambda i: ({'project_id': p_(i)['project_id'], 'listed': i % 2 == 0}, p_(i)['owner_id'])),
+        ('create_project', lambda i: ({}, 'benchmark-user')),
+        ('delete_project', lambda i: ({'project_id': state['created_projects'][i]}, 'benchmark-user')),
+        ('compile_analysis_model', lambda i: ({'analysis_id': a_(i)['analysis_id']}, a_(i)['owner_id'])),
+        ('generate_analysis_data', lambda i: ({'analysis_id': a_(i)['analysis_id'], 'edit_token': a_(i)['edit_token'], 'access_code': access_code}, a_(i)['owner_id'])),
+        ('get_job_status', lambda i: ({'job_id': state['job_ids'][i % len(state['job_ids'])]}, None))
+    ]
+
+    ret = {}
+    for query_type, make_query in query_makers:
+        if query_type == 'set_analysis_project' and len(movable) == 0:
+            continue
+        _log(f'  {query_type}')
+        def run_query(i: int):
+            query, user_id = make_query(i)
+            query['type'] = query_type
+            with _quiet():
+                resp, _ = StanPlaygroundService.handle_query(query, dir='rtcshare://', user_id=user_id)
+            if not resp.get('success', False):
+                raise Exception(f'Query {query_type} failed: {resp.get("error", None)}')
+            if query_type == 'create_project':
+                state['created_projects'].append(resp['project_id'])
+            if 'jobId' in resp:
+                state['job_ids'].append(resp['jobId'])
+        ret[query_type] = _time_repeated(run_query, repeats=repeats)
+        if query_type == 'set_analysis_status' and repeats % 2 == 1:
+            # leave the analysis unqueued
+            run_query(repeats)
+    # let the background jobs finish before going on
+    _wait_for(lambda: all(get_job_status(job_id, dir=data_dir)['status'] in ['completed', 'failed'] for job_id in state['job_ids']), timeout=300)
+    return ret
+
+def _benchmark_worker(synthetic: dict, *, data_dir: str, num_samples: int) -> dict:
+    """Measure the time from queueing an analysis to the worker starting it, with an idle worker"""
+    _log('  worker enqueue-to-start latency')
+    analyses = [a for a in synthetic['analyses'] if a['status'] == 'none'][1:num_samples + 1]
+    log_path = f'{os.path.dirname(data_dir)}/worker.log'
+    with open(log_path, 'w') as log:
+        worker = subprocess.Popen(
+            [sys.executable, '-c', 'import stan_playground; stan_playground.start_processing(dir=".")'],
+            cwd=data_dir, stdout=log, stderr=subprocess.STDOUT,
+            # in its own process group, so that it can be stopped together with the analyses it runs
+            start_new_session=True
+        )
+    try:
+        # wait for the worker to be listening
+        _wait_for(lambda: os.path.exists(f'{data_dir}/.stan_playground_queue.fifo'), timeout=60)
+        time.sleep(0.5)
+        latencies = []
+        run_times = []
+        for a in analyses:
+            analysis_id = a['analysis_id']
+            timer = time.time()
+            with _quiet():
+                queue_analysis(analysis_id, dir=data_dir)
+            info = _wait_for(lambda: _get_info_if(analysis_id, data_dir, lambda x: x.get('timestamp_started', None) is not None), timeout=60)
+            latencies.append(info['timestamp_started'] - timer)
+            info = _wait_for(lambda: _get_info_if(analysis_id, data_dir, lambda x: x.get('status', None) in ['completed', 'failed']), timeout=300)
+            if info['status'] == 'failed':
+                raise Exception(f'Analysis {analysis_id} failed in the worker: {info.get("error", None)} (see {log_path})')
+            run_times.append(time.time() - timer)
+    finally:
+        os.killpg(worker.pid, signal.SIGTERM)
+        worker.wait()
+    return {
+        'enqueue_to_start_sec': _get_stats(latencies),
+        'enqueue_to_completed_sec': _get_stats(run_times)
+    }
+
+def _get_info_if(analysis_id: str, data_dir: str, condition: Callable[[dict], bool]) -> Union[dict, None]:
+    info = read_analysis_info(analysis_id, dir=data_dir)
+    return info if condition(info) else None
+
+def _wait_for(f: Callable, *, timeout: float):
+    timer = time.time()
+    while True:
+        x = f()
+        if x:
+            return x
+        if time.time() - timer > timeout:
+            raise Exception('Timeout while waiting for the worker')
+        time.sleep(0.002)
+
+def _time_once(f: Callable) -> float:
+    timer = time.perf_counter()
+    with _quiet():
+        f()
+    return time.perf_counter() - timer
+
+def _time_repeated(f: Callable[[int], None], *, repeats: int) -> dict:
+    elapsed = []
+    for i in range(repeats):
+        timer = time.perf_counter()
+        f(i)
+        elapsed.append(time.perf_counter() - timer)
+    return _get_stats(elapsed)
+
+def _get_stats(x: List[float]) -> dict:
+    x = sorted(x)
+    return {
+        'n': len(x),
+        'min': x[0],
+        'median': statistics.median(x),
+        'p90': x[min(len(x) - 1, int(0.9 * len(x)))],
+        'max': x[-1],
+        'mean': statistics.mean(x)
+    }
+
+@contextlib.contextmanager
+def _quiet():
+    # the service prints a line per request
+    with open(os.devnull, 'w') as f:
+        with contextlib.redirect_stdout(f):
+            yield
+
+def _get_git_commit() -> Union[str, None]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=_repo_dir, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def _log(msg: str):
+    print(msg, file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# A stand-in for cmdstanpy so that the worker loop can be benchmarked offline.
+# CmdStanModel.sample writes csv files in the CmdStan format with random
+# draws (after sleeping for STUB_SAMPLE_SEC) instead of running a sampler,
+# and cmdstan_path() points to a directory with a makefile that "compiles" a
+# model by writing an empty executable.
+
+import os
+import time
+import random
+
+
+def cmdstan_path() -> str:
+    return os.environ['STUB_CMDSTAN_DIR']
+
+class CmdStanModel:
+    def __init__(self, *, stan_file: str, exe_file: str):
+        self.stan_file = stan_file
+        self.exe_file = exe_file
+    def sample(self, *, data, output_dir: str, iter_sampling: int, iter_warmup: int, chains: int=4, seed=None, save_warmup: bool=True, show_console: bool=False, **kwargs):
+        time.sleep(float(os.environ.get('STUB_SAMPLE_SEC', 0)))
+        rng = random.Random(seed)
+        timestamp = time.strftime('%Y%m%d%H%M%S')
+        csv_files = []
+        for chain_id in range(1, chains + 1):
+            csv_file = f'{output_dir}/main-{timestamp}_{chain_id}.csv'
+            thin = kwargs.get('thin', None) or 1
+            num_warmup_draws = (iter_warmup + thin - 1) // thin if save_warmup else 0
+            num_draws = (iter_sampling + thin - 1) // thin + num_warmup_draws
+            with open(csv_file, 'w') as f:
+                f.write(f'# model = main_model\n# id = {chain_id}\n')
+                f.write('lp__,accept_stat__,stepsize__,theta\n')
+                for i in range(num_draws):
+                    if i == num_warmup_draws and iter_warmup > 0:
+                        f.write('# Adaptation terminated\n# Step size = 0.9\n# Diagonal elements of inverse mass matrix:\n# 1.1\n')
+                    f.write(f'{-rng.expovariate(1)},{rng.random()},0.9,{rng.gauss(0, 1)}\n')
+                f.write('# \n')
+                f.write('#  Elapsed Time: 0.001 seconds (Warm-up)\n')
+                f.write('#                0.001 seconds (Sampling)\n')
+                f.write('#                0.002 seconds (Total)\n')
+                f.write('# \n')
+            csv_files.append(csv_file)
+        return CmdStanMCMC(csv_files)
+
+class CmdStanMCMC:
+    def __init__(self, csv_files: list):
+        self.runset = RunSet(csv_files)
+
+class RunSet:
+    def __init__(self, csv_files: list):
+        self.csv_files = csv_files
@@ -0,0 +1,93 @@
+import os
+import time
+import random
+import string
+import yaml
+
+
+# Synthetic stan-playground data directories for the benchmarks
+
+STAN_PROGRAM = '''data {
+  int<lower=0> N;
+  vector[N] y;
+}
+parameters {
+  real theta;
+}
+model {
+  y ~ normal(theta, 1);
+}
+'''
+
+OPTIONS_YAML = 'iter_sampling: 100\niter_warmup: 100\nsave_warmup: True\nchains: 2\nseed: 0\n'
+
+def create_synthetic_data_dir(path: str, *, num_analyses: int, num_projects: int, num_users: int, seed: int=0) -> dict:
+    """Create a data directory with the given number of analyses and projects
+
+    Returns a description of what was created, which the benchmarks use to
+    pick the targets of their queries.
+    """
+    rng = random.Random(seed)
+    os.makedirs(f'{path}/analyses')
+    os.makedirs(f'{path}/projects')
+    user_ids = [f'user{i}' for i in range(num_users)]
+    timestamp = time.time()
+
+    projects = []
+    for _ in range(num_projects):
+        project_id = _random_id(rng, 8)
+        owner_id = rng.choice(user_ids)
+        project_dir = f'{path}/projects/{project_id}'
+        os.makedirs(project_dir)
+        with open(f'{project_dir}/project.yaml', 'w') as f:
+            yaml.safe_dump({
+                'owner_id': owner_id,
+                'listed': rng.random() < 0.5,
+                'timestamp_created': timestamp,
+                'timestamp_modified': timestamp,
+                'users': [{'user_id': u} for u in rng.sample(user_ids, min(3, len(user_ids)))]
+            }, f)
+        with open(f'{project_dir}/description.md', 'w') as f:
+            f.write(f'# Project {project_id}\n')
+        projects.append({'project_id': project_id, 'owner_id': owner_id})
+
+    analyses = []
+    for i in range(num_analyses):
+        analysis_id = _random_id(rng, 8)
+        owner_id = rng.choice(user_ids)
+        project_id = rng.choice(projects)['project_id'] if projects and rng.random() < 0.8 else None
+        edit_token = _random_id(rng, 12)
+        analysis_dir = f'{path}/analyses/{analysis_id}'
+        os.makedirs(analysis_dir)
+        with open(f'{analysis_dir}/main.stan', 'w') as f:
+            f.write(STAN_PROGRAM)
+        with open(f'{analysis_dir}/data.json', 'w') as f:
+            f.write('{"N": 3, "y": [0.1, -0.3, 1.2]}')
+        with open(f'{analysis_dir}/data.py', 'w') as f:
+            f.write('import json\njson.dump({"N": 3, "y": [0.1, -0.3, 1.2]}, open("data.json", "w"))\n')
+        with open(f'{analysis_dir}/description.md', 'w') as f:
+            f.write(f'# Analysis {i}\n\nA synthetic analysis.\n')
+        with open(f'{analysis_dir}/options.yaml', 'w') as f:
+            f.write(OPTIONS_YAML)
+        status = rng.choice(['none', 'none', 'completed', 'failed'])
+        with open(f'{analysis_dir}/analysis.yaml', 'w') as f:
+            yaml.safe_dump({
+                'status': status,
+                'owner_id': owner_id,
+                'project_id': project_id,
+                'listed': rng.random() < 0.7,
+                'timestamp_created': timestamp - rng.random() * 1e6,
+                'timestamp_modified': timestamp - rng.random() * 1e5
+            }, f)
+        with open(f'{analysis_dir}/.edit_token', 'w') as f:
+            f.write(edit_token)
+        analyses.append({'analysis_id': analysis_id, 'owner_id': owner_id, 'project_id': project_id, 'status': status, 'edit_token': edit_token})
+
+    return {
+        'user_ids': user_ids,
+        'projects': projects,
+        'analyses': analyses
+    }
+
+def _random_id(rng: random.Random, num_chars: int) -> str:
+    return ''.join(rng.choice(string.ascii_lowercase + string.digits) for _ in range(num_chars))
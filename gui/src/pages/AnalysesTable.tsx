@@ -2,42 +2,59 @@ import { FunctionComponent } from "react";
 import Hyperlink from "../components/Hyperlink";
 import useRoute from "../useRoute";
 import './scientific-table.css';
-import { AnalysisInfo } from "./AnalysisPage/useAnalysisData";
-import { Summary } from "./useSummary";
+import { AnalysesSortBy, AnalysisSummary } from "./useSummary";
 
 type Props = {
-    summary: Summary
+    analyses: AnalysisSummary[]
+    // if given, the analyses are sorted by the caller (e.g. on the server) and the headers are clickable
+    sortBy?: AnalysesSortBy
+    sortOrder?: 'asc' | 'desc'
+    onSetSort?: (sortBy: AnalysesSortBy, sortOrder: 'asc' | 'desc') => void
 }
 
-const AnalysesTable: FunctionComponent<Props> = ({summary}) => {
+const AnalysesTable: FunctionComponent<Props> = ({analyses: analyses0, sortBy, sortOrder, onSetSort}) => {
     const {setRoute} = useRoute()
 
     // const mcmcMonitorBaseUrl = useMcmcMonitorBaseUrl()
 
-    const analyses = [...(summary.analyses || [])]
-    analyses.sort((a, b) => {
-        if ((a.info.timestamp_modified) && (b.info.timestamp_modified)) {
-            if (a.info.timestamp_modified > b.info.timestamp_modified) return -1
-            if (a.info.timestamp_modified < b.info.timestamp_modified) return 1
-            return 0
-        }
-        else {
-            return 0
-        }
-    })
+    const analyses = [...analyses0]
+    if (!onSetSort) {
+        analyses.sort((a, b) => {
+            if ((a.timestamp_modified) && (b.timestamp_modified)) {
+                if (a.timestamp_modified > b.timestamp_modified) return -1
+                if (a.timestamp_modified < b.timestamp_modified) return 1
+                return 0
+            }
+            else {
+                return 0
+            }
+        })
+    }
+
+    const header = (label: string, key?: AnalysesSortBy) => {
+        if ((!onSetSort) || (!key)) return <th>{label}</th>
+        const arrow = sortBy === key ? (sortOrder === 'asc' ? ' \u25B2' : ' \u25BC') : ''
+        return (
+            <th>
+                <Hyperlink onClick={() => onSetSort(key, (sortBy === key) && (sortOrder === 'desc') ? 'asc' : 'desc')}>
+                    {label}{arrow}
+                </Hyperlink>
+            </th>
+        )
+    }
 
     return (
         <div>
             <table className="scientific-table">
                 <thead>
                     <tr>
-                        <th>Analysis</th>
-                        <th>Owner</th>
-                        <th>Project</th>
-                        <th>Status</th>
-                        <th>Elapsed</th>
-                        <th>Created</th>
-                        <th>Description</th>
+                        {header('Analysis', 'title')}
+                        {header('Owner', 'owner_id')}
+                        {header('Project')}
+                        {header('Status', 'status')}
+                        {header('Elapsed', 'run_elapsed_sec')}
+                        {header('Created', 'timestamp_created')}
+                        {header('Description')}
                     </tr>
                 </thead>
                 <tbody>
@@ -45,7 +62,7 @@ const AnalysesTable: FunctionComponent<Props> = ({summary}) => {
                         <tr key={analysis.analysis_id}>
                             <td>
                                 <Hyperlink onClick={() => setRoute({page: 'analysis', analysisId: analysis.analysis_id})}>
-                                    {analysis.title || getTitleFromMarkdown(analysis.description)}
+                                    {analysis.title || getTitleFromMarkdown(analysis.description || '') || analysis.analysis_id}
                                 </Hyperlink>
                             </td>
                             <td>
@@ -53,14 +70,14 @@ const AnalysesTable: FunctionComponent<Props> = ({summary}) => {
                             </td>
                             <td>
                                 {
-                                    analysis.info.project_id ? (
-                                        <Hyperlink onClick={() => setRoute({page: 'project', projectId: analysis.info.project_id || ''})}>
-                                            {analysis.info.project_id || ''}
+                                    analysis.project_id ? (
+                                        <Hyperlink onClick={() => setRoute({page: 'project', projectId: analysis.project_id || ''})}>
+                                            {analysis.project_id || ''}
                                         </Hyperlink>
                                     ) : <span />
                                 }
                             </td>
-                            <td>{analysis.status} {createTimestampText(analysis.info)}</td>
+                            <td>{analysis.status} {createTimestampText(analysis)}</td>
                             {/* <td>
                                 {
                                     mcmcMonitorBaseUrl ? (
@@ -71,12 +88,12 @@ const AnalysesTable: FunctionComponent<Props> = ({summary}) => {
                                 }
                             </td> */}
                             <td>
-                                {createElapsedText(analysis.info)}
+                                {createElapsedText(analysis)}
                             </td>
                             <td>
-                                {createTimestampCreatedText(analysis.info)}
+                                {createTimestampCreatedText(analysis)}
                             </td>
-                            <td><span style={{fontSize: 11}}>{abbreviateString(removeFirstHeaderLineInMarkdown(analysis.description), 200)}</span></td>
+                            <td><span style={{fontSize: 11}}>{abbreviateString(removeFirstHeaderLineInMarkdown(analysis.description || ''), 200)}</span></td>
                         </tr>
                     ))}
                 </tbody>
@@ -112,7 +129,18 @@ export function abbreviateString(s: string, maxLength: number) {
     else return s.slice(0, maxLength) + '...'
 }
 
-export function createTimestampText(info: AnalysisInfo) {
+// the status and timestamps of an analysis (from analysis.yaml or the summary index)
+type AnalysisTimestamps = {
+    status: string
+    timestamp_created?: number
+    timestamp_queued?: number
+    timestamp_started?: number
+    timestamp_completed?: number
+    timestamp_failed?: number
+    run_elapsed_sec?: number
+}
+
+export function createTimestampText(info: AnalysisTimestamps) {
     const status = info.status
     let ts: number | undefined
     if (status === 'queued') {
@@ -130,15 +158,18 @@ export function createTimestampText(info: AnalysisInfo) {
     if (ts === undefined) return ''
     return timeAgoString(ts)
 }
-export function createTimestampCreatedText(info: AnalysisInfo) {
+export function createTimestampCreatedText(info: AnalysisTimestamps) {
     const ts = info.timestamp_created
     if (ts === undefined) return ''
     return timeAgoString(ts)
 }
-export function createElapsedText(info: AnalysisInfo) {
+export function createElapsedText(info: AnalysisTimestamps) {
     const status = info.status
     let numSeconds: number | undefined
-    if (status === 'completed') {
+    if ((status === 'completed') && (info.run_elapsed_sec !== undefined)) {
+        numSeconds = info.run_elapsed_sec
+    }
+    else if (status === 'completed') {
         numSeconds = (info.timestamp_completed || 0) - (info.timestamp_started || 0)
     }
     else if (status === 'failed') {
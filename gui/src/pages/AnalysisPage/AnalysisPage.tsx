@@ -18,7 +18,7 @@ type Props = {
 
 const AnalysisPage: FunctionComponent<Props> = ({analysisId, width, height}) => {
     // important to do this here just once rather than separately in the various editors
-    const {mainStanText, dataJsonText, descriptionMdText, optionsYamlText, dataPyText, setDataPyText, analysisInfo, setMainStanText, setDataJsonText, setDescriptionMdText, setOptionsYamlText, refreshMainStanText, refreshDataJsonText, refreshDataPyText, refreshDescriptionMdText, refreshOptionsYamlText, setStatus, refreshAnalysisInfo} = useAnalysisData(analysisId)
+    const {mainStanText, dataJsonText, descriptionMdText, optionsYamlText, dataPyText, setDataPyText, analysisInfo, setMainStanText, setDataJsonText, setDescriptionMdText, setOptionsYamlText, refreshMainStanText, refreshDataJsonText, refreshDataPyText, refreshDescriptionMdText, refreshOptionsYamlText, setStatus, continueRun, refreshAnalysisInfo} = useAnalysisData(analysisId)
 
     useEffect(() => {
         if (analysisInfo) {
@@ -140,6 +140,7 @@ const AnalysisPage: FunctionComponent<Props> = ({analysisId, width, height}) =>
                     onRefreshStatus={refreshAnalysisInfo}
                     onQueueRun={handleQueueRun}
                     onDeleteRun={handleDeleteRun}
+                    onContinueRun={continueRun}
                 />
             </TabWidget>  
             </div>
@@ -8,6 +8,7 @@ import TextEditor, { ToolbarItem } from "../TextEditor"
 import { AnalysisInfo, useAnalysisTextFile } from "./useAnalysisData"
 import ConsoleOutputWindow from "./ConsoleOutputWindow"
 import { alert } from "../../confirm_prompt_alert"
+import waitForJob from "./waitForJob"
 
 type Props = {
     width: number
@@ -53,6 +54,12 @@ const DataGenerationTab: FunctionComponent<Props> = ({width, height, canEdit, da
                     setStatusBarMessage('Data generation failed')
                     throw Error(`Error generating data: ${result.error}`)
                 }
+                // data generation runs as a background job; refresh the console output while it runs
+                const job = await waitForJob(result.jobId, {onPoll: refreshDataConsoleText})
+                if (job.status === 'failed') {
+                    setStatusBarMessage('Data generation failed')
+                    throw Error(`Error generating data: ${job.error}`)
+                }
             } catch (err: any) {
                 refreshDataConsoleText()
                 setTimeout(() => {
@@ -1,7 +1,7 @@
 import { FunctionComponent, useEffect } from "react";
 import Hyperlink from "../../components/Hyperlink";
 import TextEditor from "../TextEditor";
-import { AnalysisInfo, useAnalysisTextFile } from "./useAnalysisData";
+import { AnalysisInfo, useConsoleOutput } from "./useAnalysisData";
 
 type Props = {
     width: number
@@ -12,17 +12,18 @@ type Props = {
     onRefreshStatus: () => void
     onQueueRun: () => void
     onDeleteRun: () => void
+    onContinueRun: () => void
 }
 
-const RunSamplerTab: FunctionComponent<Props> = ({width, height, canEdit, analysisId, analysisInfo, onRefreshStatus, onQueueRun, onDeleteRun}) => {
-    const {text: runConsoleText, refresh: refreshRunConsoleText} = useAnalysisTextFile(analysisId, analysisInfo, 'run.console.txt')
+const RunSamplerTab: FunctionComponent<Props> = ({width, height, canEdit, analysisId, analysisInfo, onRefreshStatus, onQueueRun, onDeleteRun, onContinueRun}) => {
+    const {text: runConsoleText, refresh: refreshRunConsoleText, fetchNewOutput: fetchNewRunConsoleOutput} = useConsoleOutput(analysisId, 'run.console.txt', analysisInfo?.status === 'running')
 
     const infoPanelWidth = Math.min(500, width / 2)
 
-    // whenever analysisInfo changes, refresh the run console text
+    // whenever analysisInfo changes, fetch the new run console output
     useEffect(() => {
-        refreshRunConsoleText()
-    }, [analysisInfo, refreshRunConsoleText])
+        fetchNewRunConsoleOutput()
+    }, [analysisInfo, fetchNewRunConsoleOutput])
 
     const infoPanel = (
         !analysisInfo ? (
@@ -44,6 +45,9 @@ const RunSamplerTab: FunctionComponent<Props> = ({width, height, canEdit, analys
                 <p>
                     Analysis run has completed.
                 </p>
+                {canEdit && (
+                    <p><Hyperlink onClick={onContinueRun}>Continue sampling</Hyperlink></p>
+                )}
                 {canEdit && (
                     <Hyperlink onClick={onDeleteRun}>Delete run</Hyperlink>
                 )}
@@ -1,6 +1,6 @@
 import { getFileData, serviceQuery, useSignedIn } from "@figurl/interface"
 import YAML from 'js-yaml'
-import { useCallback, useEffect, useMemo, useState } from "react"
+import { useCallback, useEffect, useMemo, useRef, useState } from "react"
 import { alert } from "../../confirm_prompt_alert"
 import { useStatusBar } from "../../StatusBar/StatusBarContext"
 import { getLocalStorageAnalysisEditToken } from "../localStorageAnalyses"
@@ -60,6 +60,56 @@ export const useAnalysisTextFile = (analysisId: string, analysisInfo: AnalysisIn
     return {text: internalText, refresh, setText}
 }
 
+// Console output is fetched incrementally: each poll only transfers the bytes
+// written since the previous one (starting with the tail of the file)
+export const useConsoleOutput = (analysisId: string, name: string, poll: boolean) => {
+    const [text, setText] = useState<string | undefined>(undefined)
+    const state = useRef<{offset: number, fileId: string | null, decoder: TextDecoder}>({offset: 0, fileId: null, decoder: new TextDecoder()})
+    const fetching = useRef(false)
+    const fetchNewOutput = useCallback(async () => {
+        if (fetching.current) return
+        fetching.current = true
+        try {
+            const s = state.current
+            const {result, binaryPayload} = await serviceQuery('stan-playground', {
+                type: 'get_console_output',
+                analysis_id: analysisId,
+                name,
+                offset: s.offset,
+                file_id: s.fileId,
+                tail: 256 * 1024
+            })
+            if (!result.success) throw Error(result.error)
+            if (state.current !== s) return // reset while fetching
+            const reset = result.reset || (s.offset === 0)
+            if (reset) s.decoder = new TextDecoder()
+            const newText = binaryPayload ? s.decoder.decode(binaryPayload, {stream: true}) : ''
+            s.offset = result.end
+            s.fileId = result.file_id
+            setText(t => (reset ? newText : (t || '') + newText))
+        }
+        catch (err) {
+            console.warn(err)
+        }
+        finally {
+            fetching.current = false
+        }
+    }, [analysisId, name])
+    const refresh = useCallback(() => {
+        state.current = {offset: 0, fileId: null, decoder: new TextDecoder()}
+        fetchNewOutput()
+    }, [fetchNewOutput])
+    useEffect(() => {
+        refresh()
+    }, [refresh])
+    useEffect(() => {
+        if (!poll) return
+        const timer = setInterval(fetchNewOutput, 3000)
+        return () => {clearInterval(timer)}
+    }, [poll, fetchNewOutput])
+    return {text, refresh, fetchNewOutput}
+}
+
 const useAnalysisData = (analysisId: string) => {
     const {text: analysisInfoText, refresh: refreshAnalysisInfo} = useAnalysisTextFile(analysisId, undefined, 'analysis.yaml')
     const analysisInfo = useMemo(() => {
@@ -112,6 +162,35 @@ const useAnalysisData = (analysisId: string) => {
             }
         })()
     }, [analysisId, refreshAnalysisInfo, setStatusBarMessage, userId, analysisInfo?.owner_id])
+
+    // run more iterations from where the completed run left off
+    const continueRun = useCallback(() => {
+        (async () => {
+            if ((analysisInfo?.owner_id) && (analysisInfo.owner_id !== userId?.toString())) {
+                await alert(`You cannot perform this action because this analysis is owned by by ${analysisInfo.owner_id}.`)
+                return
+            }
+            try {
+                const {result} = await serviceQuery('stan-playground', {
+                    type: 'continue_analysis',
+                    analysis_id: analysisId,
+                    edit_token: getLocalStorageAnalysisEditToken(analysisId)
+                }, {
+                    includeUserId: true
+                })
+                if (!result.success) {
+                    throw new Error(result.error)
+                }
+            }
+            catch(err: any) {
+                setStatusBarMessage(err.message)
+                await alert(err.message)
+            }
+            finally {
+                refreshAnalysisInfo()
+            }
+        })()
+    }, [analysisId, refreshAnalysisInfo, setStatusBarMessage, userId, analysisInfo?.owner_id])
     
     return {
         mainStanText,
@@ -131,6 +210,7 @@ const useAnalysisData = (analysisId: string) => {
         refreshOptionsYamlText,
         refreshDataPyText,
         setStatus,
+        continueRun,
         refreshAnalysisInfo
     }
 }
@@ -0,0 +1,37 @@
+import { serviceQuery } from "@figurl/interface"
+
+export type JobStatus = {
+    job_id: string
+    job_type: string
+    analysis_id: string
+    status: 'queued' | 'running' | 'completed' | 'failed'
+    error: string | null
+    timestamp_submitted: number
+    timestamp_started: number | null
+    timestamp_finished: number | null
+}
+
+// Poll a background job (compile or data generation) until it has finished
+const waitForJob = async (jobId: string, o: {onPoll?: () => void, pollIntervalMsec?: number} = {}): Promise<JobStatus> => {
+    const pollIntervalMsec = o.pollIntervalMsec || 1000
+    // eslint-disable-next-line no-constant-condition
+    while (true) {
+        const {result} = await serviceQuery('stan-playground', {
+            type: 'get_job_status',
+            job_id: jobId
+        }, {
+            includeUserId: true
+        })
+        if (!result.success) {
+            throw Error(`Error getting job status: ${result.error}`)
+        }
+        const job = result.job as JobStatus
+        if ((job.status === 'completed') || (job.status === 'failed')) {
+            return job
+        }
+        o.onPoll && o.onPoll()
+        await new Promise(resolve => setTimeout(resolve, pollIntervalMsec))
+    }
+}
+
+export default waitForJob
@@ -1,5 +1,5 @@
 import { serviceQuery, useSignedIn } from "@figurl/interface";
-import { FunctionComponent, useCallback, useMemo } from "react";
+import { FunctionComponent, useCallback, useMemo, useState } from "react";
 import { alert, confirm } from '../confirm_prompt_alert';
 import Hyperlink from "../components/Hyperlink";
 import { useStatusBar } from "../StatusBar/StatusBarContext";
@@ -7,15 +7,23 @@ import useRoute from "../useRoute";
 import AnalysesTable from "./AnalysesTable";
 import { addLocalStorageAnalysis, getLocalStorageAnalyses } from "./localStorageAnalyses";
 import ProjectsTable from "./ProjectsTable";
-import useSummary, { Summary } from "./useSummary";
+import useSummary, { AnalysesSortBy, AnalysisSummary } from "./useSummary";
 
 type Props = {
     width: number
     height: number
 }
 
+const analysesPageSize = 50
+
 const Home: FunctionComponent<Props> = ({width, height}) => {
-    const {summary, refreshSummary} = useSummary()
+    const [analysesOffset, setAnalysesOffset] = useState(0)
+    const [analysesSort, setAnalysesSort] = useState<{sortBy: AnalysesSortBy, sortOrder: 'asc' | 'desc'}>({sortBy: 'timestamp_modified', sortOrder: 'desc'})
+    const {page: summaryPage, refreshSummary} = useSummary({offset: analysesOffset, limit: analysesPageSize, ...analysesSort})
+    const handleSetAnalysesSort = useCallback((sortBy: AnalysesSortBy, sortOrder: 'asc' | 'desc') => {
+        setAnalysesSort({sortBy, sortOrder})
+        setAnalysesOffset(0)
+    }, [])
 
     const {setStatusBarMessage} = useStatusBar()
 
@@ -72,23 +80,18 @@ const Home: FunctionComponent<Props> = ({width, height}) => {
 
     const padding = 20
 
-    const summaryFromLocalStorage: Summary = useMemo(() => {
+    const analysesFromLocalStorage: AnalysisSummary[] = useMemo(() => {
         const lsAnalyses = getLocalStorageAnalyses()
-        return {
-            analyses: lsAnalyses.map(a => ({
-                analysis_id: a.analysisId,
-                title: '',
-                status: a.analysisInfo?.status || 'undefined',
-                owner_id: a.analysisInfo?.owner_id || '',
-                data_size: 0,
-                info: a.analysisInfo || {status: 'none'},
-                description: a.descriptionMdText || '',
-                stan_program: '',
-                options: {}
-            }))
-        }
+        return lsAnalyses.map(a => ({
+            ...(a.analysisInfo || {}),
+            analysis_id: a.analysisId,
+            title: '',
+            status: a.analysisInfo?.status || 'undefined',
+            owner_id: a.analysisInfo?.owner_id || '',
+            description: a.descriptionMdText || ''
+        }))
     // eslint-disable-next-line react-hooks/exhaustive-deps
-    }, [summary]) // when summary is updated, we want to update this too
+    }, [summaryPage]) // when the summary is updated, we want to update this too
 
     return (
         <div style={{position: 'absolute', left: padding, top: padding, width: width - padding * 2, height: height - padding * 2, overflowY: 'auto'}}>
@@ -108,8 +111,26 @@ const Home: FunctionComponent<Props> = ({width, height}) => {
             {
                 <ProjectsTable mode="user" />
             }
+            <h3>Public analyses</h3>
+            {
+                summaryPage ? (
+                    <div>
+                        <AnalysesTable
+                            analyses={summaryPage.analyses}
+                            sortBy={analysesSort.sortBy}
+                            sortOrder={analysesSort.sortOrder}
+                            onSetSort={handleSetAnalysesSort}
+                        />
+                        <div style={{paddingTop: 5}}>
+                            {summaryPage.total > 0 ? `${summaryPage.offset + 1}-${summaryPage.offset + summaryPage.analyses.length} of ${summaryPage.total}` : 'No public analyses'}
+                            {analysesOffset > 0 && <span>&nbsp;|&nbsp;<Hyperlink onClick={() => setAnalysesOffset(Math.max(0, analysesOffset - analysesPageSize))}>Previous</Hyperlink></span>}
+                            {analysesOffset + analysesPageSize < summaryPage.total && <span>&nbsp;|&nbsp;<Hyperlink onClick={() => setAnalysesOffset(analysesOffset + analysesPageSize)}>Next</Hyperlink></span>}
+                        </div>
+                    </div>
+                ) : <span>Loading analyses...</span>
+            }
             <h3>Your recent analyses</h3>
-            <AnalysesTable summary={summaryFromLocalStorage} />
+            <AnalysesTable analyses={analysesFromLocalStorage} />
         </div>
     )
 }
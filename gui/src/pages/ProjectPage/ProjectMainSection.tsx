@@ -6,7 +6,7 @@ import { useStatusBar } from "../../StatusBar/StatusBarContext";
 import useRoute from "../../useRoute";
 import AnalysesTable, { getTitleFromMarkdown } from "../AnalysesTable";
 import { AnalysisInfo } from "../AnalysisPage/useAnalysisData";
-import { Summary } from "../useSummary";
+import { AnalysisSummary } from "../useSummary";
 import useProjectData from "./useProjectData";
 
 type Props = {
@@ -50,20 +50,13 @@ const ProjectPageMainSection: FunctionComponent<Props> = ({projectId, width, hei
 
     const {setRoute} = useRoute()
 
-    const summary: Summary = useMemo(() => {
-        return {
-            analyses: (analyses || []).map(a => ({
-                analysis_id: a.analysis_id,
-                title: getTitleFromMarkdown(a.description),
-                status: a.config.status,
-                owner_id: a.config.owner_id,
-                data_size: 0,
-                info: a.config,
-                description: a.description,
-                stan_program: '',
-                options: {}
-            }))
-        }
+    const analysisSummaries: AnalysisSummary[] = useMemo(() => {
+        return (analyses || []).map(a => ({
+            ...a.config,
+            analysis_id: a.analysis_id,
+            title: getTitleFromMarkdown(a.description),
+            description: a.description
+        }))
     }, [analyses])
 
     const handleCreateNewAnalysis = useCallback(() => {
@@ -149,7 +142,7 @@ const ProjectPageMainSection: FunctionComponent<Props> = ({projectId, width, hei
                     <Hyperlink onClick={handleCreateNewAnalysis}>Create new analysis</Hyperlink>
                 </div>
                 <AnalysesTable
-                    summary={summary}
+                    analyses={analysisSummaries}
                 />
             </div>
         </div>
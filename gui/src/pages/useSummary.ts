@@ -1,37 +1,134 @@
-import { getFileData } from "@figurl/interface"
-import { useCallback, useEffect, useState } from "react"
+import { serviceQuery } from "@figurl/interface"
+import { useCallback, useEffect, useRef, useState } from "react"
 import { AnalysisInfo } from "./AnalysisPage/useAnalysisData"
 
-export type Summary = {
-    analyses: {
-        analysis_id: string
-        title: string
-        status: string
-        owner_id?: string
-        data_size: number
-        info: AnalysisInfo
-        description: string
-        stan_program: string
-        options: any
-    }[]
+// An entry of the summary index of the listed analyses. The full details of
+// each analysis are in summary/analyses/<analysis_id>.json
+export type AnalysisSummary = {
+    analysis_id: string
+    title: string
+    status: string
+    owner_id?: string
+    project_id?: string
+    data_size?: number
+    description_size?: number
+    stan_program_size?: number
+    data_python_program_size?: number
+    timestamp_created?: number
+    timestamp_modified?: number
+    timestamp_queued?: number
+    timestamp_started?: number
+    timestamp_completed?: number
+    timestamp_failed?: number
+    run_elapsed_sec?: number
+    run_cpu_sec?: number
+    run_peak_rss_bytes?: number
+    // not in the index; available for the analyses of a project or of the local storage
+    description?: string
 }
 
-const useSummary = () => {
-    const [summary, setSummary] = useState<Summary | undefined>(undefined)
+export type AnalysesSortBy = 'analysis_id' | 'title' | 'status' | 'owner_id' | 'timestamp_created' | 'timestamp_modified' | 'run_elapsed_sec' | 'run_cpu_sec'
+
+export type AnalysesSummaryPage = {
+    total: number
+    offset: number
+    analyses: AnalysisSummary[]
+}
+
+type ChangeLogEntry = {
+    version: number
+    kind: 'analysis' | 'project'
+    id: string
+    timestamp: number
+    data: (AnalysisInfo & {deleted?: boolean}) | null
+}
+
+const changesPollIntervalMsec = 5000
+
+// One page of the listed analyses, sorted on the server
+const useSummary = (o: {offset: number, limit: number, sortBy: AnalysesSortBy, sortOrder: 'asc' | 'desc'}) => {
+    const {offset, limit, sortBy, sortOrder} = o
+    const [page, setPage] = useState<AnalysesSummaryPage | undefined>(undefined)
     const [refreshCode, setRefreshCode] = useState(0)
+    const pageRef = useRef<AnalysesSummaryPage | undefined>(undefined)
     useEffect(() => {
-        setSummary(undefined)
+        pageRef.current = page
+    }, [page])
+    useEffect(() => {
+        let canceled = false
         ;(async () => {
-            const s = await getFileData(`$dir/stan_playground_summary.json`, () => {}, {responseType: 'json'})
-            setSummary(s)
+            const {result} = await serviceQuery('stan-playground', {
+                type: 'get_analyses_summary',
+                offset,
+                limit,
+                sort_by: sortBy,
+                sort_order: sortOrder
+            })
+            if (canceled) return
+            if (!result.success) {
+                console.warn(result.error)
+                return
+            }
+            setPage({total: result.total, offset: result.offset, analyses: result.analyses})
         })()
-    }, [refreshCode])
+        return () => {canceled = true}
+    }, [offset, limit, sortBy, sortOrder, refreshCode])
 
     const refreshSummary = useCallback(() => {
         setRefreshCode(c => (c + 1))
     }, [])
 
-    return {summary, refreshSummary}
+    // poll the change feed, and reload the page when an analysis on it has
+    // changed or when an analysis may have entered the listing
+    useEffect(() => {
+        let canceled = false
+        ;(async () => {
+            let version: number | undefined = undefined
+            while (!canceled) {
+                try {
+                    if (version !== undefined) {
+                        await new Promise(resolve => setTimeout(resolve, changesPollIntervalMsec))
+                        if (canceled) return
+                    }
+                    const {result} = await serviceQuery('stan-playground', {
+                        type: 'get_changes_since',
+                        since: version !== undefined ? version : -1
+                    }, {
+                        includeUserId: true
+                    })
+                    if (canceled) return
+                    if (!result.success) throw Error(result.error)
+                    if (version === undefined) {
+                        // the first call only gets the current version
+                        version = result.version
+                        continue
+                    }
+                    version = result.version
+                    if (result.reset) {
+                        setRefreshCode(c => (c + 1))
+                        continue
+                    }
+                    const p = pageRef.current
+                    const changed = (result.changes as ChangeLogEntry[]).some(c => (
+                        (c.kind === 'analysis') && (
+                            ((p) && (p.analyses.some(a => (a.analysis_id === c.id)))) ||
+                            ((c.data) && (c.data.listed) && (!c.data.deleted))
+                        )
+                    ))
+                    if (changed) {
+                        setRefreshCode(c => (c + 1))
+                    }
+                }
+                catch (err) {
+                    console.warn(err)
+                    await new Promise(resolve => setTimeout(resolve, 10000))
+                }
+            }
+        })()
+        return () => {canceled = true}
+    }, [])
+
+    return {page, refreshSummary}
 }
 
-export default useSummary
\ No newline at end of file
+export default useSummary
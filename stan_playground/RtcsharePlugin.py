@@ -1,12 +1,21 @@
 from typing import Tuple, Union
 from .query_handlers.project_query_handlers import handle_get_projects, handle_create_project, handle_delete_project, handle_set_analysis_project, handle_get_project_analyses, handle_set_project_text_file, handle_set_project_listed
-from .query_handlers.analysis_query_handlers import handle_clone_analysis, handle_compile_analysis_model, handle_create_analysis, handle_delete_analysis, handle_generate_analysis_data, handle_set_analysis_status, handle_set_analysis_text_file, handle_undelete_analysis
+from .query_handlers.analysis_query_handlers import handle_clone_analysis, handle_compile_analysis_model, handle_continue_analysis, handle_create_analysis, handle_delete_analysis, handle_generate_analysis_data, handle_get_analyses_summary, handle_get_console_output, handle_get_job_status, handle_set_analysis_status, handle_set_analysis_text_file, handle_undelete_analysis
+from .query_handlers.change_query_handlers import handle_get_changes_since
 from ._get_full_path import _get_full_path
+from .create_summary import deferred_summary_updates
+from .jobs import warm_up_job_pool
+from .metadata_cache import metadata_snapshot
+
+
+MAX_BATCH_SIZE = 1000
 
 
 class RtcsharePlugin:
     def initialize(context):
         context.register_service('stan-playground', StanPlaygroundService)
+        # so that the first data.py run does not wait for the pool to start
+        warm_up_job_pool()
 
 class StanPlaygroundService:
     def handle_query(query: dict, *, dir: str, user_id: Union[str, None]=None) -> Tuple[dict, bytes]:
@@ -16,6 +25,8 @@ class StanPlaygroundService:
         try:
             if type0 == 'test':
                 return {'success': True}, b''
+            elif type0 == 'batch':
+                return _handle_batch(query, dir=dir, user_id=user_id)
             
             elif type0 == 'get_listed_projects':
                 return handle_get_projects(query, dir=dir, user_id=user_id, listed_only=True, filter_by_user=None)
@@ -38,6 +49,8 @@ class StanPlaygroundService:
                 return handle_set_analysis_text_file(query, dir=dir, user_id=user_id)
             elif type0 == 'set_analysis_status':
                 return handle_set_analysis_status(query, dir=dir, user_id=user_id)
+            elif type0 == 'continue_analysis':
+                return handle_continue_analysis(query, dir=dir, user_id=user_id)
             elif type0 == 'clone_analysis':
                 return handle_clone_analysis(query, dir=dir, user_id=user_id)
             elif type0 == 'delete_analysis':
@@ -52,11 +65,41 @@ class StanPlaygroundService:
                 return handle_generate_analysis_data(query, dir=dir, user_id=user_id)
             elif type0 == 'compile_analysis_model':
                 return handle_compile_analysis_model(query, dir=dir, user_id=user_id)
+            elif type0 == 'get_analyses_summary':
+                return handle_get_analyses_summary(query, dir=dir, user_id=user_id)
+            elif type0 == 'get_console_output':
+                return handle_get_console_output(query, dir=dir, user_id=user_id)
+            elif type0 == 'get_job_status':
+                return handle_get_job_status(query, dir=dir, user_id=user_id)
+            elif type0 == 'get_changes_since':
+                return handle_get_changes_since(query, dir=dir, user_id=user_id)
             else:
                 raise Exception(f'Unexpected query type: {type0}')
         except Exception as e:
             return {'success': False, 'error': str(e)}, b''
 
+def _handle_batch(query: dict, *, dir: str, user_id: Union[str, None]=None) -> Tuple[dict, bytes]:
+    # The sub-queries run in order and each one succeeds or fails on its own.
+    # They share the parsed metadata files, and the summary is updated once
+    # at the end rather than after each of them.
+    queries = query['queries']
+    if not isinstance(queries, list):
+        raise Exception('Unexpected queries for batch: not a list')
+    if len(queries) > MAX_BATCH_SIZE:
+        raise Exception(f'Too many queries in batch: {len(queries)} > {MAX_BATCH_SIZE}')
+    for q in queries:
+        if not isinstance(q, dict):
+            raise Exception('Unexpected query in batch: not an object')
+        # there is no slot for the binary payload of a sub-query, and a long-poll would hold up the others
+        if q.get('type', None) in ['batch', 'get_console_output', 'get_changes_since']:
+            raise Exception(f'Query type not allowed in batch: {q["type"]}')
+    results = []
+    with metadata_snapshot(), deferred_summary_updates(dir=_get_full_path('$dir', dir=dir)):
+        for q in queries:
+            result, _ = StanPlaygroundService.handle_query(q, dir=dir, user_id=user_id)
+            results.append(result)
+    return {'success': True, 'results': results}, b''
+
 # def _get_new_analysis_id(*, dir: str) -> str:
 #     i = 1
 #     while True:
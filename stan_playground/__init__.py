@@ -1,5 +1,7 @@
 from .RtcsharePlugin import RtcsharePlugin
 from .queue_analysis import queue_analysis
 from .start_processing import start_processing
-from .create_summary import create_summary
-from .generate_access_code import generate_access_code
\ No newline at end of file
+from .create_summary import create_summary, update_analysis_summary
+from .generate_access_code import generate_access_code
+from .metadata_index import rebuild_index
+from .blob_store import collect_blob_garbage
\ No newline at end of file
@@ -0,0 +1,97 @@
+import os
+import stat
+import shutil
+import hashlib
+
+
+# Large files of analyses that are never modified in place (data.json and
+# data.npz are only ever replaced by renaming, see write_text_atomic and
+# make_private_copy) are shared between an analysis and its clones by
+# hardlinks into a content-addressed store in the data directory:
+#
+#   .blobs/<sha256 of the content>
+#
+# The blobs are read-only. A large file is interned (hashed and linked into
+# the store) when it is written: data.json when it is set through the service,
+# data.json and data.npz when they are generated by data.py, and the data
+# converted from data.npz. Cloning an interned file is a hardlink, in
+# constant time; a file written before interning existed is interned on its
+# first clone. Replacing the file in one analysis gives that analysis a
+# private copy and leaves the others untouched.
+
+BLOB_MIN_BYTES = int(os.environ.get('STAN_PLAYGROUND_BLOB_MIN_BYTES', 64 * 1024))
+
+def clone_file(src: str, dst: str, *, dir: str):
+    """Copy a file, sharing its content through the blob store if it is large"""
+    st = os.stat(src)
+    if st.st_size < BLOB_MIN_BYTES:
+        shutil.copy2(src, dst)
+        return
+    if not _is_interned(st):
+        _intern_file(src, dir=dir)
+    try:
+        os.link(src, dst)
+    except OSError:
+        # e.g. on a different file system
+        shutil.copy2(src, dst)
+
+def intern_file(path: str, *, dir: str):
+    """Replace a large file by a link into the blob store, so that cloning it is a hardlink"""
+    if not os.path.exists(path):
+        return
+    st = os.stat(path)
+    if st.st_size < BLOB_MIN_BYTES or _is_interned(st):
+        return
+    _intern_file(path, dir=dir)
+
+def collect_blob_garbage(*, dir: str) -> int:
+    """Remove the blobs that are no longer linked from any analysis; returns the number of bytes freed"""
+    blobs_dir = f'{dir}/.blobs'
+    if not os.path.exists(blobs_dir):
+        return 0
+    freed = 0
+    for name in os.listdir(blobs_dir):
+        path = f'{blobs_dir}/{name}'
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if '.tmp-' in name or st.st_nlink <= 1:
+            os.remove(path)
+            freed += st.st_size
+    return freed
+
+def _is_interned(st: os.stat_result) -> bool:
+    # blobs are read-only and linked from the store
+    return st.st_nlink > 1 and not st.st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+
+def _intern_file(path: str, *, dir: str):
+    # replace the file by a link to the blob with the same content, adding the blob if needed
+    blobs_dir = f'{dir}/.blobs'
+    os.makedirs(blobs_dir, exist_ok=True)
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            h.update(chunk)
+    blob_path = f'{blobs_dir}/{h.hexdigest()}'
+    if not os.path.exists(blob_path):
+        tmp_path = f'{blob_path}.tmp-{os.getpid()}'
+        try:
+            os.link(path, tmp_path)
+        except OSError:
+            shutil.copyfile(path, tmp_path)
+        os.chmod(tmp_path, 0o444)
+        os.rename(tmp_path, blob_path)
+    if os.stat(blob_path).st_ino == os.stat(path).st_ino:
+        # the blob was added from this file (renaming a link onto the same file would do nothing)
+        return
+    # an identical blob already exists (e.g. from another upload of the same data)
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    try:
+        os.link(blob_path, tmp_path)
+    except OSError:
+        return
+    os.rename(tmp_path, path)
@@ -0,0 +1,39 @@
+import os
+import fcntl
+from contextlib import contextmanager
+
+
+# Helpers shared by the content-addressed caches in the data directory
+# (compiled models in .model_cache, generated data in .data_cache) and by the
+# other content hashes (the saved sampler state of warm starts). A cache
+# entry is a directory named by its key, next to a <key>.lock file.
+
+@contextmanager
+def cache_entry_lock(cache_dir: str, key: str, *, blocking: bool=True):
+    """Lock a cache entry; yields False if blocking is False and the entry is locked by someone else"""
+    with open(f'{cache_dir}/{key}.lock', 'w') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def canonicalize_stan_source(source: str) -> str:
+    """Normalize a Stan program for hashing; line endings and trailing whitespace do not affect the compiled model"""
+    lines = [line.rstrip() for line in source.replace('\r\n', '\n').replace('\r', '\n').split('\n')]
+    return '\n'.join(lines).strip('\n') + '\n'
+
+def get_dir_size(path: str) -> int:
+    """Total size of the files in a directory tree (files removed during the walk are skipped)"""
+    size = 0
+    for root, _, files in os.walk(path):
+        for fname in files:
+            try:
+                size += os.path.getsize(f'{root}/{fname}')
+            except FileNotFoundError:
+                pass
+    return size
@@ -1,57 +1,220 @@
 import os
 import sys
-import logging
-from logging import Logger
+import time
+import queue
+import select
+import threading
+from collections import deque
 from contextlib import contextmanager
+from typing import List, Union
 
-def setup_logger(output_file: str):
-    if os.path.exists(output_file):
-        os.remove(output_file)
-    
-    logger = logging.getLogger('spike_sorting')
-    
-    while logger.hasHandlers():
-        logger.removeHandler(logger.handlers[0])
 
-    logger.setLevel(logging.DEBUG)
+# The console output of a run (cmdstan progress lines, printed by cmdstanpy,
+# and anything else written by the worker or its child processes) is captured
+# at the file descriptor level: stdout and stderr of the worker process, which
+# runs a single analysis, are pointed at a pipe that is drained by a reader
+# thread. The lines are timestamped and written to run.console.txt by a
+# writer thread, so a slow disk never blocks the sampler.
+#
+# The file is bounded: when it exceeds CONSOLE_MAX_BYTES it is rotated to
+# run.console.txt.1 and replaced by its first CONSOLE_HEAD_BYTES (the
+# configuration and the start of warmup) and its last CONSOLE_TAIL_BYTES,
+# with a line noting how much was omitted in between.
+#
+# The capture is per process, on purpose: cmdstanpy reads the output pipes
+# of the cmdstan processes itself and prints their lines, so there is no pipe
+# of the sampler to pass in. The worker process (see process_analysis) runs
+# a single analysis, and everything it and its children print belongs to the
+# run. Only one capture can be active in a process.
 
-    formatter = logging.Formatter('%(asctime)s - %(message)s')
+CONSOLE_MAX_BYTES = int(os.environ.get('STAN_PLAYGROUND_CONSOLE_MAX_BYTES', 4 * 1024 * 1024))
+CONSOLE_HEAD_BYTES = int(os.environ.get('STAN_PLAYGROUND_CONSOLE_HEAD_BYTES', 256 * 1024))
+CONSOLE_TAIL_BYTES = int(os.environ.get('STAN_PLAYGROUND_CONSOLE_TAIL_BYTES', 1024 * 1024))
+CONSOLE_RING_LINES = 1000
 
-    # Add console handler
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.DEBUG)
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+_capture_active = False
 
-    # Add file handler
-    file_handler = logging.FileHandler(output_file)
-    file_handler.setLevel(logging.DEBUG)
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
-
-    return logger
+class ConsoleSink:
+    """Writes console output to a size-capped file in a background thread, keeping the last lines in memory"""
+    def __init__(self, path: str, *, echo_fd: Union[int, None]=None):
+        self._path = path
+        self._echo_fd = echo_fd
+        self._queue: 'queue.SimpleQueue[Union[bytes, None]]' = queue.SimpleQueue()
+        self._ring: deque = deque(maxlen=CONSOLE_RING_LINES)
+        self._ring_lock = threading.Lock()
+        self._partial = b''
+        self._num_omitted_bytes = 0
+        self._head: Union[bytes, None] = None
+        self._kept_size = 0
+        for p in [path, f'{path}.1']:
+            if os.path.exists(p):
+                os.remove(p)
+        self._file = open(path, 'ab')
+        self._size = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    def write(self, data: bytes):
+        """Queue output for writing; never blocks"""
+        self._queue.put(data)
+    def tail(self, num_lines: int) -> List[str]:
+        """Return the last lines of output (up to CONSOLE_RING_LINES)"""
+        with self._ring_lock:
+            lines = list(self._ring)
+        return lines[-num_lines:] if num_lines > 0 else []
+    def close(self):
+        """Write out the queued output and close the file"""
+        self._queue.put(None)
+        self._thread.join()
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            # write everything that is queued in one go
+            chunks = [data]
+            done = False
+            while True:
+                try:
+                    data = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if data is None:
+                    done = True
+                    break
+                chunks.append(data)
+            self._write_lines(b''.join(chunks))
+            if done:
+                break
+        if self._partial:
+            self._write_lines(b'\n')
+        self._file.close()
+    def _write_lines(self, data: bytes):
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        if len(lines) == 0:
+            return
+        t = time.time()
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t)) + f',{int(t * 1000) % 1000:03d}'
+        out = []
+        for line in lines:
+            line = line.rstrip(b'\r').decode('utf-8', errors='replace')
+            if line.strip() == '':
+                continue
+            out.append(f'{timestamp} - {line}\n')
+        if len(out) == 0:
+            return
+        with self._ring_lock:
+            self._ring.extend(x.rstrip('\n') for x in out)
+        buf = ''.join(out).encode('utf-8')
+        if self._echo_fd is not None:
+            try:
+                os.write(self._echo_fd, buf)
+            except OSError:
+                pass
+        self._file.write(buf)
+        self._file.flush()
+        self._size += len(buf)
+        if self._size > CONSOLE_MAX_BYTES:
+            self._rotate()
+    def _rotate(self):
+        self._file.close()
+        with open(self._path, 'rb') as f:
+            if self._head is None:
+                head = f.read(CONSOLE_HEAD_BYTES)
+                self._head = head[:head.rfind(b'\n') + 1]
+                self._kept_size = len(self._head)
+            # the head and the note of the previous rotation are not part of the tail
+            start = max(self._size - CONSOLE_TAIL_BYTES, self._kept_size)
+            f.seek(start)
+            tail = f.read()
+        if start > self._kept_size and b'\n' in tail:
+            # cut at a line boundary
+            tail = tail[tail.index(b'\n') + 1:]
+        self._num_omitted_bytes += self._size - self._kept_size - len(tail)
+        note = f'... {self._num_omitted_bytes} bytes of console output omitted ...\n'.encode('utf-8')
+        tmp_path = f'{self._path}.tmp-{os.getpid()}'
+        with open(tmp_path, 'wb') as f:
+            f.write(self._head + note + tail)
+        # the previous version stays available as run.console.txt.1
+        rotated_tmp_path = f'{self._path}.1.tmp-{os.getpid()}'
+        os.link(self._path, rotated_tmp_path)
+        os.rename(rotated_tmp_path, f'{self._path}.1')
+        os.rename(tmp_path, self._path)
+        self._file = open(self._path, 'ab')
+        self._kept_size = len(self._head) + len(note)
+        self._size = self._kept_size + len(tail)
 
 @contextmanager
-def capture_console_output(logger: Logger):
-    class LoggerWriter:
-        def __init__(self, logger, level):
-            self.logger = logger
-            self.level = level
-
-        def write(self, message):
-            if message.rstrip() != "":
-                self.logger.log(self.level, message.rstrip())
+def capture_console_output(path: str):
+    """Send the stdout and stderr of this process, including those of child processes, to a ConsoleSink
 
-        def flush(self):
-            pass
+    Yields the sink. The output is also echoed to the original stdout. This
+    must only be used in a process that is dedicated to the captured work.
+    """
+    global _capture_active
+    # a second capture would take over the file descriptors of the first
+    if _capture_active:
+        raise Exception('The console output of this process is already being captured')
+    _capture_active = True
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_stdout_fd = os.dup(1)
+    saved_stderr_fd = os.dup(2)
+    sink = ConsoleSink(path, echo_fd=saved_stdout_fd)
+    read_fd, write_fd = os.pipe()
+    os.dup2(write_fd, 1)
+    os.dup2(write_fd, 2)
+    os.close(write_fd)
+    # the pipe would otherwise make stdout block-buffered
+    line_buffering = getattr(sys.stdout, 'line_buffering', None)
+    if line_buffering is not None:
+        sys.stdout.reconfigure(line_buffering=True)
 
-    stdout_original = sys.stdout
-    stderr_original = sys.stderr
+    # the reader is stopped through a second pipe rather than by the end of
+    # file of the capture pipe, which never comes while a descendant that
+    # inherited fd 1 or 2 (e.g. the resource tracker of multiprocessing) is
+    # still running
+    stop_read_fd, stop_write_fd = os.pipe()
 
+    def read_pipe():
+        while True:
+            ready, _, _ = select.select([read_fd, stop_read_fd], [], [])
+            if read_fd in ready:
+                data = os.read(read_fd, 65536)
+                if not data:
+                    break
+                sink.write(data)
+            elif stop_read_fd in ready:
+                # what was written before the file descriptors were restored
+                # is in the pipe; anything written later by a lingering
+                # descendant is dropped
+                os.set_blocking(read_fd, False)
+                while True:
+                    try:
+                        data = os.read(read_fd, 65536)
+                    except BlockingIOError:
+                        break
+                    if not data:
+                        break
+                    sink.write(data)
+                break
+        os.close(read_fd)
+    reader = threading.Thread(target=read_pipe, daemon=True)
+    reader.start()
     try:
-        sys.stdout = LoggerWriter(logger, logging.DEBUG)
-        sys.stderr = LoggerWriter(logger, logging.ERROR)
-        yield
+        yield sink
     finally:
-        sys.stdout = stdout_original
-        sys.stderr = stderr_original
\ No newline at end of file
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if line_buffering is not None:
+            sys.stdout.reconfigure(line_buffering=line_buffering)
+        os.dup2(saved_stdout_fd, 1)
+        os.dup2(saved_stderr_fd, 2)
+        os.write(stop_write_fd, b'x')
+        reader.join()
+        os.close(stop_read_fd)
+        os.close(stop_write_fd)
+        sink.close()
+        os.close(saved_stdout_fd)
+        os.close(saved_stderr_fd)
+        _capture_active = False
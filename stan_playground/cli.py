@@ -16,13 +16,23 @@ def cli():
 #         stan_playground.queue_analysis(analysis_id, dir='.')
 
 @click.command(help="Start the processing")
-def start():
-    stan_playground.start_processing(dir='.')
+@click.option('--cores', type=int, default=None, help='Total number of cores that running analyses may use (default: all)')
+def start(cores: int):
+    stan_playground.start_processing(dir='.', max_cores=cores)
 
-@click.command(help='Update the summary file for the GUI')
+@click.command(help='Rebuild the summary file for the GUI from scratch')
 def update_summary():
     stan_playground.create_summary(dir='.')
 
+@click.command(help='Rebuild the metadata index of analyses and projects from the data directory')
+def rebuild_index():
+    stan_playground.rebuild_index(dir='.')
+
+@click.command(help='Remove the shared file blobs that are no longer used by any analysis')
+def collect_garbage():
+    freed = stan_playground.collect_blob_garbage(dir='.')
+    print(f'Freed {freed} bytes')
+
 @click.command(help='Generate a temporary access code for use in the GUI')
 def generate_access_code():
     print(stan_playground.generate_access_code(dir='.'))
@@ -30,4 +40,6 @@ def generate_access_code():
 # cli.add_command(queue)
 cli.add_command(start)
 cli.add_command(update_summary)
+cli.add_command(rebuild_index)
+cli.add_command(collect_garbage)
 cli.add_command(generate_access_code)
\ No newline at end of file
@@ -0,0 +1,197 @@
+import os
+import re
+import json
+import mmap
+from typing import List, Union
+
+
+# The data of an analysis is passed to CmdStan as a file rather than as a
+# python dict (which cmdstanpy would write out again), so that a large
+# data.json is never loaded into memory by the worker. It is validated by a
+# streaming scanner, which consumes runs of numbers (the bulk of a large
+# dataset) with a single regex match.
+#
+# An analysis may also have a data.npz next to data.json, with large arrays
+# in binary form. Its arrays are merged with the variables of data.json into
+# a json file for CmdStan, which is cached in the analysis directory
+# (.data.npz.json) until data.json or data.npz change.
+
+NPZ_CACHE_FNAME = '.data.npz.json'
+
+_NUMBER = rb'(?:-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?|NaN|-?Infinity)'
+_token_regex = re.compile(
+    rb'[ \t\r\n]*(?:'
+    # a bounded run, so that the regex engine does not build a deep stack
+    rb'(?P<numbers>' + _NUMBER + rb'(?:[ \t\r\n]*,[ \t\r\n]*' + _NUMBER + rb'){0,10000})'
+    rb'|(?P<string>"(?:[^"\\\x00-\x1f]|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))*")'
+    rb'|(?P<literal>true|false|null)'
+    rb'|(?P<punct>[{}\[\]:,])'
+    rb')'
+)
+_trailing_whitespace_regex = re.compile(rb'[ \t\r\n]*')
+
+def get_cmdstan_data_file(analysis_dir: str) -> str:
+    """Return the path of the json data file to pass to CmdStan for an analysis"""
+    data_json_path = f'{analysis_dir}/data.json'
+    data_npz_path = f'{analysis_dir}/data.npz'
+    if not os.path.exists(data_npz_path):
+        validate_json_data_file(data_json_path)
+        return data_json_path
+    return _get_converted_npz_data_file(analysis_dir)
+
+def validate_json_data_file(path: str):
+    """Raise an exception if the file is not a json object (as required by CmdStan), without loading it"""
+    if not os.path.exists(path):
+        raise Exception(f'Data file not found: {os.path.basename(path)}')
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise Exception(f'Invalid data file {os.path.basename(path)}: empty file')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            error = _scan_json_object(mm)
+    if error is not None:
+        raise Exception(f'Invalid data file {os.path.basename(path)}: {error}')
+
+def _scan_json_object(buf) -> Union[str, None]:
+    # returns a description of the first error, or None if buf is a valid json object
+    stack: List[bytes] = [] # the open containers
+    # what is expected next: 'value', 'key', 'colon', 'next' (comma or close),
+    # 'value_or_close' (after '[') or 'key_or_close' (after '{')
+    expect = 'top'
+    pos = 0
+    n = len(buf)
+    while True:
+        if len(stack) == 0 and expect == 'next':
+            m = _trailing_whitespace_regex.match(buf, pos)
+            if m.end() != n:
+                return f'unexpected content after the data at byte {m.end()}'
+            return None
+        m = _token_regex.match(buf, pos)
+        if m is None:
+            end = _trailing_whitespace_regex.match(buf, pos).end()
+            return 'unexpected end of file' if end == n else f'invalid json at byte {end}'
+        pos = m.end()
+        kind = m.lastgroup
+        token = m.group(kind)
+        if expect == 'top':
+            if token != b'{':
+                return 'the data must be a json object'
+            stack.append(b'{')
+            expect = 'key_or_close'
+        elif expect in ('value', 'value_or_close'):
+            if kind == 'punct':
+                if token in (b'{', b'['):
+                    stack.append(token)
+                    expect = 'key_or_close' if token == b'{' else 'value_or_close'
+                elif token == b']' and expect == 'value_or_close':
+                    stack.pop()
+                    expect = 'next'
+                else:
+                    return f'unexpected "{token.decode()}" at byte {m.start(kind)}'
+            elif kind == 'numbers' and stack[-1] == b'{' and b',' in token:
+                # a run of numbers is only a single value within an object
+                return f'unexpected "," at byte {m.start(kind) + token.index(b",")}'
+            else:
+                expect = 'next'
+        elif expect in ('key', 'key_or_close'):
+            if kind == 'string':
+                expect = 'colon'
+            elif token == b'}' and expect == 'key_or_close':
+                stack.pop()
+                expect = 'next'
+            else:
+                return f'expected a variable name at byte {m.start(kind)}'
+        elif expect == 'colon':
+            if token != b':':
+                return f'expected ":" at byte {m.start(kind)}'
+            expect = 'value'
+        elif expect == 'next':
+            if token == b',':
+                expect = 'key' if stack[-1] == b'{' else 'value'
+            elif (token == b'}' and stack[-1] == b'{') or (token == b']' and stack[-1] == b'['):
+                stack.pop()
+                expect = 'next'
+            else:
+                return f'unexpected "{token.decode(errors="replace")}" at byte {m.start(kind)}'
+
+def _get_converted_npz_data_file(analysis_dir: str) -> str:
+    data_json_path = f'{analysis_dir}/data.json'
+    data_npz_path = f'{analysis_dir}/data.npz'
+    converted_path = f'{analysis_dir}/{NPZ_CACHE_FNAME}'
+    signature = {
+        'data.json': _get_file_signature(data_json_path),
+        'data.npz': _get_file_signature(data_npz_path)
+    }
+    signature_path = f'{converted_path}.signature'
+    if os.path.exists(converted_path) and os.path.exists(signature_path):
+        with open(signature_path, 'r') as f:
+            try:
+                if json.load(f) == signature:
+                    return converted_path
+            except json.JSONDecodeError:
+                pass
+    tmp_path = f'{converted_path}.tmp-{os.getpid()}'
+    try:
+        _convert_npz_data(data_json_path, data_npz_path, tmp_path)
+        os.rename(tmp_path, converted_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    with open(f'{signature_path}.tmp-{os.getpid()}', 'w') as f:
+        json.dump(signature, f)
+    os.rename(f'{signature_path}.tmp-{os.getpid()}', signature_path)
+    return converted_path
+
+def _convert_npz_data(data_json_path: str, data_npz_path: str, output_path: str):
+    import numpy as np
+
+    # data.json holds the small variables when there is a data.npz
+    if os.path.exists(data_json_path):
+        with open(data_json_path, 'r') as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise Exception('Invalid data file data.json: the data must be a json object')
+    else:
+        data = {}
+    with np.load(data_npz_path, allow_pickle=False) as npz, open(output_path, 'w') as f:
+        f.write('{')
+        first = True
+        for name, value in data.items():
+            if name in npz.files:
+                raise Exception(f'Variable {name} is in both data.json and data.npz')
+            f.write(('' if first else ',') + json.dumps(name) + ':' + json.dumps(value))
+            first = False
+        for name in npz.files:
+            a = npz[name]
+            if a.dtype.kind not in 'biuf':
+                raise Exception(f'Unsupported type of variable {name} in data.npz: {a.dtype}')
+            f.write(('' if first else ',') + json.dumps(name) + ':')
+            _write_json_array(f, a)
+            first = False
+        f.write('}')
+
+def _write_json_array(f, a):
+    # nested lists in row-major order, as CmdStan expects for arrays and matrices
+    if a.ndim == 0:
+        f.write(json.dumps(a.item()))
+    elif a.ndim == 1:
+        if a.dtype.kind == 'b':
+            a = a.astype(int)
+        f.write('[')
+        chunk_size = 1 << 16
+        for start in range(0, len(a), chunk_size):
+            # json writes nan and inf as NaN and Infinity, which CmdStan accepts
+            f.write(('' if start == 0 else ',') + json.dumps(a[start:start + chunk_size].tolist())[1:-1])
+        f.write(']')
+    else:
+        f.write('[')
+        for i in range(a.shape[0]):
+            if i > 0:
+                f.write(',')
+            _write_json_array(f, a[i])
+        f.write(']')
+
+def _get_file_signature(path: str) -> Union[list, None]:
+    if not os.path.exists(path):
+        return None
+    st = os.stat(path)
+    return [st.st_ino, st.st_mtime_ns, st.st_size]
@@ -1,6 +1,9 @@
 import os
-import subprocess
 import time
+import shutil
+from .metadata_cache import load_yaml_file
+from .model_cache import use_compiled_model
+from .sampling_options import get_cpp_options
 
 
 def compile_analysis_model(analysis_id: str, *, dir: str):
@@ -10,8 +13,12 @@ def compile_analysis_model(analysis_id: str, *, dir: str):
     if not os.path.exists(main_stan_path):
         raise Exception(f'Unable to find main.stan file for analysis {analysis_id}')
     
-    # Run compilation in a separate process, writing the console output to compile.console.txt, including the stderr, and waiting for return
-    # we want to be in the analysis_path as the working directory
+    # compile the variant (e.g. with STAN_THREADS) that the options of the run need
+    options_path = f'{analysis_path}/options.yaml'
+    options = (load_yaml_file(options_path) or {}) if os.path.exists(options_path) else {}
+    cpp_options = get_cpp_options(options)
+
+    # Compile (or fetch from the compiled model cache), writing the console output to compile.console.txt
     compile_console_path = f'{analysis_path}/compile.console.txt'
     if os.path.exists(compile_console_path):
         os.remove(compile_console_path)
@@ -20,19 +27,26 @@ def compile_analysis_model(analysis_id: str, *, dir: str):
         # write a timestamp line to the file
         f.write(f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())}\n')
         f.write(f'============================\n')
+        f.flush()
         timer = time.time()
-        return_code = subprocess.call(
-            ['cmdstan_model', 'main.stan'],
-            cwd=analysis_path,
-            stdout=f,
-            stderr=subprocess.STDOUT
-        )
-        elapsed = time.time() - timer
+        try:
+            with use_compiled_model(main_stan_path, dir=dir, cpp_options=cpp_options, console=f) as (exe_path, cache_hit):
+                elapsed = time.time() - timer
+                # the executable is hard linked from the cache rather than copied
+                model_path = f'{analysis_path}/model'
+                if os.path.exists(model_path):
+                    os.remove(model_path)
+                try:
+                    os.link(exe_path, model_path)
+                except OSError:
+                    shutil.copy2(exe_path, model_path)
+        except Exception as e:
+            f.write(f'============================\n')
+            f.write(f'{str(e)}\n')
+            raise Exception(f'Error compiling model for analysis {analysis_id}')
         f.write(f'============================\n')
+        f.write(f'Model cache: {"hit" if cache_hit else "miss"}\n')
+        if cpp_options:
+            f.write(f'Compiler options: {" ".join(f"{k}={v}" for k, v in sorted(cpp_options.items()))}\n')
         f.write(f'Elapsed time: {elapsed:.2f} seconds\n')
-        f.write(f'Executable size (bytes): {os.path.getsize(f"{analysis_path}/model")}\n')
-        f.write(f'Return code: {return_code}\n')
-
-    # if the return code is not zero, then raise an exception
-    if return_code != 0:
-        raise Exception(f'Error compiling model for analysis {analysis_id}')
\ No newline at end of file
+        f.write(f'Executable size (bytes): {os.path.getsize(model_path)}\n')
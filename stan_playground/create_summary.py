@@ -1,88 +1,314 @@
 import os
 import json
-import yaml
+import threading
+from contextlib import contextmanager
+from typing import List, Tuple, Union
+from .metadata_cache import load_yaml_file
+from .metadata_store import exclusive_lock
+from .run_metrics import read_run_metrics
 
 
+# files that determine the summary entry of an analysis
+_SUMMARY_SOURCE_FILES = ['analysis.yaml', 'description.md', 'options.yaml', 'main.stan', 'data.py', 'data.json', 'data.npz']
+
+# fields of the summary index by which the analyses can be sorted
+_SORT_KEYS = ['analysis_id', 'title', 'status', 'owner_id', 'timestamp_created', 'timestamp_modified', 'run_elapsed_sec', 'run_cpu_sec']
+
+_summary_index_cache = None
+
+# the summary updates collected for the current batch of queries (per thread), see deferred_summary_updates
+_deferred = threading.local()
+
 def create_summary(dir: str):
+    """Rebuild the summary from scratch by scanning every analysis folder"""
+    with _summary_lock(dir=dir):
+        _create_summary(dir)
+
+def update_analysis_summary(analysis_id: str, *, dir: str):
+    """Rebuild the summary entry for a single analysis and splice it into the summary
+
+    The per-analysis manifest records the (mtime, size) of the files that the
+    summary entry was built from, so the entry is only rebuilt when one of those
+    files has changed. If there is no manifest yet, a full rebuild is done.
+    """
+    deferred = getattr(_deferred, 'updates', None)
+    if deferred is not None and deferred['dir'] == dir:
+        deferred['analysis_ids'].add(analysis_id)
+        return
+    # the manifest and the index are read-modify-written, so updates from
+    # concurrent processes must not interleave
+    with _summary_lock(dir=dir):
+        _update_analysis_summaries([analysis_id], dir=dir)
+
+@contextmanager
+def deferred_summary_updates(*, dir: str):
+    """Collect the summary updates of the enclosed operations and apply them at the end, with a single rewrite of the index"""
+    if getattr(_deferred, 'updates', None) is not None:
+        yield # nested
+        return
+    _deferred.updates = {'dir': dir, 'analysis_ids': set()}
+    try:
+        yield
+    finally:
+        analysis_ids = _deferred.updates['analysis_ids']
+        _deferred.updates = None
+        if len(analysis_ids) > 0:
+            with _summary_lock(dir=dir):
+                _update_analysis_summaries(sorted(analysis_ids), dir=dir)
+
+def _create_summary(dir: str):
     if not os.path.exists(f'{dir}/analyses'):
         os.makedirs(f'{dir}/analyses')
 
-    analyses = []
+    manifest = {}
+    details_by_id = {}
     # Iterate through all the folders in the analyses directory
     folders = os.listdir(f'{dir}/analyses')
     folders.sort()
     for folder in folders:
         path = f'{dir}/analyses/{folder}'
+        if not os.path.isdir(path):
+            continue
+        manifest[folder], details = _create_manifest_entry(folder, dir=dir)
+        if details is not None:
+            details_by_id[folder] = details
+
+    # write all the detail shards, removing those of analyses that are no longer listed
+    details_dir = f'{dir}/summary/analyses'
+    os.makedirs(details_dir, exist_ok=True)
+    for fname in os.listdir(details_dir):
+        if fname.endswith('.json') and manifest.get(fname[:-len('.json')], {}).get('summary', None) is None:
+            os.remove(f'{details_dir}/{fname}')
+    for analysis_id, details in details_by_id.items():
+        _write_summary_details(analysis_id, details, dir=dir)
 
-        # read info from analysis.yaml file
-        if os.path.exists(f'{path}/analysis.yaml'):
-            with open(f'{path}/analysis.yaml') as f:
-                info = yaml.load(f, Loader=yaml.FullLoader)
+    _write_manifest(manifest, dir=dir)
+    _write_summary_index(manifest, dir=dir)
+
+    # the monolithic summary file has been replaced by the index and the detail shards
+    if os.path.exists(f'{dir}/stan_playground_summary.json'):
+        os.remove(f'{dir}/stan_playground_summary.json')
+
+def _update_analysis_summaries(analysis_ids: List[str], *, dir: str):
+    manifest = _read_manifest(dir=dir)
+    if manifest is None:
+        _create_summary(dir)
+        return
+
+    changed = False
+    for analysis_id in analysis_ids:
+        path = f'{dir}/analyses/{analysis_id}'
+        if os.path.isdir(path):
+            existing = manifest.get(analysis_id, None)
+            if existing is not None and existing['signature'] == _get_analysis_signature(path, output_path=f'{dir}/output/{analysis_id}'):
+                continue
+            manifest[analysis_id], details = _create_manifest_entry(analysis_id, dir=dir)
         else:
-            info = {}
-        
-        # if model.stan exists, rename to main.stan
-        if os.path.exists(f'{path}/model.stan'):
-            print(f'Renaming model.stan to main.stan for analysis {folder}')
-            os.rename(f'{path}/model.stan', f'{path}/main.stan')
-        
-        # if deleted, skip
-        if info.get('deleted', False):
-            continue
+            if analysis_id not in manifest:
+                continue
+            manifest.pop(analysis_id)
+            details = None
+
+        if details is not None:
+            _write_summary_details(analysis_id, details, dir=dir)
+        elif os.path.exists(f'{dir}/summary/analyses/{analysis_id}.json'):
+            os.remove(f'{dir}/summary/analyses/{analysis_id}.json')
+        changed = True
+    if changed:
+        _write_manifest(manifest, dir=dir)
+        _write_summary_index(manifest, dir=dir)
+
+def get_analyses_summary_page(*, dir: str, offset: int, limit: int, sort_by: str, sort_order: str) -> Tuple[int, List[dict]]:
+    """Return the total number of listed analyses and one page of their summary index entries
+
+    The index is parsed and sorted once per version of the index file, so
+    serving a page does not depend on the total number of analyses.
+    """
+    if sort_by not in _SORT_KEYS:
+        raise Exception(f'Unexpected sort_by: {sort_by}')
+    if sort_order not in ['asc', 'desc']:
+        raise Exception(f'Unexpected sort_order: {sort_order}')
+    index_path = f'{dir}/stan_playground_summary_index.json'
+    if not os.path.exists(index_path):
+        create_summary(dir)
+    st = os.stat(index_path)
+    signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+    global _summary_index_cache
+    if _summary_index_cache is None or _summary_index_cache['signature'] != signature:
+        with open(index_path, 'r') as f:
+            analyses = json.load(f)['analyses']
+        _summary_index_cache = {'signature': signature, 'analyses': analyses, 'sorted': {}}
+    cache = _summary_index_cache
+    if sort_by not in cache['sorted']:
+        # None values sort first in ascending order
+        cache['sorted'][sort_by] = sorted(cache['analyses'], key=lambda a: (a.get(sort_by) is not None, a.get(sort_by) if a.get(sort_by) is not None else 0, a['analysis_id']))
+    ordered = cache['sorted'][sort_by]
+    total = len(ordered)
+    if sort_order == 'asc':
+        page = ordered[offset:offset + limit]
+    else:
+        start = max(total - offset - limit, 0)
+        end = max(total - offset, 0)
+        page = ordered[start:end][::-1]
+    return total, page
+
+def _summary_lock(*, dir: str):
+    return exclusive_lock(f'{dir}/.stan_playground_summary.lock')
+
+def _create_manifest_entry(analysis_id: str, *, dir: str) -> Tuple[dict, Union[dict, None]]:
+    path = f'{dir}/analyses/{analysis_id}'
+    output_path = f'{dir}/output/{analysis_id}'
+
+    # if model.stan exists, rename to main.stan
+    if os.path.exists(f'{path}/model.stan'):
+        print(f'Renaming model.stan to main.stan for analysis {analysis_id}')
+        os.rename(f'{path}/model.stan', f'{path}/main.stan')
+
+    # the signature is taken before reading the files so that a concurrent
+    # modification results in a stale signature (and a rebuild next time)
+    # rather than a stale entry with a fresh signature
+    signature = _get_analysis_signature(path, output_path=output_path)
+    details = _create_analysis_summary(analysis_id, path=path, output_path=output_path)
+    entry = {
+        'signature': signature,
+        'summary': _get_summary_index_entry(details) if details is not None else None
+    }
+    return entry, details
+
+def _create_analysis_summary(analysis_id: str, *, path: str, output_path: str) -> Union[dict, None]:
+    # read info from analysis.yaml file
+    if os.path.exists(f'{path}/analysis.yaml'):
+        info = load_yaml_file(f'{path}/analysis.yaml') or {}
+    else:
+        info = {}
+
+    # if deleted, skip
+    if info.get('deleted', False):
+        return None
+
+    # if not listed, skip
+    if not info.get('listed', False):
+        return None
+
+    # read description from description.md file
+    if os.path.exists(f'{path}/description.md'):
+        with open(f'{path}/description.md') as f:
+            description = f.read()
+    else:
+        description = ''
+
+    # read options from options.yaml file
+    if os.path.exists(f'{path}/options.yaml'):
+        options = load_yaml_file(f'{path}/options.yaml') or {}
+    else:
+        options = {}
 
-        # if not listed, skip
-        if not info.get('listed', False):
+    # read stan program from main.stan file
+    if os.path.exists(f'{path}/main.stan'):
+        with open(f'{path}/main.stan') as f:
+            stan_program = f.read()
+    else:
+        stan_program = ''
+
+    # read python program from data.py file
+    if os.path.exists(f'{path}/data.py'):
+        with open(f'{path}/data.py') as f:
+            data_python_program = f.read()
+    else:
+        data_python_program = ''
+
+    title = _get_title_from_markdown(description)
+    return {
+        'analysis_id': analysis_id,
+        'title': title,
+        'status': info.get('status', 'none'),
+        'owner_id': info.get('owner_id', None),
+        'data_size': sum(os.path.getsize(f'{path}/{fname}') for fname in ['data.json', 'data.npz'] if os.path.exists(f'{path}/{fname}')),
+        'info': info,
+        'description': description,
+        'stan_program': stan_program,
+        'data_python_program': data_python_program,
+        'options': options,
+        # performance record of the last run
+        'metrics': read_run_metrics(output_path)
+    }
+
+def _get_analysis_signature(path: str, *, output_path: str) -> dict:
+    signature = {}
+    # the performance record of the last run is part of the summary too
+    files = [(fname, f'{path}/{fname}') for fname in _SUMMARY_SOURCE_FILES] + [('output/metrics.json', f'{output_path}/metrics.json')]
+    for key, file_path in files:
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
+            signature[key] = None
             continue
+        signature[key] = [st.st_mtime_ns, st.st_size]
+    return signature
 
-        # read description from description.md file
-        if os.path.exists(f'{path}/description.md'):
-            with open(f'{path}/description.md') as f:
-                description = f.read()
-        else:
-            description = ''
-        
-        # read options from options.yaml file
-        if os.path.exists(f'{path}/options.yaml'):
-            with open(f'{path}/options.yaml') as f:
-                options = yaml.load(f, Loader=yaml.FullLoader)
-        else:
-            options = {}
+def _read_manifest(*, dir: str):
+    manifest_path = f'{dir}/.stan_playground_summary_manifest.json'
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        print(f'WARNING: Unable to parse summary manifest. Doing a full rebuild.')
+        return None
 
-        # read stan program from main.stan file
-        if os.path.exists(f'{path}/main.stan'):
-            with open(f'{path}/main.stan') as f:
-                stan_program = f.read()
-        else:
-            stan_program = ''
-        
-        # read python program from data.py file
-        if os.path.exists(f'{path}/data.py'):
-            with open(f'{path}/data.py') as f:
-                data_python_program = f.read()
-        else:
-            data_python_program = ''
-        
-        title = _get_title_from_markdown(description)
-        analyses.append({
-            'analysis_id': folder,
-            'title': title,
-            'status': info.get('status', 'none'),
-            'owner_id': info.get('owner_id', None),
-            'data_size': os.path.getsize(f'{path}/data.json') if os.path.exists(f'{path}/data.json') else 0,
-            'info': info,
-            'description': description,
-            'stan_program': stan_program,
-            'data_python_program': data_python_program,
-            'options': options
-        })
-
-    summary = {
+def _write_manifest(manifest: dict, *, dir: str):
+    _write_json_compact(f'{dir}/.stan_playground_summary_manifest.json', manifest)
+
+def _write_summary_index(manifest: dict, *, dir: str):
+    analyses = []
+    for analysis_id in sorted(manifest.keys()):
+        a = manifest[analysis_id]['summary']
+        if a is not None:
+            analyses.append(a)
+
+    summary_index = {
         'analyses': analyses
     }
-    
-    # write analyses to stan_playground_summary.json file
-    with open(f'{dir}/stan_playground_summary.json', 'w') as f:
-        json.dump(summary, f, indent=2)
+
+    # write the compact index of the listed analyses to stan_playground_summary_index.json
+    _write_json_compact(f'{dir}/stan_playground_summary_index.json', summary_index)
+
+def _write_summary_details(analysis_id: str, details: dict, *, dir: str):
+    details_dir = f'{dir}/summary/analyses'
+    os.makedirs(details_dir, exist_ok=True)
+    _write_json_compact(f'{details_dir}/{analysis_id}.json', details)
+
+def _get_summary_index_entry(details: dict) -> dict:
+    info = details['info']
+    sampling = (details['metrics'] or {}).get('sampling', {})
+    return {
+        'analysis_id': details['analysis_id'],
+        'title': details['title'],
+        'status': details['status'],
+        'owner_id': details['owner_id'],
+        'project_id': info.get('project_id', None),
+        'data_size': details['data_size'],
+        'description_size': len(details['description']),
+        'stan_program_size': len(details['stan_program']),
+        'data_python_program_size': len(details['data_python_program']),
+        'timestamp_created': info.get('timestamp_created', None),
+        'timestamp_modified': info.get('timestamp_modified', None),
+        'timestamp_queued': info.get('timestamp_queued', None),
+        'timestamp_started': info.get('timestamp_started', None),
+        'timestamp_completed': info.get('timestamp_completed', None),
+        'timestamp_failed': info.get('timestamp_failed', None),
+        'run_elapsed_sec': sampling.get('elapsed_sec', None),
+        'run_cpu_sec': sampling.get('cpu_sec', None),
+        'run_peak_rss_bytes': sampling.get('peak_rss_bytes', None)
+    }
+
+def _write_json_compact(path: str, x: dict):
+    # write to a temporary file and rename, so that readers never see a partial file
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'w') as f:
+        json.dump(x, f, separators=(',', ':'))
+    os.rename(tmp_path, path)
 
 def _get_title_from_markdown(markdown: str):
     # Extract the title from the markdown
@@ -91,4 +317,4 @@ def _get_title_from_markdown(markdown: str):
         if line.startswith('#'):
             # skip all the initial # characters
             return line.lstrip('#').strip()
-    return ''
\ No newline at end of file
+    return ''
@@ -0,0 +1,128 @@
+import os
+import re
+import sys
+import json
+import stat
+import shutil
+import hashlib
+from typing import List, Union
+from .cache_utils import cache_entry_lock, get_dir_size
+
+
+# The data.json generated by a deterministic data.py is stored in a
+# content-addressed cache in the data directory, keyed by a hash of data.py
+# (and of the python environment), so that rerunning an unchanged generator,
+# or the generator of a clone, is a hardlink instead of a run. A data.py is
+# declared deterministic (e.g. because it seeds its random numbers) with the
+# line
+#
+#   # stan-playground: deterministic
+#
+# The cached files are read-only and shared with the analyses by hardlinks,
+# so a data.json must never be modified in place while it is linked (see
+# make_private_copy).
+
+DATA_CACHE_MAX_BYTES = int(os.environ.get('STAN_PLAYGROUND_DATA_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+
+_deterministic_marker_regex = re.compile(rb'^#\s*stan-playground:\s*deterministic\s*$', re.MULTILINE)
+
+def get_data_cache_key(data_py: bytes, *, module_names: List[str]) -> Union[str, None]:
+    """Return the cache key of a data.py script, or None if it is not declared deterministic
+
+    module_names are the (preloaded) modules whose versions are part of the key.
+    """
+    if _deterministic_marker_regex.search(data_py) is None:
+        return None
+    x = {
+        'data_py': hashlib.sha256(data_py).hexdigest(),
+        # the output of a seeded generator depends on the library versions
+        'python': sys.version,
+        'modules': {
+            name: str(getattr(sys.modules[name], '__version__', '')) if name in sys.modules else None
+            for name in sorted(set(module_names))
+        }
+    }
+    return hashlib.sha256(json.dumps(x, sort_keys=True).encode('utf-8')).hexdigest()
+
+def get_data_cache_dir(*, dir: str) -> str:
+    cache_dir = f'{dir}/.data_cache'
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+def data_cache_entry_lock(key: str, *, dir: str):
+    """Lock a cache entry, so that concurrent runs of the same data.py run it only once"""
+    return cache_entry_lock(get_data_cache_dir(dir=dir), key)
+
+def restore_cached_data_json(key: str, data_json_path: str, *, dir: str) -> bool:
+    """Hardlink the cached data.json into place; returns False if it is not in the cache"""
+    entry_dir = f'{get_data_cache_dir(dir=dir)}/{key}'
+    cached_path = f'{entry_dir}/data.json'
+    if not os.path.exists(cached_path):
+        return False
+    tmp_path = f'{data_json_path}.tmp-{os.getpid()}'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    _link_or_copy(cached_path, tmp_path)
+    os.rename(tmp_path, data_json_path)
+    # mark as recently used for the LRU eviction
+    os.utime(entry_dir)
+    return True
+
+def save_data_json_to_cache(key: str, data_json_path: str, *, dir: str):
+    cache_dir = get_data_cache_dir(dir=dir)
+    entry_dir = f'{cache_dir}/{key}'
+    if os.path.exists(entry_dir):
+        return
+    build_dir = f'{entry_dir}.tmp-{os.getpid()}'
+    if os.path.exists(build_dir):
+        shutil.rmtree(build_dir)
+    os.makedirs(build_dir)
+    try:
+        # a private read-only copy, which is then shared by hardlinks
+        shutil.copyfile(data_json_path, f'{build_dir}/data.json')
+        os.chmod(f'{build_dir}/data.json', 0o444)
+        os.rename(build_dir, entry_dir)
+    finally:
+        if os.path.exists(build_dir):
+            shutil.rmtree(build_dir)
+    restore_cached_data_json(key, data_json_path, dir=dir)
+
+def evict_data_cache(*, dir: str, keep: str):
+    cache_dir = get_data_cache_dir(dir=dir)
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry_dir = f'{cache_dir}/{name}'
+        if name.endswith('.lock') or '.tmp-' in name or not os.path.isdir(entry_dir):
+            continue
+        entries.append((os.stat(entry_dir).st_mtime, name, get_dir_size(entry_dir)))
+    total_size = sum(e[2] for e in entries)
+    entries.sort()
+    for _, name, size in entries:
+        if total_size <= DATA_CACHE_MAX_BYTES:
+            break
+        if name == keep:
+            continue
+        with cache_entry_lock(cache_dir, name, blocking=False) as locked:
+            if not locked:
+                continue # in use
+            # the analyses that link to the entry keep their data.json
+            shutil.rmtree(f'{cache_dir}/{name}')
+        total_size -= size
+
+def make_private_copy(path: str):
+    """Replace a file that is shared by hardlinks (or read-only, e.g. copied from the cache) with a private, writable copy"""
+    if not os.path.exists(path):
+        return
+    st = os.stat(path)
+    if st.st_nlink <= 1 and st.st_mode & stat.S_IWUSR:
+        return
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    shutil.copyfile(path, tmp_path)
+    os.rename(tmp_path, path)
+
+def _link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # e.g. on a different file system
+        shutil.copyfile(src, dst)
@@ -0,0 +1,207 @@
+import os
+import re
+import sys
+import json
+import array
+import threading
+from typing import Dict, List, Union
+
+
+# The draws of a run are stored in output/<id>/draws next to the CmdStan csv
+# files, in a columnar binary format so that a single parameter can be read
+# (or memory-mapped) without parsing the csv files:
+#
+#   draws/header.json           column names, number of draws per chain, ...
+#   draws/chain_<n>/<i>.f64     little-endian float64 draws of column i of chain n
+#
+# The column files are only appended to, and header.json is replaced
+# atomically after the appended data has been written, so a reader that
+# trusts num_draws from the header never sees a partial draw, even while
+# sampling is still running.
+
+DRAWS_FORMAT_VERSION = 1
+
+_csv_chain_regex = re.compile(r'_(\d+)\.csv$')
+
+class DrawsWriter:
+    """Converts the CmdStan csv files of a run into the columnar draws store, incrementally
+
+    Call poll() to append whatever complete rows have been written to the csv
+    files since the last call, or use start() / stop() to do that in a
+    background thread while sampling. If progress is given, it is fed the new
+    rows and published after each poll.
+
+    With append=True the rows are appended to the chains of an existing store
+    (continuing a run), reading the csv files from csv_dir.
+    """
+    def __init__(self, output_dir: str, *, num_warmup_draws: int=0, poll_interval_sec: float=1, progress=None, csv_dir: Union[str, None]=None, append: bool=False):
+        self._output_dir = output_dir
+        self._csv_dir = csv_dir or output_dir
+        self._draws_dir = f'{output_dir}/draws'
+        self._num_warmup_draws = num_warmup_draws
+        self._poll_interval_sec = poll_interval_sec
+        self._progress = progress
+        self._chains: Dict[int, _CsvChainTailer] = {}
+        self._num_draws: Dict[int, int] = {}
+        self._columns: Union[List[str], None] = None
+        self._complete = False
+        self._thread: Union[threading.Thread, None] = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._error: Union[Exception, None] = None
+        self._append = append
+        if append:
+            header = read_draws_header(output_dir)
+            self._columns = header['columns']
+            self._num_warmup_draws = header['num_warmup_draws']
+            self._num_draws = {int(k): v['num_draws'] for k, v in header['chains'].items()}
+            # so that the first poll marks the store as incomplete again
+            self._complete = header['complete']
+            return
+        if os.path.exists(f'{self._draws_dir}/header.json'):
+            raise Exception(f'Draws store already exists: {self._draws_dir}')
+        os.makedirs(self._draws_dir, exist_ok=True)
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    def stop(self, *, complete: bool):
+        """Stop the background thread and do a final pass over the csv files"""
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            raise self._error
+        self.poll(complete=complete)
+    def poll(self, *, complete: bool=False) -> bool:
+        """Append any new complete rows to the store; returns True if anything was added"""
+        with self._lock:
+            changed = False
+            for fname in sorted(os.listdir(self._csv_dir)):
+                m = _csv_chain_regex.search(fname)
+                if m is None:
+                    continue
+                chain_id = int(m.group(1))
+                if chain_id not in self._chains:
+                    if self._append and chain_id not in self._num_draws:
+                        raise Exception(f'Unable to append chain {chain_id}, which is not in the draws store')
+                    self._chains[chain_id] = _CsvChainTailer(f'{self._csv_dir}/{fname}')
+                    self._num_draws.setdefault(chain_id, 0)
+                    os.makedirs(f'{self._draws_dir}/chain_{chain_id}', exist_ok=True)
+            for chain_id, tailer in sorted(self._chains.items()):
+                rows = tailer.read_rows()
+                if tailer.columns is not None:
+                    if self._columns is None:
+                        self._columns = tailer.columns
+                    elif tailer.columns != self._columns:
+                        raise Exception(f'Unexpected columns in csv file of chain {chain_id}')
+                if len(rows) > 0:
+                    _append_rows(f'{self._draws_dir}/chain_{chain_id}', rows, num_columns=len(self._columns))
+                    self._num_draws[chain_id] += len(rows)
+                    if self._progress is not None:
+                        self._progress.add_rows(chain_id, rows, columns=self._columns)
+                    changed = True
+            if changed or complete != self._complete or not os.path.exists(f'{self._draws_dir}/header.json'):
+                self._complete = complete
+                self._write_header()
+            if self._progress is not None and (changed or complete):
+                # the progress is throttled, except for the final update
+                self._progress.publish(complete=complete, force=complete)
+            return changed
+    def _run(self):
+        try:
+            while not self._stop_event.wait(self._poll_interval_sec):
+                self.poll()
+        except Exception as e:
+            self._error = e
+    def _write_header(self):
+        header = {
+            'format_version': DRAWS_FORMAT_VERSION,
+            'dtype': '<f8',
+            'columns': self._columns or [],
+            'num_warmup_draws': self._num_warmup_draws,
+            'chains': {str(chain_id): {'num_draws': num_draws} for chain_id, num_draws in sorted(self._num_draws.items())},
+            'complete': self._complete
+        }
+        path = f'{self._draws_dir}/header.json'
+        tmp_path = f'{path}.tmp-{os.getpid()}'
+        with open(tmp_path, 'w') as f:
+            json.dump(header, f)
+        os.rename(tmp_path, path)
+
+def read_draws_header(output_dir: str) -> dict:
+    with open(f'{output_dir}/draws/header.json', 'r') as f:
+        return json.load(f)
+
+def read_draws(output_dir: str, column: str, *, chain_id: int, header: Union[dict, None]=None):
+    """Return the draws of one column of one chain as a read-only numpy memmap (warmup draws included, if saved)"""
+    import numpy as np
+
+    if header is None:
+        header = read_draws_header(output_dir)
+    if column not in header['columns']:
+        raise Exception(f'Column not found in draws: {column}')
+    num_draws = _get_num_draws(header, chain_id)
+    if num_draws == 0:
+        return np.zeros((0,), dtype=header['dtype'])
+    path = get_draws_path(output_dir, header['columns'].index(column), chain_id=chain_id)
+    return np.memmap(path, dtype=header['dtype'], mode='r', shape=(num_draws,))
+
+def read_draws_range(output_dir: str, column_index: int, *, chain_id: int, header: dict, start: int, end: int):
+    """Return draws start:end of the column with the given index of one chain as a numpy array"""
+    import numpy as np
+
+    if end > _get_num_draws(header, chain_id):
+        raise Exception(f'Not enough draws in chain {chain_id}')
+    dtype = np.dtype(header['dtype'])
+    path = get_draws_path(output_dir, column_index, chain_id=chain_id)
+    return np.fromfile(path, dtype=dtype, count=end - start, offset=start * dtype.itemsize)
+
+def get_draws_path(output_dir: str, column_index: int, *, chain_id: int) -> str:
+    return f'{output_dir}/draws/chain_{chain_id}/{column_index}.f64'
+
+def convert_csv_draws(output_dir: str, *, num_warmup_draws: int=0):
+    """Build the draws store of a finished run from its csv files"""
+    writer = DrawsWriter(output_dir, num_warmup_draws=num_warmup_draws)
+    writer.poll(complete=True)
+
+def _get_num_draws(header: dict, chain_id: int) -> int:
+    chain = header['chains'].get(str(chain_id), None)
+    if chain is None:
+        raise Exception(f'Chain not found in draws: {chain_id}')
+    return chain['num_draws']
+
+class _CsvChainTailer:
+    """Reads the rows of a CmdStan csv file that is possibly still being written"""
+    def __init__(self, path: str):
+        self._path = path
+        self._offset = 0
+        self._partial = b''
+        self.columns: Union[List[str], None] = None
+    def read_rows(self) -> List[List[float]]:
+        with open(self._path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        self._offset += len(data)
+        lines = (self._partial + data).split(b'\n')
+        # the last line is incomplete (or empty)
+        self._partial = lines.pop()
+        rows = []
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith(b'#'):
+                # comments hold the configuration, adaptation and timing info
+                continue
+            if self.columns is None:
+                self.columns = line.decode('utf-8').split(',')
+                continue
+            rows.append([float(x) for x in line.split(b',')])
+        return rows
+
+def _append_rows(chain_dir: str, rows: List[List[float]], *, num_columns: int):
+    for i in range(num_columns):
+        a = array.array('d', [row[i] for row in rows])
+        if sys.byteorder == 'big':
+            a.byteswap()
+        with open(f'{chain_dir}/{i}.f64', 'ab') as f:
+            a.tofile(f)
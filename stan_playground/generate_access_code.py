@@ -1,8 +1,14 @@
 import os
+import hmac
 import json
-import random
+import heapq
 import string
+import secrets
+import hashlib
+import threading
 import time
+from typing import Dict, List, Tuple, Union
+from .metadata_store import exclusive_lock
 
 
 def generate_access_code(*, dir: str) -> str:
@@ -15,46 +21,103 @@ def generate_access_code(*, dir: str) -> str:
         else:
             raise Exception('You must be in the root of the stan-playground data directory.')
 
-    # load the existing access_codes from the .access_codes.json file, if it exists
-    access_codes = []
-    if os.path.exists(f'{dir}/.access_codes.json'):
-        with open(f'{dir}/.access_codes.json') as f:
-            access_codes = json.load(f)
-    
-    # filter this to only include the access_codes that have not yet expired
-    current_timestamp = int(time.time())
-    access_codes = [p for p in access_codes if get_expiration_timestamp(p) > current_timestamp]
-
-    # generate a new access_code
-    new_access_code = create_access_code(60 * 60) # one hour for now
-
-    # add the new access_code to the list
-    access_codes.append(new_access_code)
-
-    # save the list of access_codes back to the .access_codes.json file
-    with open(f'{dir}/.access_codes.json', 'w') as f:
-        json.dump(access_codes, f)
-    
+    # the read-modify-write of the file must not interleave with that of another process
+    with exclusive_lock(f'{dir}/.access_codes.json.lock'):
+        store = _get_access_code_store(dir)
+        # generate a new access_code
+        new_access_code = create_access_code(60 * 60) # one hour for now
+        store.add(new_access_code)
+
     # return the new access_code
     return new_access_code
 
 def check_valid_access_code(access_code: str, *, dir: str) -> bool:
-    # load the existing access_codes from the .access_codes.json file, if it exists
-    access_codes = []
-    if os.path.exists(f'{dir}/.access_codes.json'):
-        with open(f'{dir}/.access_codes.json') as f:
-            access_codes = json.load(f)
-    
-    # filter this to only include the access_codes that have not yet expired
-    current_timestamp = int(time.time())
-    access_codes = [p for p in access_codes if get_expiration_timestamp(p) > current_timestamp]
-
-    # check if the access_code is in the list
-    return access_code in access_codes
+    return _get_access_code_store(dir).contains(access_code)
+
+class AccessCodeStore:
+    """The unexpired access codes of a data directory, backed by .access_codes.json
+
+    The codes are kept in memory, keyed by their hash, with a heap ordered by
+    expiration so that expired codes are dropped without scanning all of
+    them. The file is reloaded only when it has been replaced (by this or by
+    another process), which is detected from its (inode, mtime, size).
+    """
+    def __init__(self, path: str):
+        self._path = path
+        self._codes: Dict[str, Tuple[str, int]] = {} # hash -> (access code, expiration timestamp)
+        self._heap: List[Tuple[int, str]] = [] # (expiration timestamp, hash)
+        self._signature: Union[tuple, None] = None
+        self._lock = threading.Lock()
+    def contains(self, access_code: str) -> bool:
+        if not isinstance(access_code, str):
+            return False
+        key = _hash_access_code(access_code)
+        with self._lock:
+            self._sync()
+            self._expire()
+            entry = self._codes.get(key, None)
+        # compare the codes themselves in constant time
+        return entry is not None and hmac.compare_digest(entry[0].encode('utf-8'), access_code.encode('utf-8'))
+    def add(self, access_code: str):
+        """Add a code and write the file (the caller holds the file lock)"""
+        with self._lock:
+            self._sync()
+            self._expire()
+            self._insert(access_code)
+            access_codes = [code for code, _ in self._codes.values()]
+            tmp_path = f'{self._path}.tmp-{os.getpid()}'
+            with open(tmp_path, 'w') as f:
+                json.dump(access_codes, f)
+            os.rename(tmp_path, self._path)
+            self._signature = _get_file_signature(self._path)
+    def _sync(self):
+        signature = _get_file_signature(self._path)
+        if signature == self._signature:
+            return
+        access_codes = []
+        if signature is not None:
+            with open(self._path) as f:
+                access_codes = json.load(f)
+        self._codes = {}
+        self._heap = []
+        for access_code in access_codes:
+            self._insert(access_code)
+        self._signature = signature
+    def _insert(self, access_code: str):
+        key = _hash_access_code(access_code)
+        expiration = get_expiration_timestamp(access_code)
+        self._codes[key] = (access_code, expiration)
+        heapq.heappush(self._heap, (expiration, key))
+    def _expire(self):
+        current_timestamp = int(time.time())
+        while len(self._heap) > 0 and self._heap[0][0] <= current_timestamp:
+            _, key = heapq.heappop(self._heap)
+            self._codes.pop(key, None)
+
+_access_code_stores: Dict[str, AccessCodeStore] = {}
+_access_code_stores_lock = threading.Lock()
+
+def _get_access_code_store(dir: str) -> AccessCodeStore:
+    with _access_code_stores_lock:
+        store = _access_code_stores.get(dir, None)
+        if store is None:
+            store = AccessCodeStore(f'{dir}/.access_codes.json')
+            _access_code_stores[dir] = store
+        return store
+
+def _hash_access_code(access_code: str) -> str:
+    return hashlib.sha256(access_code.encode('utf-8')).hexdigest()
+
+def _get_file_signature(path: str) -> Union[tuple, None]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
 
 def create_access_code(expiration_sec: int):
     expiration_timestamp = int(time.time()) + expiration_sec
-    random_str = ''.join(random.choices(string.ascii_letters + string.digits, k=12))
+    random_str = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(12))
     return f'{random_str}.{expiration_timestamp}'
 
 def get_expiration_timestamp(access_code: str):
@@ -1,15 +1,49 @@
 import os
-import subprocess
+import sys
 import time
+import runpy
+import signal
+import resource
+import importlib
+import traceback
+from .blob_store import intern_file
+from .data_cache import data_cache_entry_lock, evict_data_cache, get_data_cache_key, make_private_copy, restore_cached_data_json, save_data_json_to_cache
 
 
+# data.py is run in a forked child of a job pool process, which has already
+# imported the common scientific modules (see preload_data_py_modules), so
+# that a small data generator does not pay for the interpreter startup and
+# the numpy/scipy imports. The child runs with cpu time, memory and file size
+# limits. The output of a deterministic data.py is cached (see data_cache.py).
+# This needs fork and the resource module, so (like the file locking of the
+# data directory) it is POSIX only.
+
+DATA_PY_PRELOAD_MODULES = [m for m in os.environ.get('STAN_PLAYGROUND_DATA_PY_PRELOAD_MODULES', 'numpy,scipy,scipy.stats,pandas').split(',') if m]
+DATA_PY_MAX_CPU_SEC = int(os.environ.get('STAN_PLAYGROUND_DATA_PY_MAX_CPU_SEC', 600))
+DATA_PY_MAX_MEMORY_BYTES = int(os.environ.get('STAN_PLAYGROUND_DATA_PY_MAX_MEMORY_BYTES', 4 * 1024 * 1024 * 1024))
+DATA_PY_MAX_FILE_BYTES = int(os.environ.get('STAN_PLAYGROUND_DATA_PY_MAX_FILE_BYTES', 1024 * 1024 * 1024))
+DATA_PY_TIMEOUT_SEC = int(os.environ.get('STAN_PLAYGROUND_DATA_PY_TIMEOUT_SEC', 1200))
+
+def preload_data_py_modules():
+    """Import the modules that data.py scripts commonly use (those that are installed)"""
+    for module_name in DATA_PY_PRELOAD_MODULES:
+        try:
+            importlib.import_module(module_name)
+        except Exception:
+            pass
+
 def generate_analysis_data(analysis_id: str, *, dir: str):
     analysis_path = f'{dir}/analyses/{analysis_id}'
 
     data_py_path = f'{analysis_path}/data.py'
     if not os.path.exists(data_py_path):
         raise Exception(f'Unable to find data.py file for analysis {analysis_id}')
-    
+    data_json_path = f'{analysis_path}/data.json'
+
+    # the output of a deterministic data.py is cached (see data_cache.py)
+    with open(data_py_path, 'rb') as f:
+        cache_key = get_data_cache_key(f.read(), module_names=[m.split('.')[0] for m in DATA_PY_PRELOAD_MODULES])
+
     # execute data.py in a separate process, writing the console output to data.console.txt, including the stderr, and waiting for return
     # we want to be in the analysis_path as the working directory
     data_console_path = f'{analysis_path}/data.console.txt'
@@ -20,20 +54,107 @@ def generate_analysis_data(analysis_id: str, *, dir: str):
         # write a timestamp line to the file
         f.write(f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())}\n')
         f.write(f'============================\n')
+        f.flush()
         timer = time.time()
-        return_code = subprocess.call(
-            ['python', 'data.py'],
-            cwd=analysis_path,
-            stdout=f,
-            stderr=subprocess.STDOUT
-        )
+        if cache_key is not None:
+            with data_cache_entry_lock(cache_key, dir=dir):
+                if restore_cached_data_json(cache_key, data_json_path, dir=dir):
+                    f.write(f'data.py is deterministic and unchanged: using the cached data.json\n')
+                    return_code = 0
+                else:
+                    return_code = _run_data_py(analysis_path, console=f)
+                    if return_code == 0:
+                        save_data_json_to_cache(cache_key, data_json_path, dir=dir)
+            evict_data_cache(dir=dir, keep=cache_key)
+        else:
+            return_code = _run_data_py(analysis_path, console=f)
         elapsed = time.time() - timer
         f.write(f'============================\n')
+        if return_code == -signal.SIGXCPU or return_code == -signal.SIGKILL:
+            f.write(f'data.py was terminated: cpu time limit ({DATA_PY_MAX_CPU_SEC} seconds) or timeout ({DATA_PY_TIMEOUT_SEC} seconds) exceeded\n')
         f.write(f'Elapsed time: {elapsed:.2f} seconds\n')
-        f.write(f'Data size (bytes): {os.path.getsize(f"{analysis_path}/data.json")}\n')
+        f.write(f'Data size (bytes): {os.path.getsize(data_json_path)}\n')
         f.write(f'Return code: {return_code}\n')
 
     # if the return code is not zero, then raise an exception
     if return_code != 0:
         raise Exception(f'Error executing data.py for analysis {analysis_id}')
-        
\ No newline at end of file
+
+    # so that cloning the analysis does not copy (or hash) the data
+    intern_file(data_json_path, dir=dir)
+    intern_file(f'{analysis_path}/data.npz', dir=dir)
+
+def _run_data_py(analysis_path: str, *, console) -> int:
+    # the data files may be hardlinks into the data cache or the blob store, which data.py must not overwrite in place
+    make_private_copy(f'{analysis_path}/data.json')
+    make_private_copy(f'{analysis_path}/data.npz')
+    return _run_data_py_in_forked_child(analysis_path, console=console)
+
+def _run_data_py_in_forked_child(analysis_path: str, *, console) -> int:
+    # returns the exit code of the child, or minus the signal that terminated it
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            code = _data_py_child_main(analysis_path, console=console)
+        finally:
+            os._exit(code)
+    deadline = time.time() + DATA_PY_TIMEOUT_SEC
+    poll_interval_sec = 0.005
+    while True:
+        wpid, status = os.waitpid(pid, os.WNOHANG)
+        if wpid != 0:
+            break
+        if time.time() > deadline:
+            os.kill(pid, signal.SIGKILL)
+            _, status = os.waitpid(pid, 0)
+            break
+        time.sleep(poll_interval_sec)
+        poll_interval_sec = min(poll_interval_sec * 2, 0.1)
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+def _data_py_child_main(analysis_path: str, *, console) -> int:
+    # runs in the forked child
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(console.fileno(), 1)
+    os.dup2(console.fileno(), 2)
+    os.chdir(analysis_path)
+    # SIGXCPU at the soft cpu limit, SIGKILL at the hard one
+    _lower_limit(resource.RLIMIT_CPU, DATA_PY_MAX_CPU_SEC, DATA_PY_MAX_CPU_SEC + 5)
+    _lower_limit(resource.RLIMIT_AS, DATA_PY_MAX_MEMORY_BYTES, DATA_PY_MAX_MEMORY_BYTES)
+    _lower_limit(resource.RLIMIT_FSIZE, DATA_PY_MAX_FILE_BYTES, DATA_PY_MAX_FILE_BYTES)
+    # as if run by "python data.py"
+    sys.argv = ['data.py']
+    sys.path.insert(0, analysis_path)
+    code = 0
+    try:
+        runpy.run_path('data.py', run_name='__main__')
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return code
+
+def _lower_limit(kind: int, soft: int, hard: int):
+    # the limits can only be lowered
+    current_soft, current_hard = resource.getrlimit(kind)
+    if current_hard != resource.RLIM_INFINITY:
+        hard = min(hard, current_hard)
+    soft = min(soft, hard)
+    if current_soft != resource.RLIM_INFINITY:
+        soft = min(soft, current_soft)
+    resource.setrlimit(kind, (soft, hard))
@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import random
+import string
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Union
+from .generate_analysis_data import preload_data_py_modules
+
+
+# Long-running service requests (model compilation, data generation) are run
+# as background jobs in a bounded process pool so that they do not block the
+# service. The state of each job is kept in a small json file in the data
+# directory so that it can be queried from any service process. The pool
+# processes preload the modules that data.py scripts commonly use.
+
+MAX_JOB_WORKERS = int(os.environ.get('STAN_PLAYGROUND_MAX_JOB_WORKERS', 2))
+MAX_PENDING_JOBS = 100
+JOB_RECORD_MAX_AGE_SEC = 60 * 60 * 24
+
+_pool: Union[ProcessPoolExecutor, None] = None
+_pool_lock = threading.Lock()
+_num_pending_jobs = 0
+
+def submit_job(job_type: str, fn: Callable, args: tuple, kwargs: dict, *, analysis_id: str, dir: str) -> str:
+    """Run fn(*args, **kwargs) in the job pool and return the id of the job
+
+    fn must be a module-level function so that it can be sent to the pool.
+    """
+    global _num_pending_jobs
+    jobs_dir = f'{dir}/.jobs'
+    os.makedirs(jobs_dir, exist_ok=True)
+    _remove_old_job_records(jobs_dir)
+    with _pool_lock:
+        if _num_pending_jobs >= MAX_PENDING_JOBS:
+            raise Exception('Too many pending jobs. Please try again later.')
+        _num_pending_jobs += 1
+    job_id = _random_job_id(12)
+    job_path = f'{jobs_dir}/{job_id}.json'
+    _write_job_record(job_path, {
+        'job_id': job_id,
+        'job_type': job_type,
+        'analysis_id': analysis_id,
+        'status': 'queued',
+        'error': None,
+        'timestamp_submitted': time.time(),
+        'timestamp_started': None,
+        'timestamp_finished': None
+    })
+    future = _get_pool().submit(_run_job, job_path, fn, args, kwargs)
+    future.add_done_callback(lambda f: _on_job_done(f, job_path))
+    return job_id
+
+def warm_up_job_pool():
+    """Start the pool processes ahead of the first job"""
+    pool = _get_pool()
+    for _ in range(MAX_JOB_WORKERS):
+        pool.submit(_noop)
+
+def get_job_status(job_id: str, *, dir: str) -> dict:
+    if not all(c.isalnum() for c in job_id):
+        raise Exception(f'Invalid job id: {job_id}')
+    job_path = f'{dir}/.jobs/{job_id}.json'
+    if not os.path.exists(job_path):
+        raise Exception(f'Job not found: {job_id}')
+    with open(job_path, 'r') as f:
+        return json.load(f)
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn rather than fork because the service process may be multi-threaded
+            _pool = ProcessPoolExecutor(max_workers=MAX_JOB_WORKERS, mp_context=multiprocessing.get_context('spawn'), initializer=preload_data_py_modules)
+        return _pool
+
+def _noop():
+    pass
+
+def _run_job(job_path: str, fn: Callable, args: tuple, kwargs: dict):
+    # runs in a pool process
+    record = _read_job_record(job_path)
+    record['status'] = 'running'
+    record['timestamp_started'] = time.time()
+    _write_job_record(job_path, record)
+    try:
+        fn(*args, **kwargs)
+    except Exception as e:
+        record['status'] = 'failed'
+        record['error'] = str(e)
+    else:
+        record['status'] = 'completed'
+    record['timestamp_finished'] = time.time()
+    _write_job_record(job_path, record)
+
+def _on_job_done(future: Future, job_path: str):
+    global _num_pending_jobs
+    with _pool_lock:
+        _num_pending_jobs -= 1
+    err = future.exception()
+    if err is not None:
+        # the pool process died before the job could record its outcome
+        record = _read_job_record(job_path)
+        record['status'] = 'failed'
+        record['error'] = str(err)
+        record['timestamp_finished'] = time.time()
+        _write_job_record(job_path, record)
+
+def _read_job_record(job_path: str) -> dict:
+    with open(job_path, 'r') as f:
+        return json.load(f)
+
+def _write_job_record(job_path: str, record: dict):
+    tmp_path = f'{job_path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f)
+    os.rename(tmp_path, job_path)
+
+def _remove_old_job_records(jobs_dir: str):
+    cutoff = time.time() - JOB_RECORD_MAX_AGE_SEC
+    for fname in os.listdir(jobs_dir):
+        path = f'{jobs_dir}/{fname}'
+        try:
+            if os.stat(path).st_mtime < cutoff:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def _random_job_id(num_chars: int) -> str:
+    # include lowercase and digits
+    return ''.join(random.choice(string.ascii_lowercase + string.digits) for _ in range(num_chars))
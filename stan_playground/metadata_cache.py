@@ -0,0 +1,93 @@
+import os
+import copy
+import time
+import threading
+from typing import Any
+from collections import OrderedDict
+from contextlib import contextmanager
+import yaml
+
+
+# In-process read-through cache of the small metadata files (analysis.yaml,
+# options.yaml, project.yaml, .edit_token, description.md) that are read by
+# almost every request. An entry is valid as long as the (inode, mtime, size)
+# of the file is unchanged; since the metadata files are replaced by
+# renaming, a rewrite always gets a new inode.
+
+MAX_CACHED_FILES = 4096
+MAX_CACHED_TEXT_SIZE = 1024 * 1024
+
+# files modified less than this long ago are not cached, because a second
+# modification within the resolution of the file system timestamps would go
+# unnoticed (as for "racily clean" entries of the git index)
+_RACY_INTERVAL_NS = 1000 * 1000 * 1000
+
+# use the LibYAML parser if PyYAML was built with it
+_YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+_cache: 'OrderedDict[tuple, tuple]' = OrderedDict()
+_cache_lock = threading.Lock()
+
+# the snapshot of the current batch of queries (per thread), see metadata_snapshot
+_snapshot = threading.local()
+
+@contextmanager
+def metadata_snapshot():
+    """Share the parsed metadata files between the operations of a batch
+
+    Within the snapshot, recently modified files are also kept (they are
+    still checked against the signature of the file), so that the files
+    written by one operation of the batch are parsed only once by the next
+    ones.
+    """
+    if getattr(_snapshot, 'entries', None) is not None:
+        yield # nested
+        return
+    _snapshot.entries = {}
+    try:
+        yield
+    finally:
+        _snapshot.entries = None
+
+def load_yaml_file(path: str) -> Any:
+    """Parse a yaml file (safe loader), or return the cached result if the file is unchanged
+
+    The caller gets its own copy, which it may modify.
+    """
+    return copy.deepcopy(_read_cached(path, kind='yaml'))
+
+def read_text_file(path: str) -> str:
+    """Read a text file, or return the cached contents if the file is unchanged"""
+    return _read_cached(path, kind='text')
+
+def _read_cached(path: str, *, kind: str) -> Any:
+    key = (kind, path)
+    st = os.stat(path)
+    with _cache_lock:
+        entry = _cache.get(key, None)
+        if entry is not None and entry[0] == _get_signature(st):
+            _cache.move_to_end(key)
+            return entry[1]
+    snapshot_entries = getattr(_snapshot, 'entries', None)
+    if snapshot_entries is not None:
+        entry = snapshot_entries.get(key, None)
+        if entry is not None and entry[0] == _get_signature(st):
+            return entry[1]
+    with open(path, 'r') as f:
+        # the signature of the file that is actually read
+        signature = _get_signature(os.fstat(f.fileno()))
+        text = f.read()
+    value = yaml.load(text, Loader=_YamlLoader) if kind == 'yaml' else text
+    if time.time_ns() - signature[1] > _RACY_INTERVAL_NS and len(text) <= MAX_CACHED_TEXT_SIZE:
+        with _cache_lock:
+            _cache[key] = (signature, value)
+            _cache.move_to_end(key)
+            while len(_cache) > MAX_CACHED_FILES:
+                _cache.popitem(last=False)
+    elif snapshot_entries is not None:
+        # metadata files are replaced by renaming, so a rewrite during the batch changes the signature
+        snapshot_entries[key] = (signature, value)
+    return value
+
+def _get_signature(st: os.stat_result) -> tuple:
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
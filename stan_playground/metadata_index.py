@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import List, Tuple, Union
+import yaml
+
+
+# The index is a cache of the analysis.yaml and project.yaml files so that
+# listings do not need to walk and parse the whole data directory. The yaml
+# files remain the source of truth and the index can always be rebuilt from
+# them (stan-playground rebuild-index).
+#
+# The index also holds the change log: every write of an analysis.yaml or
+# project.yaml (by the service or by the worker) is recorded with a
+# monotonically increasing version, in the same transaction as the index
+# update, so that clients can fetch only the changes since the version they
+# have seen (see get_changes_since). The oldest entries are pruned.
+
+CHANGE_LOG_MAX_ENTRIES = int(os.environ.get('STAN_PLAYGROUND_CHANGE_LOG_MAX_ENTRIES', 100000))
+
+_local = threading.local()
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS index_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS analyses (
+    analysis_id TEXT PRIMARY KEY,
+    status TEXT,
+    owner_id TEXT,
+    project_id TEXT,
+    listed INTEGER,
+    deleted INTEGER,
+    timestamp_created REAL,
+    timestamp_modified REAL,
+    timestamp_queued REAL,
+    info TEXT
+);
+CREATE INDEX IF NOT EXISTS analyses_project_id ON analyses (project_id);
+CREATE INDEX IF NOT EXISTS analyses_owner_id ON analyses (owner_id);
+CREATE INDEX IF NOT EXISTS analyses_status ON analyses (status);
+CREATE INDEX IF NOT EXISTS analyses_listed ON analyses (listed, deleted);
+CREATE TABLE IF NOT EXISTS projects (
+    project_id TEXT PRIMARY KEY,
+    owner_id TEXT,
+    listed INTEGER,
+    timestamp_created REAL,
+    timestamp_modified REAL,
+    config TEXT
+);
+CREATE INDEX IF NOT EXISTS projects_owner_id ON projects (owner_id);
+CREATE INDEX IF NOT EXISTS projects_listed ON projects (listed);
+CREATE TABLE IF NOT EXISTS project_users (
+    project_id TEXT,
+    user_id TEXT
+);
+CREATE INDEX IF NOT EXISTS project_users_project_id ON project_users (project_id);
+CREATE INDEX IF NOT EXISTS project_users_user_id ON project_users (user_id);
+CREATE TABLE IF NOT EXISTS changes (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT,
+    id TEXT,
+    timestamp REAL,
+    owner_id TEXT,
+    data TEXT
+);
+CREATE TABLE IF NOT EXISTS analysis_queue (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    analysis_id TEXT UNIQUE,
+    timestamp_queued REAL
+);
+'''
+
+def get_index_connection(*, dir: str) -> sqlite3.Connection:
+    """Return the (per-thread) connection to the index of the data directory, building the index if needed"""
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = {}
+        _local.connections = connections
+    key = (os.getpid(), dir)
+    conn = connections.get(key, None)
+    if conn is None:
+        conn = sqlite3.connect(f'{dir}/.stan_playground_index.db', timeout=60, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(_SCHEMA)
+        connections[key] = conn
+        if not _is_built(conn):
+            with transaction(conn):
+                # check again now that we hold the write lock, in case another process built it meanwhile
+                if not _is_built(conn):
+                    _rebuild(conn, dir=dir)
+    return conn
+
+def rebuild_index(*, dir: str) -> None:
+    """Rebuild the index by scanning the analyses and projects directories"""
+    conn = get_index_connection(dir=dir)
+    with transaction(conn):
+        _rebuild(conn, dir=dir)
+
+def index_analysis(analysis_id: str, info: dict, *, dir: str) -> None:
+    """Record the contents of analysis.yaml for an analysis in the index"""
+    conn = get_index_connection(dir=dir)
+    with transaction(conn):
+        _insert_analysis(conn, analysis_id, info)
+        _log_change(conn, 'analysis', analysis_id, info, owner_id=info.get('owner_id', info.get('user_id', None)))
+
+def index_project(project_id: str, config: dict, *, dir: str) -> None:
+    """Record the contents of project.yaml for a project in the index"""
+    conn = get_index_connection(dir=dir)
+    with transaction(conn):
+        _insert_project(conn, project_id, config)
+        _log_change(conn, 'project', project_id, config, owner_id=config.get('owner_id', None))
+
+def remove_project_from_index(project_id: str, *, dir: str) -> None:
+    conn = get_index_connection(dir=dir)
+    with transaction(conn):
+        # the removal is only reported to the former owner
+        row = conn.execute('SELECT owner_id FROM projects WHERE project_id = ?', (project_id,)).fetchone()
+        conn.execute('DELETE FROM projects WHERE project_id = ?', (project_id,))
+        conn.execute('DELETE FROM project_users WHERE project_id = ?', (project_id,))
+        _log_change(conn, 'project', project_id, None, owner_id=row[0] if row is not None else None)
+
+def get_changes_since(since: int, *, dir: str, limit: int) -> Tuple[int, List[dict], bool]:
+    """Return the changes after version since, oldest first
+
+    Returns the version to ask for next time, up to limit changes (each with
+    version, kind, id, timestamp, owner_id and data, the new contents of the
+    yaml file or None if it was removed), and whether the client needs to start over
+    from a full snapshot because the changes it has not seen were pruned.
+    """
+    conn = get_index_connection(dir=dir)
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+    current_version = row[0] if row is not None else 0
+    row = conn.execute("SELECT value FROM index_meta WHERE key = 'changes_pruned_through'").fetchone()
+    pruned_through = int(row[0]) if row is not None else 0
+    if since < pruned_through or since > current_version:
+        # (a version from the future means that the index was recreated)
+        return current_version, [], True
+    changes = [
+        {'version': version, 'kind': kind, 'id': id, 'timestamp': timestamp, 'owner_id': owner_id, 'data': json.loads(data) if data is not None else None}
+        for version, kind, id, timestamp, owner_id, data in conn.execute(
+            'SELECT version, kind, id, timestamp, owner_id, data FROM changes WHERE version > ? ORDER BY version LIMIT ?',
+            (since, limit)
+        )
+    ]
+    next_version = changes[-1]['version'] if len(changes) == limit else current_version
+    return next_version, changes, False
+
+def get_indexed_analyses(*, dir: str, project_id: Union[str, None]=None, status: Union[str, None]=None, listed_only: bool=False, include_deleted: bool=True) -> List[Tuple[str, dict]]:
+    """Return (analysis_id, info) pairs for the analyses matching the filters, ordered by analysis id"""
+    conditions = []
+    params = []
+    if project_id is not None:
+        conditions.append('project_id = ?')
+        params.append(project_id)
+    if status is not None:
+        conditions.append('status = ?')
+        params.append(status)
+    if listed_only:
+        conditions.append('listed = 1')
+    if not include_deleted:
+        conditions.append('deleted = 0')
+    sql = 'SELECT analysis_id, info FROM analyses'
+    if len(conditions) > 0:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY analysis_id'
+    conn = get_index_connection(dir=dir)
+    return [(analysis_id, json.loads(info)) for analysis_id, info in conn.execute(sql, params)]
+
+def get_indexed_projects(*, dir: str, listed_only: bool=False, user_id: Union[str, None]=None) -> List[Tuple[str, dict]]:
+    """Return (project_id, config) pairs for the projects matching the filters, ordered by project id
+
+    If user_id is given, only projects that are owned by the user or that list
+    the user among their users are returned.
+    """
+    conditions = []
+    params = []
+    if listed_only:
+        conditions.append('listed = 1')
+    if user_id is not None:
+        conditions.append('(owner_id = ? OR project_id IN (SELECT project_id FROM project_users WHERE user_id = ?))')
+        params.extend([user_id, user_id])
+    sql = 'SELECT project_id, config FROM projects'
+    if len(conditions) > 0:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY project_id'
+    conn = get_index_connection(dir=dir)
+    return [(project_id, json.loads(config)) for project_id, config in conn.execute(sql, params)]
+
+def _insert_analysis(conn: sqlite3.Connection, analysis_id: str, info: dict):
+    conn.execute(
+        'INSERT OR REPLACE INTO analyses (analysis_id, status, owner_id, project_id, listed, deleted, timestamp_created, timestamp_modified, timestamp_queued, info) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        (
+            analysis_id,
+            info.get('status', 'none'),
+            info.get('owner_id', info.get('user_id', None)),
+            info.get('project_id', None),
+            1 if info.get('listed', False) else 0,
+            1 if info.get('deleted', False) else 0,
+            info.get('timestamp_created', None),
+            info.get('timestamp_modified', None),
+            info.get('timestamp_queued', None),
+            json.dumps(info)
+        )
+    )
+
+def _insert_project(conn: sqlite3.Connection, project_id: str, config: dict):
+    conn.execute(
+        'INSERT OR REPLACE INTO projects (project_id, owner_id, listed, timestamp_created, timestamp_modified, config) VALUES (?, ?, ?, ?, ?, ?)',
+        (
+            project_id,
+            config.get('owner_id', None),
+            1 if config.get('listed', False) else 0,
+            config.get('timestamp_created', None),
+            config.get('timestamp_modified', None),
+            json.dumps(config)
+        )
+    )
+    conn.execute('DELETE FROM project_users WHERE project_id = ?', (project_id,))
+    for user in config.get('users', []) or []:
+        user_id = user.get('user_id', None)
+        if user_id is not None:
+            conn.execute('INSERT INTO project_users (project_id, user_id) VALUES (?, ?)', (project_id, user_id))
+
+def _log_change(conn: sqlite3.Connection, kind: str, id: str, data: Union[dict, None], *, owner_id: Union[str, None]):
+    cursor = conn.execute(
+        'INSERT INTO changes (kind, id, timestamp, owner_id, data) VALUES (?, ?, ?, ?, ?)',
+        (kind, id, time.time(), owner_id, json.dumps(data) if data is not None else None)
+    )
+    version = cursor.lastrowid
+    if version % 1000 == 0 and version > CHANGE_LOG_MAX_ENTRIES:
+        conn.execute('DELETE FROM changes WHERE version <= ?', (version - CHANGE_LOG_MAX_ENTRIES,))
+        conn.execute("INSERT OR REPLACE INTO index_meta (key, value) VALUES ('changes_pruned_through', ?)", (str(version - CHANGE_LOG_MAX_ENTRIES),))
+
+def _is_built(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT value FROM index_meta WHERE key = 'built'").fetchone() is not None
+
+def _rebuild(conn: sqlite3.Connection, *, dir: str):
+    conn.execute('DELETE FROM analyses')
+    conn.execute('DELETE FROM projects')
+    conn.execute('DELETE FROM project_users')
+    analyses_dir = f'{dir}/analyses'
+    if os.path.isdir(analyses_dir):
+        for analysis_id in os.listdir(analyses_dir):
+            analysis_yaml_path = f'{analyses_dir}/{analysis_id}/analysis.yaml'
+            if not os.path.isfile(analysis_yaml_path):
+                continue
+            with open(analysis_yaml_path, 'r') as f:
+                info = yaml.safe_load(f) or {}
+            _insert_analysis(conn, analysis_id, info)
+    projects_dir = f'{dir}/projects'
+    if os.path.isdir(projects_dir):
+        for project_id in os.listdir(projects_dir):
+            project_yaml_path = f'{projects_dir}/{project_id}/project.yaml'
+            if not os.path.isfile(project_yaml_path):
+                continue
+            with open(project_yaml_path, 'r') as f:
+                config = yaml.safe_load(f) or {}
+            _insert_project(conn, project_id, config)
+    conn.execute("INSERT OR REPLACE INTO index_meta (key, value) VALUES ('built', '1')")
+
+@contextmanager
+def transaction(conn: sqlite3.Connection):
+    # BEGIN IMMEDIATE takes the write lock up front so that concurrent
+    # processes serialize instead of failing on lock upgrade
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
@@ -0,0 +1,102 @@
+import os
+import fcntl
+from typing import Union
+from contextlib import contextmanager
+import yaml
+from .metadata_index import index_analysis, index_project
+from .metadata_cache import load_yaml_file
+
+
+# All writes of analysis.yaml and project.yaml go through this module. Each
+# read-modify-write happens while holding an exclusive lock on the analysis
+# (or project) directory, and files are replaced by writing to a temporary
+# file and renaming it, so that concurrent service processes and workers
+# never lose updates or see a truncated file.
+
+# values assumed for fields that are missing from analysis.yaml
+_ANALYSIS_INFO_DEFAULTS = {
+    'status': 'none'
+}
+
+@contextmanager
+def exclusive_lock(path: str):
+    """Hold an exclusive lock on a lock file (a path ending in .lock, created if needed) or on a directory
+
+    A missing directory (e.g. of an analysis that does not exist) raises
+    FileNotFoundError rather than being created as an empty file.
+    """
+    if path.endswith('.lock'):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    else:
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # closing the file descriptor releases the lock
+        os.close(fd)
+
+def write_text_atomic(path: str, text: str) -> None:
+    """Replace the contents of a file so that readers see either the old or the new contents
+
+    This also means that a file that is hard linked elsewhere is never modified in place.
+    """
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.rename(tmp_path, path)
+
+def read_analysis_info(analysis_id: str, *, dir: str) -> dict:
+    info_path = f'{dir}/analyses/{analysis_id}/analysis.yaml'
+    if not os.path.exists(info_path):
+        return {}
+    return load_yaml_file(info_path) or {}
+
+def set_analysis_info(analysis_id: str, info: dict, *, dir: str) -> None:
+    with exclusive_lock(f'{dir}/analyses/{analysis_id}'):
+        _write_analysis_info(analysis_id, info, dir=dir)
+
+def update_analysis_info(analysis_id: str, *, dir: str, update: dict, expected: Union[dict, None]=None) -> Union[dict, None]:
+    """Atomically apply an update to analysis.yaml and return the new info
+
+    If expected is given, the update is only applied if the current values of
+    those fields match (compare-and-swap); otherwise nothing is written and
+    None is returned.
+    """
+    with exclusive_lock(f'{dir}/analyses/{analysis_id}'):
+        info = read_analysis_info(analysis_id, dir=dir)
+        if expected is not None:
+            for k, v in expected.items():
+                if info.get(k, _ANALYSIS_INFO_DEFAULTS.get(k, None)) != v:
+                    return None
+        for k, v in update.items():
+            info[k] = v
+        _write_analysis_info(analysis_id, info, dir=dir)
+        return info
+
+def read_project_config(project_id: str, *, dir: str) -> dict:
+    config_path = f'{dir}/projects/{project_id}/project.yaml'
+    if not os.path.exists(config_path):
+        return {}
+    return load_yaml_file(config_path) or {}
+
+def set_project_config(project_id: str, config: dict, *, dir: str) -> None:
+    with exclusive_lock(f'{dir}/projects/{project_id}'):
+        _write_project_config(project_id, config, dir=dir)
+
+def update_project_config(project_id: str, *, dir: str, update: dict) -> dict:
+    """Atomically apply an update to project.yaml and return the new config"""
+    with exclusive_lock(f'{dir}/projects/{project_id}'):
+        config = read_project_config(project_id, dir=dir)
+        for k, v in update.items():
+            config[k] = v
+        _write_project_config(project_id, config, dir=dir)
+        return config
+
+def _write_analysis_info(analysis_id: str, info: dict, *, dir: str):
+    write_text_atomic(f'{dir}/analyses/{analysis_id}/analysis.yaml', yaml.safe_dump(info))
+    index_analysis(analysis_id, info, dir=dir)
+
+def _write_project_config(project_id: str, config: dict, *, dir: str):
+    write_text_atomic(f'{dir}/projects/{project_id}/project.yaml', yaml.safe_dump(config))
+    index_project(project_id, config, dir=dir)
@@ -0,0 +1,117 @@
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import subprocess
+from contextlib import contextmanager
+from typing import IO, Iterator, Tuple, Union
+from .cache_utils import cache_entry_lock, canonicalize_stan_source, get_dir_size
+
+
+# Compiled models are stored in a content-addressed cache in the data
+# directory, keyed by a hash of the canonicalized Stan program, the CmdStan
+# installation and the compiler options, so that clones and reruns of an
+# identical main.stan do not recompile.
+
+MODEL_CACHE_MAX_BYTES = int(os.environ.get('STAN_PLAYGROUND_MODEL_CACHE_MAX_BYTES', 5 * 1024 * 1024 * 1024))
+
+@contextmanager
+def use_compiled_model(stan_file: str, *, dir: str, cpp_options: Union[dict, None]=None, console: Union[IO, None]=None) -> Iterator[Tuple[str, bool]]:
+    """Yield the path of the compiled executable for a Stan program, compiling it if it is not in the cache
+
+    The second value is True if the executable was found in the cache. The
+    cache entry holds a shared lock until the block exits, so that it is not
+    evicted (by this or another process) while the executable is in use.
+    Compiler output is written to console if provided, otherwise printed.
+    """
+    from cmdstanpy import cmdstan_path
+
+    with open(stan_file, 'r') as f:
+        source = f.read()
+    key = _get_model_cache_key(source, cmdstan_dir=cmdstan_path(), cpp_options=cpp_options or {})
+    cache_dir = f'{dir}/.model_cache'
+    os.makedirs(cache_dir, exist_ok=True)
+    entry_dir = f'{cache_dir}/{key}'
+    # the exe must be named after the stan file, otherwise cmdstanpy refuses it
+    exe_path = f'{entry_dir}/main'
+    with open(f'{cache_dir}/{key}.lock', 'w') as lock_file:
+        cache_hit = True
+        while True:
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+            if os.path.exists(exe_path):
+                break
+            # converting the lock is not atomic, so the entry is checked again after each conversion
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if not os.path.exists(exe_path):
+                _compile_model(source, entry_dir=entry_dir, cpp_options=cpp_options, console=console)
+                cache_hit = False
+        if cache_hit:
+            # mark as recently used for the LRU eviction
+            os.utime(entry_dir)
+        else:
+            _evict_least_recently_used(cache_dir, max_bytes=MODEL_CACHE_MAX_BYTES, keep=key)
+        yield exe_path, cache_hit
+        # closing the lock file releases the lock
+
+def _compile_model(source: str, *, entry_dir: str, cpp_options: Union[dict, None], console: Union[IO, None]):
+    from cmdstanpy import cmdstan_path
+
+    build_dir = f'{entry_dir}.tmp-{os.getpid()}'
+    if os.path.exists(build_dir):
+        shutil.rmtree(build_dir)
+    os.makedirs(build_dir)
+    try:
+        with open(f'{build_dir}/main.stan', 'w') as f:
+            f.write(source)
+        cmd = ['make', f'{os.path.abspath(build_dir)}/main'] + [f'{k}={v}' for k, v in sorted((cpp_options or {}).items())]
+        if console is not None:
+            return_code = subprocess.call(cmd, cwd=cmdstan_path(), stdout=console, stderr=subprocess.STDOUT)
+        else:
+            result = subprocess.run(cmd, cwd=cmdstan_path(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            print(result.stdout.decode('utf-8', errors='replace'))
+            return_code = result.returncode
+        if return_code != 0:
+            raise Exception(f'Error compiling model (return code {return_code})')
+        os.rename(build_dir, entry_dir)
+    finally:
+        if os.path.exists(build_dir):
+            shutil.rmtree(build_dir)
+
+def _get_model_cache_key(source: str, *, cmdstan_dir: str, cpp_options: dict) -> str:
+    make_local_path = f'{cmdstan_dir}/make/local'
+    if os.path.exists(make_local_path):
+        with open(make_local_path, 'r') as f:
+            make_local = f.read()
+    else:
+        make_local = ''
+    x = {
+        'source': canonicalize_stan_source(source),
+        # the cmdstan installation directory is version specific (e.g. cmdstan-2.32.2)
+        'cmdstan': os.path.basename(os.path.normpath(cmdstan_dir)),
+        'make_local': make_local,
+        'cpp_options': {k: str(v) for k, v in cpp_options.items()}
+    }
+    return hashlib.sha256(json.dumps(x, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _evict_least_recently_used(cache_dir: str, *, max_bytes: int, keep: str):
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry_dir = f'{cache_dir}/{name}'
+        if name.endswith('.lock') or '.tmp-' in name or not os.path.isdir(entry_dir):
+            continue
+        entries.append((os.stat(entry_dir).st_mtime, name, get_dir_size(entry_dir)))
+    total_size = sum(e[2] for e in entries)
+    entries.sort()
+    for _, name, size in entries:
+        if total_size <= max_bytes:
+            break
+        if name == keep:
+            continue
+        # entries that are in use hold a shared lock
+        with cache_entry_lock(cache_dir, name, blocking=False) as locked:
+            if not locked:
+                continue
+            print(f'Evicting compiled model from cache: {name}')
+            shutil.rmtree(f'{cache_dir}/{name}')
+        total_size -= size
@@ -0,0 +1,171 @@
+import os
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+from typing import List
+import numpy as np
+from .draws_store import read_draws_header, read_draws_range
+
+
+# Summary statistics of the posterior draws of a finished run, written to
+# output/<id>/summary.json. The statistics are computed from the draws store,
+# vectorized over the columns, a block of columns at a time so that the
+# memory used does not depend on the number of parameters. R-hat and the bulk
+# and tail ESS follow Vehtari et al. (2021), as in posterior / ArviZ.
+
+SUMMARY_BLOCK_BYTES = int(os.environ.get('STAN_PLAYGROUND_SUMMARY_BLOCK_BYTES', 256 * 1024 * 1024))
+
+QUANTILES = [0.05, 0.5, 0.95]
+
+_STAT_NAMES = ['mean', 'sd', 'mcse_mean'] + [f'q{round(q * 100)}' for q in QUANTILES] + ['ess_bulk', 'ess_tail', 'rhat']
+
+# temporary arrays of about this many times the size of the draws of a block are needed
+_WORK_FACTOR = 8
+
+def create_posterior_summary(output_dir: str, *, num_workers: int=1):
+    """Write summary.json for the draws store of a run
+
+    The blocks of columns are summarized in parallel by num_workers processes.
+    """
+    header = read_draws_header(output_dir)
+    columns: List[str] = header['columns']
+    chain_ids = sorted(int(chain_id) for chain_id in header['chains'].keys())
+    num_warmup_draws = header['num_warmup_draws']
+    # chains are truncated to a common length
+    num_draws = min([header['chains'][str(chain_id)]['num_draws'] for chain_id in chain_ids] or [0]) - num_warmup_draws
+    if len(columns) == 0 or num_draws < 4:
+        raise Exception('Not enough draws to summarize')
+
+    # every worker holds one block at a time
+    block_size = max(1, SUMMARY_BLOCK_BYTES // (num_workers * _WORK_FACTOR * 8 * len(chain_ids) * num_draws))
+    block_size = min(block_size, -(-len(columns) // num_workers))
+    blocks = [(start, min(start + block_size, len(columns))) for start in range(0, len(columns), block_size)]
+    # the column names are not needed to read the draws
+    block_header = {k: v for k, v in header.items() if k != 'columns'}
+    args = [(output_dir, block_header, start, end) for start, end in blocks]
+    if num_workers > 1 and len(blocks) > 1:
+        with ProcessPoolExecutor(max_workers=min(num_workers, len(blocks)), mp_context=multiprocessing.get_context('spawn')) as pool:
+            block_stats_list = list(pool.map(_summarize_columns, *zip(*args)))
+    else:
+        block_stats_list = [_summarize_columns(*a) for a in args]
+    stats = {k: np.concatenate([block_stats[k] for block_stats in block_stats_list]) for k in _STAT_NAMES}
+
+    summary = {
+        'columns': columns,
+        'num_chains': len(chain_ids),
+        'num_draws_per_chain': num_draws,
+        'quantiles': QUANTILES
+    }
+    for k in _STAT_NAMES:
+        # json has no nan or inf
+        summary[k] = [float(v) if np.isfinite(v) else None for v in stats[k]]
+    path = f'{output_dir}/summary.json'
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'w') as f:
+        json.dump(summary, f, separators=(',', ':'))
+    os.rename(tmp_path, path)
+
+def _summarize_columns(output_dir: str, header: dict, start: int, end: int) -> dict:
+    chain_ids = sorted(int(chain_id) for chain_id in header['chains'].keys())
+    num_warmup_draws = header['num_warmup_draws']
+    num_draws = min(header['chains'][str(chain_id)]['num_draws'] for chain_id in chain_ids) - num_warmup_draws
+    # (columns, chains, draws), so that the draws of a chain are contiguous
+    x = np.empty((end - start, len(chain_ids), num_draws))
+    for j in range(start, end):
+        for i, chain_id in enumerate(chain_ids):
+            x[j - start, i] = read_draws_range(output_dir, j, chain_id=chain_id, header=header, start=num_warmup_draws, end=num_warmup_draws + num_draws)
+    return _summarize_block(x)
+
+def _summarize_block(x: np.ndarray) -> dict:
+    num_columns, num_chains, num_draws = x.shape
+    flat = x.reshape(num_columns, num_chains * num_draws)
+    # a single sort gives the quantiles and the ranks
+    order = np.argsort(flat, axis=1)
+    sorted_draws = np.take_along_axis(flat, order, axis=1)
+    ret = {}
+    ret['mean'] = flat.mean(axis=1)
+    ret['sd'] = flat.std(axis=1, ddof=1)
+    for p in QUANTILES:
+        ret[f'q{round(p * 100)}'] = _quantile_of_sorted(sorted_draws, p)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ret['mcse_mean'] = ret['sd'] / np.sqrt(_ess(_split_chains(x)))
+
+    # rank normalized split chains
+    z = _split_chains(_rank_normalize(order).reshape(x.shape))
+    ret['ess_bulk'] = _ess(z)
+    # the tail ESS is the smaller ESS of the indicators of the 5% and 95% quantiles
+    q05 = _quantile_of_sorted(sorted_draws, 0.05)[:, None, None]
+    q95 = _quantile_of_sorted(sorted_draws, 0.95)[:, None, None]
+    ess_q05 = _ess(_split_chains((x <= q05).astype(np.float64)))
+    ess_q95 = _ess(_split_chains((x <= q95).astype(np.float64)))
+    ret['ess_tail'] = np.minimum(ess_q05, ess_q95)
+    # folded draws detect differences in scale between the chains
+    median = _quantile_of_sorted(sorted_draws, 0.5)[:, None]
+    del sorted_draws
+    order_folded = np.argsort(np.abs(flat - median), axis=1)
+    z_folded = _split_chains(_rank_normalize(order_folded).reshape(x.shape))
+    ret['rhat'] = np.maximum(_rhat(z), _rhat(z_folded))
+    return ret
+
+def _quantile_of_sorted(sorted_draws: np.ndarray, p: float) -> np.ndarray:
+    # linear interpolation, as np.quantile
+    h = (sorted_draws.shape[1] - 1) * p
+    lo = int(np.floor(h))
+    hi = min(lo + 1, sorted_draws.shape[1] - 1)
+    return sorted_draws[:, lo] + (h - lo) * (sorted_draws[:, hi] - sorted_draws[:, lo])
+
+def _split_chains(x: np.ndarray) -> np.ndarray:
+    # (columns, chains, draws) -> (columns, 2 * chains, draws // 2), dropping the middle draw if odd
+    n = x.shape[2] // 2
+    return np.concatenate([x[:, :, :n], x[:, :, x.shape[2] - n:]], axis=1)
+
+def _rank_normalize(order: np.ndarray) -> np.ndarray:
+    """Normal scores of the ranks, given the sort order of each row (ties are broken by position)"""
+    s = order.shape[1]
+    ranks = np.empty(order.shape, dtype=np.int64)
+    np.put_along_axis(ranks, order, np.arange(s)[None, :], axis=1)
+    # the normal scores are the same for every column, so they are computed once
+    normal_dist = NormalDist()
+    scores = np.array([normal_dist.inv_cdf((r + 1 - 3 / 8) / (s + 1 / 4)) for r in range(s)])
+    return scores[ranks]
+
+def _rhat(x: np.ndarray) -> np.ndarray:
+    num_draws = x.shape[2]
+    chain_means = x.mean(axis=2)
+    chain_vars = x.var(axis=2, ddof=1)
+    b = num_draws * chain_means.var(axis=1, ddof=1)
+    w = chain_vars.mean(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(((num_draws - 1) / num_draws * w + b / num_draws) / w)
+
+def _ess(x: np.ndarray) -> np.ndarray:
+    """ESS of (columns, chains, draws) draws, using Geyer's initial monotone sequence"""
+    _, num_chains, num_draws = x.shape
+    # autocovariances of each chain, via fft
+    centered = x - x.mean(axis=2, keepdims=True)
+    fft_size = 1 << (2 * num_draws - 1).bit_length()
+    f = np.fft.rfft(centered, n=fft_size, axis=2)
+    del centered
+    acov = np.fft.irfft(f.real ** 2 + f.imag ** 2, n=fft_size, axis=2)[:, :, :num_draws] / num_draws
+    del f
+    chain_vars = acov[:, :, 0] * num_draws / (num_draws - 1)
+    mean_var = chain_vars.mean(axis=1)
+    var_plus = mean_var * (num_draws - 1) / num_draws
+    if num_chains > 1:
+        var_plus = var_plus + x.mean(axis=2).var(axis=1, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rho = 1 - (mean_var[:, None] - acov.mean(axis=1)) / var_plus[:, None]
+    rho[:, 0] = 1
+    # sums of adjacent pairs of autocorrelations, truncated at the first negative one
+    num_pairs = num_draws // 2
+    p = rho[:, 0:2 * num_pairs:2] + rho[:, 1:2 * num_pairs:2]
+    p = np.where(np.cumprod(p > 0, axis=1).astype(bool), p, 0)
+    # ... and made monotone
+    p = np.minimum.accumulate(p, axis=1)
+    total = num_chains * num_draws
+    tau = np.maximum(-1 + 2 * p.sum(axis=1), 1 / np.log10(total))
+    ess = np.minimum(total / tau, total * np.log10(total))
+    # constant draws
+    ess[~(var_plus > 0)] = np.nan
+    return ess
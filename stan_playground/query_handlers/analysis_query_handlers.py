@@ -1,15 +1,20 @@
 from typing import Tuple, Union
 import os
-import yaml
 import shutil
 import time
 import random
 import string
-from ..create_summary import create_summary
+from ..create_summary import get_analyses_summary_page, update_analysis_summary
 from ..generate_access_code import check_valid_access_code
 from ..generate_analysis_data import generate_analysis_data
 from ..compile_analysis_model import compile_analysis_model
+from ..blob_store import clone_file, intern_file
+from ..cmdstan_data import NPZ_CACHE_FNAME
+from ..jobs import get_job_status, submit_job
 from .._get_full_path import _get_full_path
+from ..metadata_cache import load_yaml_file, read_text_file
+from ..metadata_store import read_analysis_info, set_analysis_info, update_analysis_info, write_text_atomic
+from ..work_queue import enqueue_analysis, remove_analysis_from_queue
 from ._check_valid import check_valid_analysis_id, check_valid_project_id
 
 
@@ -25,14 +30,16 @@ def handle_set_analysis_text_file(query: dict, *, dir: str, user_id: Union[str,
     if name in ['main.stan', 'data.json', 'description.md', 'options.yaml', 'data.py']:
         path = f'$dir/analyses/{analysis_id}/{name}'
         full_path = _get_full_path(path, dir=dir)
-        with open(full_path, 'w') as f:
-            f.write(text)
+        write_text_atomic(full_path, text)
+        if name == 'data.json':
+            # so that cloning the analysis does not copy (or hash) the data
+            intern_file(full_path, dir=_get_full_path('$dir', dir=dir))
 
         _update_analysis_info(analysis_id=analysis_id, dir=dir, update={
             'timestamp_modified': time.time()
         })
 
-        create_summary(dir=_get_full_path('$dir', dir=dir))
+        update_analysis_summary(analysis_id, dir=_get_full_path('$dir', dir=dir))
         return {'success': True}, b''
     else:
         raise Exception(f'Unexpected file name: {name}')
@@ -50,40 +57,95 @@ def handle_set_analysis_status(query: dict, *, dir: str, user_id: Union[str, Non
         if current_status != 'none':
             raise Exception(f'Unable to set status to "queued" because current status is "{current_status}"')
 
-        _update_analysis_info(analysis_id=analysis_id, dir=dir, update={
+        new_info = _update_analysis_info(analysis_id=analysis_id, dir=dir, expected={'status': current_status}, update={
             'status': 'queued',
             'error': None,
+            'continue_iter_sampling': None,
             'timestamp_queued': time.time(),
             'timestamp_modified': time.time()
         })
-        create_summary(dir=_get_full_path('$dir', dir=dir))
+        if new_info is None:
+            raise Exception(f'Unable to set status to "queued" because the status was changed concurrently')
+        enqueue_analysis(analysis_id, dir=_get_full_path('$dir', dir=dir))
+        update_analysis_summary(analysis_id, dir=_get_full_path('$dir', dir=dir))
         return {'success': True}, b''
     elif status == 'none':
         if not current_status in ['completed', 'failed', 'queued']:
             raise Exception(f'Unable to set status to "none" because current status is "{current_status}"')
-        _update_analysis_info(analysis_id=analysis_id, dir=dir, update={
+        if current_status == 'queued' and info.get('continue_iter_sampling', None) is not None:
+            # canceling the continuation of a run leaves the completed run as it was
+            new_info = _update_analysis_info(analysis_id=analysis_id, dir=dir, expected={'status': 'queued', 'continue_iter_sampling': info['continue_iter_sampling']}, update={
+                'status': 'completed',
+                'continue_iter_sampling': None,
+                'timestamp_queued': None,
+                'timestamp_modified': time.time()
+            })
+            if new_info is None:
+                raise Exception(f'Unable to cancel the run because the status was changed concurrently')
+            remove_analysis_from_queue(analysis_id, dir=_get_full_path('$dir', dir=dir))
+            update_analysis_summary(analysis_id, dir=_get_full_path('$dir', dir=dir))
+            return {'success': True}, b''
+        new_info = _update_analysis_info(analysis_id=analysis_id, dir=dir, expected={'status': current_status}, update={
             'status': 'none',
             'error': None,
+            'continue_iter_sampling': None,
             'timestamp_queued': None,
             'timestamp_started':None,
             'timestamp_completed': None,
             'timestamp_failed': None,
             'timestamp_modified': time.time()
         })
+        if new_info is None:
+            # e.g., the worker started running the analysis in the meantime
+            raise Exception(f'Unable to set status to "none" because the status was changed concurrently')
+        remove_analysis_from_queue(analysis_id, dir=_get_full_path('$dir', dir=dir))
         _clear_run_console_for_analysis(analysis_id, dir=dir)
         _clear_output_for_analysis(analysis_id, dir=dir)
-        create_summary(dir=_get_full_path('$dir', dir=dir))
+        update_analysis_summary(analysis_id, dir=_get_full_path('$dir', dir=dir))
         return {'success': True}, b''
     else:
         raise Exception(f'Unexpected status for set_analysis status: {status}')
 
+def handle_continue_analysis(query: dict, *, dir: str, user_id: Union[str, None]=None) -> Tuple[dict, bytes]:
+    analysis_id = query['analysis_id']
+    check_valid_analysis_id(analysis_id)
+
+    _check_can_edit_analysis(analysis_id=analysis_id, dir=dir, user_id=user_id, query=query)
+
+    # the number of additional iterations defaults to iter_sampling of options.yaml
+    iter_sampling = query.get('iter_sampling', None)
+    if iter_sampling is None:
+        options = _get_analysis_options(analysis_id=analysis_id, dir=dir)
+        iter_sampling = options.get('iter_sampling', None)
+    if not isinstance(iter_sampling, int) or isinstance(iter_sampling, bool) or iter_sampling <= 0:
+        raise Exception(f'Invalid iter_sampling: {iter_sampling}')
+
+    # the draws are appended to the completed run, so its output is kept
+    new_info = _update_analysis_info(analysis_id=analysis_id, dir=dir, expected={'status': 'completed'}, update={
+        'status': 'queued',
+        'error': None,
+        'continue_iter_sampling': iter_sampling,
+        'timestamp_queued': time.time(),
+        'timestamp_modified': time.time()
+    })
+    if new_info is None:
+        raise Exception(f'Unable to continue sampling because the analysis is not completed')
+    enqueue_analysis(analysis_id, dir=_get_full_path('$dir', dir=dir))
+    update_analysis_summary(analysis_id, dir=_get_full_path('$dir', dir=dir))
+    return {'success': True}, b''
+
 def handle_clone_analysis(query: dict, *, dir: str, user_id: Union[str, None]=None) -> Tuple[dict, bytes]:
     analysis_id = query['analysis_id']
     check_valid_analysis_id(analysis_id)
     new_analysis_id = _random_id(8)
     path = _get_full_path(f'$dir/analyses/{analysis_id}', dir=dir)
     path_new = _get_full_path(f'$dir/analyses/{new_analysis_id}', dir=dir)
-    shutil.copytree(path, path_new)
+    # large files are shared with the original rather than copied
+    shutil.copytree(
+        path, path_new,
+        copy_function=lambda src, dst: _clone_analysis_file(src, dst, dir=_get_full_path('$dir', dir=dir)),
+        ignore=shutil.ignore_patterns('*.tmp-*')
+    )
     if os.path.exists(f'{path_new}/analysis.yaml'):
         os.remove(f'{path_new}/analysis.yaml')
     if os.path.exists(f'{path_new}/.edit_token'):
@@ -95,11 +157,9 @@ def handle_clone_analysis(query: dict, *, dir: str, user_id: Union[str, None]=No
         'timestamp_modified': time.time(),
         'listed': False
     }
-    with open(f'{path_new}/analysis.yaml', 'w') as f:
-        yaml.dump(x, f)
+    _set_analysis_info(new_analysis_id, x, dir=dir)
     edit_token = _random_token(12)
-    with open(f'{path_new}/.edit_token', 'w') as f:
-        f.write(edit_token)
+    write_text_atomic(f'{path_new}/.edit_token', edit_token)
 
     # replace the title in description.md by one where "copy" is concatenated to the title
     with open(f'{path_new}/description.md', 'r') as f:
@@ -108,10 +168,9 @@ def handle_clone_analysis(query: dict, *, dir: str, user_id: Union[str, None]=No
     if lines[0].startswith('#'):
         lines[0] = lines[0] + ' copy'
     text = '\n'.join(lines)
-    with open(f'{path_new}/description.md', 'w') as f:
-        f.write(text)
+    write_text_atomic(f'{path_new}/description.md', text)
 
-    create_summary(dir=_get_full_path('$dir', dir=dir))
+    update_analysis_summary(new_analysis_id, dir=_get_full_path('$dir', dir=dir))
     return {'success': True, 'newAnalysisId': new_analysis_id, 'editToken': edit_token}, b''
 
 def handle_delete_analysis(query: dict, *, dir: str, user_id: Union[str, None]=None) -> Tuple[dict, bytes]:
@@ -123,7 +182,7 @@ def handle_delete_analysis(query: dict, *, dir: str, user_id: Union[str, None]=N
     _update_analysis_info(analysis_id=analysis_id, dir=dir, update={
         'deleted': True
     })
-    create_summary(dir=_get_full_path('$dir', dir=dir))
+    update_analysis_summary(analysis_id, dir=_get_full_path('$dir', dir=dir))
     return {'success': True}, b''
 
 def handle_undelete_analysis(query: dict, *, dir: str, user_id: Union[str, None]=None) -> Tuple[dict, bytes]:
@@ -136,7 +195,7 @@ def handle_undelete_analysis(query: dict, *, dir: str, user_id: Union[str, None]
         'deleted': False
     })    
 
-    create_summary(dir=_get_full_path('$dir', dir=dir))
+    update_analysis_summary(analysis_id, dir=_get_full_path('$dir', dir=dir))
     return {'success': True}, b''
 
 def handle_create_analysis(query: dict, *, dir: str, user_id: Union[str, None]=None) -> Tuple[dict, bytes]:
@@ -163,12 +222,10 @@ def handle_create_analysis(query: dict, *, dir: str, user_id: Union[str, None]=N
         'timestamp_modified': time.time(),
         'listed': False
     }
-    with open(f'{path}/analysis.yaml', 'w') as f:
-        yaml.dump(x, f)
+    _set_analysis_info(new_analysis_id, x, dir=dir)
     edit_token = _random_token(12)
-    with open(f'{path}/.edit_token', 'w') as f:
-        f.write(edit_token)
-    create_summary(dir=_get_full_path('$dir', dir=dir))
+    write_text_atomic(f'{path}/.edit_token', edit_token)
+    update_analysis_summary(new_analysis_id, dir=_get_full_path('$dir', dir=dir))
     return {'success': True, 'newAnalysisId': new_analysis_id, 'editToken': edit_token}, b''
 
 def handle_generate_analysis_data(query: dict, *, dir: str, user_id: Union[str, None]=None) -> Tuple[dict, bytes]:
@@ -182,37 +239,105 @@ def handle_generate_analysis_data(query: dict, *, dir: str, user_id: Union[str,
     if not check_valid_access_code(access_code, dir=_get_full_path('$dir', dir=dir)):
         return {'success': False, 'error': 'Invalid access code'}, b''
     
+    # run data.py in the background; the console output streams into data.console.txt
+    job_id = submit_job(
+        'generate_analysis_data', _generate_analysis_data_job, (analysis_id,), {'dir': dir},
+        analysis_id=analysis_id, dir=_get_full_path('$dir', dir=dir)
+    )
+
+    return {'success': True, 'jobId': job_id}, b''
+
+def handle_compile_analysis_model(query: dict, *, dir: str, user_id: Union[str, None]=None) -> Tuple[dict, bytes]:
+    analysis_id = query['analysis_id']
+    check_valid_analysis_id(analysis_id)
+
+    # compile in the background; the console output streams into compile.console.txt
+    job_id = submit_job(
+        'compile_analysis_model', compile_analysis_model, (analysis_id,), {'dir': _get_full_path('$dir', dir=dir)},
+        analysis_id=analysis_id, dir=_get_full_path('$dir', dir=dir)
+    )
+
+    return {'success': True, 'jobId': job_id}, b''
+
+def handle_get_analyses_summary(query: dict, *, dir: str, user_id: Union[str, None]=None) -> Tuple[dict, bytes]:
+    offset = int(query.get('offset', 0))
+    limit = int(query.get('limit', 100))
+    sort_by = query.get('sort_by', 'timestamp_modified')
+    sort_order = query.get('sort_order', 'desc')
+    if offset < 0:
+        raise Exception(f'Invalid offset: {offset}')
+    if limit < 0 or limit > 1000:
+        raise Exception(f'Invalid limit: {limit}')
+
+    total, analyses = get_analyses_summary_page(dir=_get_full_path('$dir', dir=dir), offset=offset, limit=limit, sort_by=sort_by, sort_order=sort_order)
+    return {'success': True, 'total': total, 'offset': offset, 'analyses': analyses}, b''
+
+def handle_get_job_status(query: dict, *, dir: str, user_id: Union[str, None]=None) -> Tuple[dict, bytes]:
+    job_id = query['job_id']
+    job = get_job_status(job_id, dir=_get_full_path('$dir', dir=dir))
+    return {'success': True, 'job': job}, b''
+
+def handle_get_console_output(query: dict, *, dir: str, user_id: Union[str, None]=None) -> Tuple[dict, bytes]:
+    analysis_id = query['analysis_id']
+    check_valid_analysis_id(analysis_id)
+    name = query['name']
+    if name not in ['run.console.txt', 'compile.console.txt', 'data.console.txt']:
+        raise Exception(f'Unexpected file name: {name}')
+    offset = int(query.get('offset', 0))
+    tail = query.get('tail', None)
+    max_bytes = int(query.get('max_bytes', 1024 * 1024))
+    if offset < 0:
+        raise Exception(f'Invalid offset: {offset}')
+    if max_bytes <= 0 or max_bytes > 16 * 1024 * 1024:
+        raise Exception(f'Invalid max_bytes: {max_bytes}')
+
+    # the new bytes since offset (or the last tail bytes) are returned as the binary payload
+    full_path = _get_full_path(f'$dir/analyses/{analysis_id}/{name}', dir=dir)
     try:
-        generate_analysis_data(analysis_id, dir=_get_full_path('$dir', dir=dir))
-    except Exception as e:
-        return {'success': False, 'error': str(e)}, b''
-    
+        f = open(full_path, 'rb')
+    except FileNotFoundError:
+        return {'success': True, 'file_id': None, 'size': 0, 'offset': 0, 'end': 0, 'reset': offset > 0}, b''
+    with f:
+        st = os.fstat(f.fileno())
+        size = st.st_size
+        # the file is replaced when a run starts or the console output is rotated
+        file_id = f'{st.st_ino}'
+        reset = query.get('file_id', None) not in [None, file_id] or offset > size
+        if reset:
+            offset = 0
+        if tail is not None and (offset == 0 or reset):
+            start = max(0, size - int(tail))
+        else:
+            start = offset
+        f.seek(start)
+        data = f.read(min(max_bytes, size - start))
+    if start > offset and b'\n' in data:
+        # start at a line boundary
+        i = data.index(b'\n') + 1
+        start += i
+        data = data[i:]
+    return {'success': True, 'file_id': file_id, 'size': size, 'offset': start, 'end': start + len(data), 'reset': reset}, data
+
+def _generate_analysis_data_job(analysis_id: str, *, dir: str):
+    # runs in the job pool
+    generate_analysis_data(analysis_id, dir=_get_full_path('$dir', dir=dir))
     _update_analysis_info(analysis_id=analysis_id, dir=dir, update={
         'timestamp_modified': time.time()
     })
-                
-    return {'success': True}, b''
 
-def handle_compile_analysis_model(query: dict, *, dir: str, user_id: Union[str, None]=None) -> Tuple[dict, bytes]:
-    analysis_id = query['analysis_id']
+def _get_analysis_info(analysis_id: str, *, dir: str) -> dict:
+    # for security, ensure that analysis_id is a valid id
     check_valid_analysis_id(analysis_id)
-    
-    compile_analysis_model(analysis_id, dir=_get_full_path('$dir', dir=dir))
-    
-    return {'success': True}, b''
+    return read_analysis_info(analysis_id, dir=_get_full_path('$dir', dir=dir))
 
-def _get_analysis_info(analysis_id: str, *, dir: str) -> dict:
+def _get_analysis_options(*, analysis_id: str, dir: str) -> dict:
     # for security, ensure that analysis_id is a valid id
     check_valid_analysis_id(analysis_id)
-    path = f'$dir/analyses/{analysis_id}/analysis.yaml'
+    path = f'$dir/analyses/{analysis_id}/options.yaml'
     full_path = _get_full_path(path, dir=dir)
     if not os.path.exists(full_path):
         return {}
-    # load the yaml info
-    with open(full_path, 'r') as f:
-        text = f.read()
-    info = yaml.safe_load(text)
-    return info
+    return load_yaml_file(full_path) or {}
 
 def _get_analysis_edit_token(analysis_id: str, *, dir: str) -> str:
     # for security, ensure that analysis_id is a valid id
@@ -221,32 +346,27 @@ def _get_analysis_edit_token(analysis_id: str, *, dir: str) -> str:
     full_path = _get_full_path(path, dir=dir)
     if not os.path.exists(full_path):
         return ''
-    with open(full_path, 'r') as f:
-        edit_token = f.read()
-    return edit_token
+    return read_text_file(full_path)
 
 def _set_analysis_info(analysis_id: str, info: dict, *, dir: str) -> None:
     # for security, ensure that analysis_id is a valid id
     check_valid_analysis_id(analysis_id)
-    path = f'$dir/analyses/{analysis_id}/analysis.yaml'
-    full_path = _get_full_path(path, dir=dir)
-    text = yaml.safe_dump(info)
-    with open(full_path, 'w') as f:
-        f.write(text)
+    set_analysis_info(analysis_id, info, dir=_get_full_path('$dir', dir=dir))
 
-def _update_analysis_info(*, analysis_id: str, dir: str, update: dict):
-    info = _get_analysis_info(analysis_id=analysis_id, dir=dir)
-    for k, v in update.items():
-        info[k] = v
-    _set_analysis_info(analysis_id=analysis_id, dir=dir, info=info)
+def _update_analysis_info(*, analysis_id: str, dir: str, update: dict, expected: Union[dict, None]=None) -> Union[dict, None]:
+    # for security, ensure that analysis_id is a valid id
+    check_valid_analysis_id(analysis_id)
+    return update_analysis_info(analysis_id, dir=_get_full_path('$dir', dir=dir), update=update, expected=expected)
 
 def _clear_run_console_for_analysis(analysis_id: str, *, dir: str) -> None:
     # for security, ensure that analysis_id is a valid id
     check_valid_analysis_id(analysis_id)
     path = f'$dir/analyses/{analysis_id}/run.console.txt'
     full_path = _get_full_path(path, dir=dir)
-    if os.path.exists(full_path):
-        os.remove(full_path)
+    # including the previous version kept by the rotation
+    for p in [full_path, f'{full_path}.1']:
+        if os.path.exists(p):
+            os.remove(p)
 
 def _clear_output_for_analysis(analysis_id: str, *, dir: str) -> None:
     # for security, ensure that analysis_id is a valid id
@@ -256,6 +376,19 @@ def _clear_output_for_analysis(analysis_id: str, *, dir: str) -> None:
     if os.path.exists(full_path):
         shutil.rmtree(full_path)
 
+def _clone_analysis_file(src: str, dst: str, *, dir: str):
+    name = os.path.basename(src)
+    if name in ['data.json', 'data.npz', NPZ_CACHE_FNAME]:
+        clone_file(src, dst, dir=dir)
+    elif name == 'model':
+        # hard linked from the compiled model cache, which never modifies it in place
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+    else:
+        shutil.copy2(src, dst)
+
 def _check_can_edit_analysis(*, analysis_id: str, dir: str, user_id: str, query: dict):
     analysis_info = _get_analysis_info(analysis_id, dir=dir)
     analysis_edit_token = _get_analysis_edit_token(analysis_id, dir=dir)
@@ -0,0 +1,33 @@
+from typing import Tuple, Union
+from .._get_full_path import _get_full_path
+from ..metadata_index import get_changes_since
+
+
+def handle_get_changes_since(query: dict, *, dir: str, user_id: Union[str, None]=None) -> Tuple[dict, bytes]:
+    # returns right away (clients poll), so that a request never holds up those of other users
+    since = int(query['since'])
+    limit = int(query.get('limit', 1000))
+    if limit <= 0 or limit > 10000:
+        raise Exception(f'Invalid limit: {limit}')
+
+    version, changes, reset = get_changes_since(since, dir=_get_full_path('$dir', dir=dir), limit=limit)
+    changes = [c for c in changes if _is_visible(c, user_id=user_id)]
+    return {'success': True, 'version': version, 'changes': changes, 'reset': reset}, b''
+
+def _is_visible(change: dict, *, user_id: Union[str, None]) -> bool:
+    # unlisted analyses and projects are only announced to their owners (and
+    # project users), and removed projects only to their former owners
+    data = change['data']
+    if user_id and change['owner_id'] == user_id:
+        return True
+    if data is None:
+        return False
+    if data.get('listed', False):
+        return True
+    if not user_id:
+        return False
+    if change['kind'] == 'project':
+        for user in data.get('users', []) or []:
+            if user.get('user_id', None) == user_id:
+                return True
+    return False
@@ -1,11 +1,13 @@
 import os
 from typing import Union, Tuple
-import yaml
 import random
 import string
 import time
 import shutil
 from .._get_full_path import _get_full_path
+from ..metadata_cache import read_text_file
+from ..metadata_index import get_indexed_analyses, get_indexed_projects, remove_project_from_index
+from ..metadata_store import read_analysis_info, read_project_config, set_project_config, update_analysis_info, update_project_config, write_text_atomic
 from ._check_valid import check_valid_analysis_id, check_valid_project_id
 
 
@@ -13,41 +15,18 @@ def handle_get_projects(query: dict, *, dir: str, user_id: Union[str, None], lis
     if filter_by_user is not None:
         if user_id != filter_by_user:
             raise Exception(f'Permission denied: user_id != filter_by_user ({user_id} != {filter_by_user})')
-    # iterate through folders in projects directory
     projects_dir = _get_full_path(path='$dir/projects', dir=dir)
     if not os.path.isdir(projects_dir):
         os.makedirs(projects_dir)
     projects = []
-    for project_id in os.listdir(projects_dir):
-        # check if it is a directory
+    for project_id, project_yaml in get_indexed_projects(dir=_get_full_path('$dir', dir=dir), listed_only=listed_only, user_id=filter_by_user):
         project_dir = f'{projects_dir}/{project_id}'
-        if not os.path.isdir(project_dir):
-            continue
-        # read the project.yaml file
-        project_yaml_path = f'{project_dir}/project.yaml'
-        if not os.path.isfile(project_yaml_path):
-            continue
-        with open(project_yaml_path, 'r') as f:
-            project_yaml = yaml.safe_load(f)
-        if listed_only:
-            if not project_yaml.get('listed', False):
-                continue
-        if filter_by_user is not None:
-            okay = False
-            if project_yaml.get('owner_id', None) == filter_by_user:
-                okay = True
-            for user in project_yaml.get('users', []):
-                if user.get('user_id', None) == filter_by_user:
-                    okay = True
-            if not okay:
-                continue
         # read the description.md file
         description_path = f'{project_dir}/description.md'
         if not os.path.isfile(description_path):
             description = ''
         else:
-            with open(description_path, 'r') as f:
-                description = f.read()
+            description = read_text_file(description_path)
         projects.append({
             'project_id': project_id,
             'config': project_yaml,
@@ -71,8 +50,7 @@ def handle_create_project(query: dict, *, dir: str, user_id: Union[str, None]) -
         'timestamp_modified': time.time(),
         'users': []
     }
-    with open(f'{project_dir}/project.yaml', 'w') as f:
-        yaml.dump(project_yaml, f)
+    set_project_config(project_id, project_yaml, dir=_get_full_path('$dir', dir=dir))
     # create description.md
     with open(f'{project_dir}/description.md', 'w') as f:
         f.write('# Untitled Project')
@@ -92,29 +70,24 @@ def handle_delete_project(query: dict, *, dir: str, user_id: Union[str, None]) -
     project_yaml_path = f'{project_dir}/project.yaml'
     if not os.path.isfile(project_yaml_path):
         raise Exception(f'Project config does not exist: {project_id}')
-    with open(project_yaml_path, 'r') as f:
-        project_yaml = yaml.safe_load(f)
+    project_yaml = read_project_config(project_id, dir=_get_full_path('$dir', dir=dir))
     if project_yaml.get('owner_id', None) != user_id:
         raise Exception(f'Permission denied: user_id != project_yaml["owner_id"] ({user_id} != {project_yaml["owner_id"]})')
     
     # Go through the analyses and remove them from the project
     analyses_dir = f'{_get_full_path(path="$dir/analyses", dir=dir)}'
-    for analysis_id in os.listdir(analyses_dir):
-        analysis_dir = f'{analyses_dir}/{analysis_id}'
-        if not os.path.isdir(analysis_dir):
-            continue
-        analysis_yaml_path = f'{analysis_dir}/analysis.yaml'
+    for analysis_id, _ in get_indexed_analyses(dir=_get_full_path('$dir', dir=dir), project_id=project_id):
+        analysis_yaml_path = f'{analyses_dir}/{analysis_id}/analysis.yaml'
         if not os.path.isfile(analysis_yaml_path):
             continue
-        with open(analysis_yaml_path, 'r') as f:
-            analysis_yaml = yaml.safe_load(f)
-        if analysis_yaml.get('project_id', None) == project_id:
-            analysis_yaml['project_id'] = None
-            with open(analysis_yaml_path, 'w') as f:
-                yaml.dump(analysis_yaml, f)
+        # only if the analysis has not been moved to another project in the meantime
+        update_analysis_info(analysis_id, dir=_get_full_path('$dir', dir=dir), expected={'project_id': project_id}, update={
+            'project_id': None
+        })
 
     # delete the project directory
     shutil.rmtree(project_dir)
+    remove_project_from_index(project_id, dir=_get_full_path('$dir', dir=dir))
     return {'success': True}, b''
 
 def handle_set_analysis_project(query: dict, *, dir: str, user_id: Union[str, None]) -> Tuple[dict, bytes]:
@@ -134,8 +107,7 @@ def handle_set_analysis_project(query: dict, *, dir: str, user_id: Union[str, No
     analysis_yaml_path = f'{analysis_dir}/analysis.yaml'
     if not os.path.isfile(analysis_yaml_path):
         raise Exception(f'Analysis config does not exist: {analysis_id}')
-    with open(analysis_yaml_path, 'r') as f:
-        analysis_yaml = yaml.safe_load(f)
+    analysis_yaml = read_analysis_info(analysis_id, dir=_get_full_path('$dir', dir=dir))
     analysis_permission_okay = False
     if analysis_yaml.get('owner_id', None) == user_id:
         analysis_permission_okay = True
@@ -151,8 +123,7 @@ def handle_set_analysis_project(query: dict, *, dir: str, user_id: Union[str, No
     project_yaml_path = f'{project_dir}/project.yaml'
     if not os.path.isfile(project_yaml_path):
         raise Exception(f'Project config does not exist: {project_id}')
-    with open(project_yaml_path, 'r') as f:
-        project_yaml = yaml.safe_load(f)
+    project_yaml = read_project_config(project_id, dir=_get_full_path('$dir', dir=dir))
     project_permission_okay = False
     if project_yaml.get('owner_id', None) == user_id:
         project_permission_okay = True
@@ -162,9 +133,9 @@ def handle_set_analysis_project(query: dict, *, dir: str, user_id: Union[str, No
     if not project_permission_okay:
         raise Exception(f'Permission denied: user {user_id} is not in project {project_id}')
     
-    analysis_yaml['project_id'] = project_id
-    with open(analysis_yaml_path, 'w') as f:
-        yaml.dump(analysis_yaml, f)
+    update_analysis_info(analysis_id, dir=_get_full_path('$dir', dir=dir), update={
+        'project_id': project_id
+    })
     
     return {'success': True}, b''
 
@@ -174,29 +145,17 @@ def handle_get_project_analyses(query: dict, *, dir: str, user_id: Union[str, No
 
     analyses = []
     analyses_dir = f'{_get_full_path(path="$dir/analyses", dir=dir)}'
-    for analysis_id in os.listdir(analyses_dir):
-        analysis_dir = f'{analyses_dir}/{analysis_id}'
-        if not os.path.isdir(analysis_dir):
-            continue
-        analysis_yaml_path = f'{analysis_dir}/analysis.yaml'
-        if not os.path.isfile(analysis_yaml_path):
-            continue
-        with open(analysis_yaml_path, 'r') as f:
-            analysis_yaml = yaml.safe_load(f)
-        if analysis_yaml.get('deleted', False):
-            continue
-        if analysis_yaml.get('project_id', None) == project_id:
-            description_path = f'{analysis_dir}/description.md'
-            if not os.path.isfile(description_path):
-                description = ''
-            else:
-                with open(description_path, 'r') as f:
-                    description = f.read()
-            analyses.append({
-                'analysis_id': analysis_id,
-                'config': analysis_yaml,
-                'description': description
-            })
+    for analysis_id, analysis_yaml in get_indexed_analyses(dir=_get_full_path('$dir', dir=dir), project_id=project_id, include_deleted=False):
+        description_path = f'{analyses_dir}/{analysis_id}/description.md'
+        if not os.path.isfile(description_path):
+            description = ''
+        else:
+            description = read_text_file(description_path)
+        analyses.append({
+            'analysis_id': analysis_id,
+            'config': analysis_yaml,
+            'description': description
+        })
     return {
         'success': True,
         'analyses': analyses
@@ -214,8 +173,7 @@ def handle_set_project_text_file(query: dict, *, dir: str, user_id: Union[str, N
     project_yaml_path = f'{project_dir}/project.yaml'
     if not os.path.isfile(project_yaml_path):
         raise Exception(f'Project config does not exist: {project_id}')
-    with open(project_yaml_path, 'r') as f:
-        project_yaml = yaml.safe_load(f)
+    project_yaml = read_project_config(project_id, dir=_get_full_path('$dir', dir=dir))
     okay_to_edit = False
     if project_yaml.get('owner_id', None) == user_id:
         okay_to_edit = True
@@ -228,8 +186,7 @@ def handle_set_project_text_file(query: dict, *, dir: str, user_id: Union[str, N
     if name not in ['description.md']:
         raise Exception(f'Unexpected file name: {name}')
     
-    with open(f'{project_dir}/{name}', 'w') as f:
-        f.write(text)
+    write_text_atomic(f'{project_dir}/{name}', text)
 
     return {'success': True}, b''
 
@@ -243,8 +200,7 @@ def handle_set_project_listed(query: dict, *, dir: str, user_id: Union[str, None
     project_yaml_path = f'{project_dir}/project.yaml'
     if not os.path.isfile(project_yaml_path):
         raise Exception(f'Project config does not exist: {project_id}')
-    with open(project_yaml_path, 'r') as f:
-        project_yaml = yaml.safe_load(f)
+    project_yaml = read_project_config(project_id, dir=_get_full_path('$dir', dir=dir))
     okay_to_edit = False
     if project_yaml.get('owner_id', None) == user_id:
         okay_to_edit = True
@@ -254,9 +210,9 @@ def handle_set_project_listed(query: dict, *, dir: str, user_id: Union[str, None
     if not okay_to_edit:
         raise Exception(f'Permission denied: user {user_id} is not in project {project_id}')
     
-    project_yaml['listed'] = query['listed']
-    with open(project_yaml_path, 'w') as f:
-        yaml.dump(project_yaml, f)
+    update_project_config(project_id, dir=_get_full_path('$dir', dir=dir), update={
+        'listed': query['listed']
+    })
 
     return {'success': True}, b''
 
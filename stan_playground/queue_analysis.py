@@ -1,36 +1,40 @@
 import os
-import yaml
 import shutil
 import time
-from .create_summary import create_summary
+from .create_summary import update_analysis_summary
+from .metadata_store import read_analysis_info, update_analysis_info
+from .work_queue import enqueue_analysis
 from .query_handlers._check_valid import check_valid_analysis_id
 
 
 def queue_analysis(analysis_id: str, *, dir: str):
     """Queue an analysis for processing"""
+    check_valid_analysis_id(analysis_id)
     try:
-        check_valid_analysis_id(analysis_id)
         info_path = f'{dir}/analyses/{analysis_id}/analysis.yaml'
         if not os.path.exists(info_path):
             raise Exception(f'Analysis info file not found: {info_path}')
-        with open(info_path, 'r') as f:
-            text = f.read()
-        info = yaml.safe_load(text)
+        info = read_analysis_info(analysis_id, dir=dir)
+        current_status = info.get('status', 'none')
+        if current_status == 'running':
+            print(f'WARNING: Cannot queue analysis. Analysis is currently running: {analysis_id}')
+            return
+        new_info = update_analysis_info(analysis_id, dir=dir, expected={'status': current_status}, update={
+            'status': 'queued',
+            'error': None,
+            'continue_iter_sampling': None,
+            'timestamp_queued': time.time(),
+            'timestamp_started': None,
+            'timestamp_completed': None,
+            'timestamp_failed': None
+        })
+        if new_info is None:
+            print(f'WARNING: Cannot queue analysis. Analysis status was changed concurrently: {analysis_id}')
+            return
         output_path = f'{dir}/output/{analysis_id}'
         if os.path.exists(output_path):
             shutil.rmtree(output_path)
-        if info.get('status', 'none') == 'running':
-            print(f'WARNING: Cannot queue analysis. Analysis is currently running: {analysis_id}')
-            return
-        info['status'] = 'queued'
-        info['error'] = None
-        info['timestamp_queued'] = time.time()
-        info['timestamp_started'] = None
-        info['timestamp_completed'] = None
-        info['timestamp_failed'] = None
-        with open(info_path, 'w') as f:
-            f.write(yaml.safe_dump(info))
-            print(f'Queued analysis: {analysis_id}')
+        print(f'Queued analysis: {analysis_id}')
+        enqueue_analysis(analysis_id, dir=dir)
     finally:
-        create_summary(dir)
-    
\ No newline at end of file
+        update_analysis_summary(analysis_id, dir=dir)
@@ -0,0 +1,127 @@
+import os
+import re
+import json
+import resource
+import threading
+from typing import Dict, Union
+
+
+# Structured performance records of a run, written to output/<id>/metrics.json
+# so that the analyses that dominate the capacity of the runner can be found.
+
+_elapsed_time_regex = re.compile(r'([0-9.eE+-]+) seconds \((Warm-up|Sampling|Total)\)')
+_chain_id_arg_regex = re.compile(r'^id=(\d+)$')
+
+class ChildProcessMonitor:
+    """Samples the peak resident memory and cpu time of the child processes (the cmdstan chains) from /proc
+
+    The peak resident memory is the high water mark reported by the kernel,
+    so it is exact even though the processes are only sampled periodically.
+    """
+    def __init__(self, *, poll_interval_sec: float=0.5):
+        self._poll_interval_sec = poll_interval_sec
+        self._children: Dict[int, dict] = {}
+        self._thread: Union[threading.Thread, None] = None
+        self._stop_event = threading.Event()
+        self._rusage_start = None
+    def start(self):
+        self._rusage_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    def stop(self) -> dict:
+        """Stop sampling and return the metrics of the child processes"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        processes = [
+            {
+                'pid': pid,
+                # cmdstan may run several chains in one process, starting with this one
+                'chain_id': child['chain_id'],
+                'peak_rss_bytes': child['peak_rss_bytes'],
+                'cpu_sec': child['cpu_sec']
+            }
+            for pid, child in sorted(self._children.items())
+        ]
+        return {
+            # cpu time of all the children that were waited for, including those never sampled
+            'cpu_sec': (rusage.ru_utime + rusage.ru_stime) - (self._rusage_start.ru_utime + self._rusage_start.ru_stime),
+            'peak_rss_bytes': max([p['peak_rss_bytes'] for p in processes] or [0]),
+            'processes': processes
+        }
+    def _run(self):
+        while True:
+            self._sample()
+            if self._stop_event.wait(self._poll_interval_sec):
+                return
+    def _sample(self):
+        if not os.path.isdir('/proc'):
+            return
+        my_pid = os.getpid()
+        for name in os.listdir('/proc'):
+            if not name.isdigit():
+                continue
+            pid = int(name)
+            try:
+                with open(f'/proc/{pid}/stat', 'r') as f:
+                    stat = f.read()
+                # the executable name (in parentheses) may contain spaces
+                fields = stat[stat.rindex(')') + 2:].split()
+                if int(fields[1]) != my_pid:
+                    continue
+                cpu_sec = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+                peak_rss_bytes = _read_peak_rss_bytes(pid)
+                if pid not in self._children:
+                    self._children[pid] = {'chain_id': _read_chain_id(pid), 'peak_rss_bytes': 0, 'cpu_sec': 0}
+            except (FileNotFoundError, ProcessLookupError, ValueError, IndexError):
+                continue # exited in the meantime
+            child = self._children[pid]
+            child['peak_rss_bytes'] = max(child['peak_rss_bytes'], peak_rss_bytes)
+            child['cpu_sec'] = max(child['cpu_sec'], cpu_sec)
+
+def read_chain_elapsed_times(csv_path: str) -> dict:
+    """Return the warmup and sampling times that cmdstan writes at the end of a csv file"""
+    with open(csv_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(f.tell() - 4096, 0))
+        tail = f.read().decode('utf-8', errors='replace')
+    times = {}
+    for value, kind in _elapsed_time_regex.findall(tail):
+        times[{'Warm-up': 'warmup_sec', 'Sampling': 'sampling_sec', 'Total': 'total_sec'}[kind]] = float(value)
+    return times
+
+def write_run_metrics(output_dir: str, metrics: dict):
+    path = f'{output_dir}/metrics.json'
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'w') as f:
+        json.dump(metrics, f, separators=(',', ':'))
+    os.rename(tmp_path, path)
+
+def read_run_metrics(output_dir: str) -> Union[dict, None]:
+    path = f'{output_dir}/metrics.json'
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        return None
+
+def _read_peak_rss_bytes(pid: int) -> int:
+    with open(f'/proc/{pid}/status', 'r') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+def _read_chain_id(pid: int) -> Union[int, None]:
+    # cmdstan is run with an id=<chain id> argument
+    with open(f'/proc/{pid}/cmdline', 'rb') as f:
+        args = f.read().decode('utf-8', errors='replace').split('\0')
+    for arg in args:
+        m = _chain_id_arg_regex.match(arg)
+        if m is not None:
+            return int(m.group(1))
+    return None
@@ -0,0 +1,48 @@
+from typing import Union
+
+
+# Parallelism options of options.yaml:
+#
+#   parallel_chains: 2     # chains run at the same time (default: all of them)
+#   threads_per_chain: 4   # threads of each chain, for models using reduce_sum / map_rect
+#   stan_threads: true     # compile with STAN_THREADS (implied by threads_per_chain > 1)
+#   thin: 2                # keep every n-th draw
+#
+# A run costs parallel_chains x threads_per_chain cores.
+
+def get_parallelism_options(options: dict) -> dict:
+    """Return the validated parallel_chains, threads_per_chain and thin options (None if not given)"""
+    chains = _get_positive_int(options, 'chains', 4)
+    parallel_chains = _get_positive_int(options, 'parallel_chains', None)
+    if parallel_chains is not None:
+        parallel_chains = min(parallel_chains, chains)
+    return {
+        'parallel_chains': parallel_chains,
+        'threads_per_chain': _get_positive_int(options, 'threads_per_chain', None),
+        'thin': _get_positive_int(options, 'thin', None)
+    }
+
+def get_cpp_options(options: dict) -> dict:
+    """Return the compiler options needed by the options of a run"""
+    threads_per_chain = _get_positive_int(options, 'threads_per_chain', None) or 1
+    if options.get('stan_threads', False) or threads_per_chain > 1:
+        return {'STAN_THREADS': 'true'}
+    return {}
+
+def get_core_cost(options: dict) -> int:
+    """Return the number of cores used by a run with the given options"""
+    chains = options.get('chains', 4)
+    parallel_chains = options.get('parallel_chains', None) or chains
+    threads_per_chain = options.get('threads_per_chain', None) or 1
+    try:
+        return max(1, int(min(chains, parallel_chains)) * int(threads_per_chain))
+    except (TypeError, ValueError):
+        return 1 # the run will fail with an error about the options
+
+def _get_positive_int(options: dict, name: str, default: Union[int, None]) -> Union[int, None]:
+    value = options.get(name, None)
+    if value is None:
+        return default
+    if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+        raise Exception(f'Invalid value of {name} in options.yaml: {value}')
+    return value
@@ -0,0 +1,186 @@
+import os
+import json
+import time
+from typing import Dict, List, Union
+import numpy as np
+
+
+# Running diagnostics of a run that is still sampling, computed from the draws
+# as they are appended to the draws store and published to
+# output/<id>/progress.json.
+#
+# Each chain keeps Welford-style accumulators (count, mean, sum of squared
+# deviations) for a bounded number of equally sized batches of its post-warmup
+# draws, vectorized over all the columns. When the batches run out, adjacent
+# batches are merged and the batch size doubles, so the memory per parameter
+# does not grow with the number of draws. The batches give the two halves of
+# each chain for split-R-hat and a batch-means estimate of the ESS.
+
+MAX_BATCHES = 64
+
+class SamplingProgress:
+    def __init__(self, output_dir: str, *, num_warmup_draws: int, publish_interval_sec: float=5):
+        self._path = f'{output_dir}/progress.json'
+        self._num_warmup_draws = num_warmup_draws
+        self._publish_interval_sec = publish_interval_sec
+        self._columns: Union[List[str], None] = None
+        self._chains: Dict[int, _ChainAccumulator] = {}
+        self._timestamp_published = 0
+    def add_rows(self, chain_id: int, rows: List[List[float]], *, columns: List[str]):
+        if self._columns is None:
+            self._columns = columns
+        if chain_id not in self._chains:
+            self._chains[chain_id] = _ChainAccumulator(num_columns=len(columns))
+        chain = self._chains[chain_id]
+        num_warmup_remaining = max(self._num_warmup_draws - chain.num_rows, 0)
+        chain.num_rows += len(rows)
+        if len(rows) > num_warmup_remaining:
+            chain.add(np.array(rows[num_warmup_remaining:], dtype=np.float64))
+    def publish(self, *, complete: bool=False, force: bool=False):
+        """Write progress.json, at most once per publish interval unless forced"""
+        now = time.time()
+        if not force and now - self._timestamp_published < self._publish_interval_sec:
+            return
+        self._timestamp_published = now
+        columns = self._columns or []
+        chains = [self._chains[chain_id] for chain_id in sorted(self._chains.keys())]
+        mean, sd = _get_pooled_mean_and_sd(chains, num_columns=len(columns))
+        progress = {
+            'timestamp': now,
+            'complete': complete,
+            'num_warmup_draws': self._num_warmup_draws,
+            'chains': {
+                str(chain_id): {
+                    'num_draws': chain.num_rows,
+                    'num_sampling_draws': chain.n
+                }
+                for chain_id, chain in sorted(self._chains.items())
+            },
+            # one entry per column, in the order of columns
+            'columns': columns,
+            'mean': _to_json_list(mean),
+            'sd': _to_json_list(sd),
+            'rhat': _to_json_list(_get_split_rhat(chains, num_columns=len(columns))),
+            'ess': _to_json_list(_get_batch_means_ess(chains, num_columns=len(columns)))
+        }
+        tmp_path = f'{self._path}.tmp-{os.getpid()}'
+        with open(tmp_path, 'w') as f:
+            json.dump(progress, f, separators=(',', ':'))
+        os.rename(tmp_path, self._path)
+
+class _ChainAccumulator:
+    def __init__(self, *, num_columns: int):
+        self.num_rows = 0 # including warmup
+        self.batch_size = 1
+        self.num_batches = 0
+        self.batch_means = np.zeros((MAX_BATCHES, num_columns))
+        self.batch_m2 = np.zeros((MAX_BATCHES, num_columns))
+        # the batch that is currently being filled
+        self.current_n = 0
+        self.current_mean = np.zeros((num_columns,))
+        self.current_m2 = np.zeros((num_columns,))
+    @property
+    def n(self) -> int:
+        return self.num_batches * self.batch_size + self.current_n
+    def add(self, x: np.ndarray):
+        i = 0
+        while i < x.shape[0]:
+            chunk = x[i:i + self.batch_size - self.current_n]
+            i += chunk.shape[0]
+            self.current_n, self.current_mean, self.current_m2 = _combine(
+                self.current_n, self.current_mean, self.current_m2,
+                chunk.shape[0], chunk.mean(axis=0), ((chunk - chunk.mean(axis=0)) ** 2).sum(axis=0)
+            )
+            if self.current_n == self.batch_size:
+                if self.num_batches == MAX_BATCHES:
+                    self._merge_batches()
+                    # the current batch is now half of a batch
+                    continue
+                self.batch_means[self.num_batches] = self.current_mean
+                self.batch_m2[self.num_batches] = self.current_m2
+                self.num_batches += 1
+                self.current_n = 0
+                self.current_mean = np.zeros_like(self.current_mean)
+                self.current_m2 = np.zeros_like(self.current_m2)
+    def get_stats(self, start: int, end: int, *, include_current: bool):
+        """Combined (n, mean, m2) of batches start:end and optionally of the current batch"""
+        n = (end - start) * self.batch_size
+        if end > start:
+            means = self.batch_means[start:end]
+            mean = means.mean(axis=0)
+            m2 = self.batch_m2[start:end].sum(axis=0) + self.batch_size * ((means - mean) ** 2).sum(axis=0)
+        else:
+            mean = np.zeros_like(self.current_mean)
+            m2 = np.zeros_like(self.current_m2)
+        if include_current:
+            n, mean, m2 = _combine(n, mean, m2, self.current_n, self.current_mean, self.current_m2)
+        return n, mean, m2
+    def _merge_batches(self):
+        h = MAX_BATCHES // 2
+        a_mean, b_mean = self.batch_means[0::2].copy(), self.batch_means[1::2].copy()
+        a_m2, b_m2 = self.batch_m2[0::2].copy(), self.batch_m2[1::2].copy()
+        _, self.batch_means[:h], self.batch_m2[:h] = _combine(self.batch_size, a_mean, a_m2, self.batch_size, b_mean, b_m2)
+        self.num_batches = h
+        self.batch_size *= 2
+
+def _combine(n_a: int, mean_a: np.ndarray, m2_a: np.ndarray, n_b: int, mean_b: np.ndarray, m2_b: np.ndarray):
+    # Chan et al. parallel update of the Welford accumulators
+    n = n_a + n_b
+    if n == 0:
+        return 0, mean_a, m2_a
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (n_b / n)
+    m2 = m2_a + m2_b + delta ** 2 * (n_a * n_b / n)
+    return n, mean, m2
+
+def _get_pooled_mean_and_sd(chains: List[_ChainAccumulator], *, num_columns: int):
+    n, mean, m2 = 0, np.zeros((num_columns,)), np.zeros((num_columns,))
+    for chain in chains:
+        n, mean, m2 = _combine(n, mean, m2, *chain.get_stats(0, chain.num_batches, include_current=True))
+    if n < 2:
+        return np.full((num_columns,), np.nan), np.full((num_columns,), np.nan)
+    return mean, np.sqrt(m2 / (n - 1))
+
+def _get_split_rhat(chains: List[_ChainAccumulator], *, num_columns: int) -> np.ndarray:
+    half_means = []
+    half_vars = []
+    half_ns = []
+    for chain in chains:
+        h = chain.num_batches // 2
+        if h * chain.batch_size < 2:
+            continue
+        # with an odd number of batches the middle one is left out
+        for start, end in [(0, h), (chain.num_batches - h, chain.num_batches)]:
+            n, mean, m2 = chain.get_stats(start, end, include_current=False)
+            half_means.append(mean)
+            half_vars.append(m2 / (n - 1))
+            half_ns.append(n)
+    if len(half_means) < 2:
+        return np.full((num_columns,), np.nan)
+    n = np.mean(half_ns)
+    w = np.mean(half_vars, axis=0)
+    b_over_n = np.var(half_means, axis=0, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(((n - 1) / n * w + b_over_n) / w)
+
+def _get_batch_means_ess(chains: List[_ChainAccumulator], *, num_columns: int) -> np.ndarray:
+    ess = np.zeros((num_columns,))
+    num_chains_used = 0
+    for chain in chains:
+        if chain.num_batches < 2:
+            continue
+        n, _, m2 = chain.get_stats(0, chain.num_batches, include_current=False)
+        var = m2 / (n - 1)
+        var_batch_means = np.var(chain.batch_means[:chain.num_batches], axis=0, ddof=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # n * var / sigma^2, where sigma^2 = batch_size * var_batch_means is
+            # the asymptotic variance of the chain mean times n
+            ess += np.minimum(chain.num_batches * var / var_batch_means, n)
+        num_chains_used += 1
+    if num_chains_used == 0:
+        return np.full((num_columns,), np.nan)
+    return ess
+
+def _to_json_list(x: np.ndarray) -> list:
+    # json has no nan or inf
+    return [float(v) if np.isfinite(v) else None for v in x]
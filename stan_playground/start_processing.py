@@ -1,116 +1,310 @@
 import os
 import yaml
 import time
-import json
 import shutil
-from .create_summary import create_summary
-from .capture_console_output import capture_console_output, setup_logger
+import multiprocessing
+import multiprocessing.connection
+from typing import Dict, Union
+from .create_summary import create_summary, update_analysis_summary
+from .metadata_cache import load_yaml_file
+from .metadata_store import update_analysis_info
+from .work_queue import QueueListener, claim_queued_analysis, enqueue_queued_analyses_from_index, peek_next_queued_analysis
+from .model_cache import use_compiled_model
+from .draws_store import DrawsWriter
+from .blob_store import intern_file
+from .cmdstan_data import get_cmdstan_data_file
+from .sampling_options import get_core_cost, get_cpp_options, get_parallelism_options
+from .warm_start import get_warm_start_sample_args, load_warm_start, save_warm_start
+from .run_metrics import ChildProcessMonitor, read_chain_elapsed_times, write_run_metrics
+from .cache_utils import get_dir_size
+from .capture_console_output import capture_console_output
 
 
-def start_processing(*, dir: str):
+def start_processing(*, dir: str, max_cores: Union[int, None]=None):
+    """Run queued analyses, several at a time, within a total budget of cores
+
+    Each analysis costs as many cores as it runs chains in parallel. An
+    analysis that needs more than the whole budget is run on its own.
+    """
     # check that we have cmdstanpy installed
     from cmdstanpy import CmdStanModel
 
+    if max_cores is None:
+        max_cores = os.cpu_count() or 1
+
+    analyses_dir = f'{dir}/analyses'
+    if not os.path.exists(analyses_dir):
+        os.makedirs(analyses_dir)
+
     create_summary(dir)
 
+    listener = QueueListener(dir=dir)
+    enqueue_queued_analyses_from_index(dir=dir)
+
+    ctx = multiprocessing.get_context('fork')
+    running_jobs: Dict[int, _RunningJob] = {} # keyed by process sentinel
     while True:
-        # iterate through all folders in the analyses directory
-        analyses_dir = f'{dir}/analyses'
-        if not os.path.exists(analyses_dir):
-            os.makedirs(analyses_dir)
-        for analysis_id in os.listdir(analyses_dir):
-            analysis_dir = f'{analyses_dir}/{analysis_id}'
-            analysis_output_dir = f'{dir}/output/{analysis_id}'
-            info_path = f'{analysis_dir}/analysis.yaml'
-            if os.path.exists(info_path):
-                with open(info_path, 'r') as f:
-                    info = yaml.safe_load(f.read())
-                status = info.get('status', 'none')
-                if status == 'queued':
-                    print(f'Processing analysis: {analysis_id}')
-                    info['status'] = 'running'
-                    info['error'] = None
-                    info['timestamp_started'] = time.time()
-                    info['timestamp_completed'] = None
-                    info['timestamp_failed'] = None
-                    with open(info_path, 'w') as f:
-                        f.write(yaml.safe_dump(info))
-                    create_summary(dir)
-
-                    # delete the output directory if it already exists
-                    if os.path.exists(analysis_output_dir):
-                        shutil.rmtree(analysis_output_dir)
-                    # create a new output directory
-                    os.makedirs(analysis_output_dir)
-                    
-                    try:
-                        do_run_analysis(analysis_id, analysis_dir, analysis_output_dir)
-                        success = True
-                    except Exception as err:
-                        print(f'Error running analysis: {analysis_id}')
-                        print(err)
-                        info['status'] = 'failed'
-                        info['error'] = str(err)
-                        info['timestamp_failed'] = time.time()
-                        with open(info_path, 'w') as f:
-                            f.write(yaml.safe_dump(info))
-                        success = False
-                    if success:
-                        print(f'Completed analysis: {analysis_id}')
-                        info['status'] = 'completed'
-                        info['error'] = None
-                        info['timestamp_completed'] = time.time()
-                        with open(info_path, 'w') as f:
-                            f.write(yaml.safe_dump(info))
-                    create_summary(dir)
-
-        # sleep for 10 seconds before checking again
-        time.sleep(10)
-
-def do_run_analysis(analysis_id: str, analysis_dir: str, analysis_output_dir: str):
+        # start as many queued analyses as fit within the core budget, in queue order
+        while True:
+            analysis_id = peek_next_queued_analysis(dir=dir)
+            if analysis_id is None:
+                break
+            cost = _get_analysis_core_cost(analysis_id, dir=dir)
+            cores_in_use = sum(job.cost for job in running_jobs.values())
+            if len(running_jobs) > 0 and cores_in_use + cost > max_cores:
+                break
+            if not claim_queued_analysis(analysis_id, dir=dir):
+                continue # claimed by another worker
+            process = ctx.Process(target=process_analysis, args=(analysis_id,), kwargs={'dir': dir})
+            process.start()
+            print(f'Started analysis {analysis_id} using {cost} cores ({cores_in_use + cost} of {max_cores} in use)')
+            running_jobs[process.sentinel] = _RunningJob(analysis_id=analysis_id, process=process, cost=cost)
+
+        if len(running_jobs) == 0:
+            # idle: block until something is enqueued
+            listener.wait()
+            continue
+
+        # wait for a job to finish or for something to be enqueued. With
+        # several workers a notification is only received by one of them,
+        # so recheck the queue periodically while it is not empty.
+        timeout = None if peek_next_queued_analysis(dir=dir) is None else 10
+        ready = multiprocessing.connection.wait([listener, *running_jobs.keys()], timeout=timeout)
+        for r in ready:
+            if r is listener:
+                listener.drain()
+                continue
+            job = running_jobs.pop(r)
+            job.process.join()
+            if job.process.exitcode != 0:
+                _mark_analysis_failed_if_running(job.analysis_id, dir=dir, error=f'Worker process exited with code {job.process.exitcode}')
+
+class _RunningJob:
+    def __init__(self, *, analysis_id: str, process: multiprocessing.Process, cost: int):
+        self.analysis_id = analysis_id
+        self.process = process
+        self.cost = cost
+
+def _get_analysis_core_cost(analysis_id: str, *, dir: str) -> int:
+    options_path = f'{dir}/analyses/{analysis_id}/options.yaml'
+    options = {}
+    if os.path.exists(options_path):
+        try:
+            options = load_yaml_file(options_path) or {}
+        except yaml.YAMLError:
+            pass
+    return get_core_cost(options)
+
+def _mark_analysis_failed_if_running(analysis_id: str, *, dir: str, error: str):
+    info = update_analysis_info(analysis_id, dir=dir, expected={'status': 'running'}, update={
+        'status': 'failed',
+        'error': error,
+        'timestamp_failed': time.time()
+    })
+    if info is None:
+        return
+    print(f'Error running analysis: {analysis_id}')
+    print(error)
+    update_analysis_summary(analysis_id, dir=dir)
+
+def process_analysis(analysis_id: str, *, dir: str):
+    analysis_dir = f'{dir}/analyses/{analysis_id}'
+    analysis_output_dir = f'{dir}/output/{analysis_id}'
+    info_path = f'{analysis_dir}/analysis.yaml'
+    if not os.path.exists(info_path):
+        return
+    # only start if the analysis is still queued (it may have been canceled after it was enqueued)
+    info = update_analysis_info(analysis_id, dir=dir, expected={'status': 'queued'}, update={
+        'status': 'running',
+        'error': None,
+        'timestamp_started': time.time(),
+        'timestamp_completed': None,
+        'timestamp_failed': None
+    })
+    if info is None:
+        return
+    print(f'Processing analysis: {analysis_id}')
+    update_analysis_summary(analysis_id, dir=dir)
+
+    # when continuing a completed run, the new draws are appended to its output
+    continue_iter_sampling = info.get('continue_iter_sampling', None)
+    if continue_iter_sampling is None:
+        # delete the output directory if it already exists
+        if os.path.exists(analysis_output_dir):
+            shutil.rmtree(analysis_output_dir)
+        # create a new output directory
+        os.makedirs(analysis_output_dir)
+
+    try:
+        do_run_analysis(analysis_id, analysis_dir, analysis_output_dir, dir=dir, continue_iter_sampling=continue_iter_sampling)
+        success = True
+    except Exception as err:
+        print(f'Error running analysis: {analysis_id}')
+        print(err)
+        update_analysis_info(analysis_id, dir=dir, expected={'status': 'running'}, update={
+            'status': 'failed',
+            'error': str(err),
+            'continue_iter_sampling': None,
+            'timestamp_failed': time.time()
+        })
+        success = False
+    if success:
+        print(f'Completed analysis: {analysis_id}')
+        update_analysis_info(analysis_id, dir=dir, expected={'status': 'running'}, update={
+            'status': 'completed',
+            'error': None,
+            'continue_iter_sampling': None,
+            'timestamp_completed': time.time()
+        })
+    update_analysis_summary(analysis_id, dir=dir)
+
+def do_run_analysis(analysis_id: str, analysis_dir: str, analysis_output_dir: str, *, dir: str, continue_iter_sampling: Union[int, None]=None):
+    """Sample the posterior of an analysis into its output directory
+
+    If continue_iter_sampling is given, that many more iterations are run
+    from the saved state of the sampler at the end of the existing run
+    (without warmup); their csv files go to output/<id>/continue_<n> and
+    their draws are appended to the draws store.
+    """
     from cmdstanpy import CmdStanModel
+    from .sampling_progress import SamplingProgress
+    from .posterior_summary import create_posterior_summary
 
     model_fname = f'{analysis_dir}/main.stan'
+    metrics = {'analysis_id': analysis_id}
+    options = load_yaml_file(f'{analysis_dir}/options.yaml') or {}
+
+    # Start sampling the posterior for this model/data. The console output
+    # includes that of the compiler when the model is not in the cache.
+    console = None
+    sampling_failed = False
+    try:
+        with capture_console_output(f'{analysis_dir}/run.console.txt') as console:
+            print(f'Starting sampling for analysis: {analysis_id}')
+            # Print a timestamp
+            print(f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())}')
+            # reuse the compiled executable of an identical program if there is
+            # one; it is not evicted from the cache until the end of the run
+            timer = time.time()
+            with use_compiled_model(model_fname, dir=dir, cpp_options=get_cpp_options(options)) as (exe_fname, cache_hit):
+                metrics['compile'] = {'elapsed_sec': time.time() - timer, 'cache_hit': cache_hit}
+                print(f'Model cache: {"hit" if cache_hit else "miss"}')
+                model = CmdStanModel(stan_file=model_fname, exe_file=exe_fname)
+
+                # the data file is passed to cmdstan as is, after validating it (or converting data.npz)
+                timer = time.time()
+                data_fname = get_cmdstan_data_file(analysis_dir)
+                # (the data converted from data.npz is shared with clones)
+                intern_file(data_fname, dir=dir)
+                metrics['data_load'] = {'elapsed_sec': time.time() - timer, 'data_bytes': os.path.getsize(data_fname)}
+
+                iter_sampling = options.get('iter_sampling', None)
+                iter_warmup = options.get('iter_warmup', None)
+                chains = options.get('chains', 4)
+                save_warmup = options.get('save_warmup', True)
+                seed = options.get('seed', None)
+                parallelism = get_parallelism_options(options)
+
+                if iter_sampling is None:
+                    raise Exception('iter_sampling not specified in options.yaml')
+                if iter_warmup is None:
+                    raise Exception('iter_warmup not specified in options.yaml')
+
+                csv_output_dir = analysis_output_dir
+                warm_start = None
+                if continue_iter_sampling is not None:
+                    warm_start = load_warm_start(analysis_dir)
+                    if warm_start is None:
+                        raise Exception('Unable to continue sampling: no saved sampler state for this model and data')
+                    iter_sampling = continue_iter_sampling
+                    iter_warmup = 0
+                    segment = 1
+                    while os.path.exists(f'{analysis_output_dir}/continue_{segment}'):
+                        segment += 1
+                    csv_output_dir = f'{analysis_output_dir}/continue_{segment}'
+                    os.makedirs(csv_output_dir)
+                    if seed is not None:
+                        # do not repeat the random numbers of the previous segments
+                        seed = seed + segment
+                    metrics['continue_segment'] = segment
+                elif options.get('warm_start', False):
+                    # reuse the adapted step size and metric of the previous run, and its last draws as inits
+                    warm_start = load_warm_start(analysis_dir)
+                    if warm_start is not None:
+                        iter_warmup = options.get('warm_start_iter_warmup', 0)
+                sample_args = {}
+                if warm_start is not None:
+                    sample_args = get_warm_start_sample_args(warm_start, chains=chains, work_dir=f'{csv_output_dir}/warm_start')
+                    if iter_warmup == 0:
+                        # cmdstan does not allow adaptation without warmup
+                        sample_args['adapt_engaged'] = False
+                metrics['warm_start'] = warm_start is not None
+
+                if warm_start is not None:
+                    print(f'Warm start from the saved sampler state (iter_warmup = {iter_warmup})')
+                print(f'====================')
+                timer = time.time()
+                # convert the draws to the columnar store while they are being written
+                thin = parallelism['thin'] or 1
+                num_warmup_draws = (iter_warmup + thin - 1) // thin if save_warmup else 0
+                progress = SamplingProgress(analysis_output_dir, num_warmup_draws=num_warmup_draws)
+                draws_writer = DrawsWriter(
+                    analysis_output_dir, num_warmup_draws=num_warmup_draws, progress=progress,
+                    csv_dir=csv_output_dir, append=continue_iter_sampling is not None
+                )
+                draws_writer.start()
+                process_monitor = ChildProcessMonitor()
+                process_monitor.start()
+                try:
+                    fit = model.sample(
+                        data=data_fname,
+                        output_dir=csv_output_dir,
+                        iter_sampling=iter_sampling,
+                        iter_warmup=iter_warmup,
+                        chains=chains,
+                        seed=seed,
+                        save_warmup=save_warmup,
+                        show_console=True,
+                        **{k: v for k, v in parallelism.items() if v is not None},
+                        **sample_args
+                    )
+                except Exception:
+                    draws_writer.stop(complete=False)
+                    metrics['sampling'] = {'elapsed_sec': time.time() - timer, 'completed': False, **process_monitor.stop()}
+                    write_run_metrics(analysis_output_dir, metrics)
+                    sampling_failed = True
+                    raise
+                metrics['sampling'] = {'elapsed_sec': time.time() - timer, 'completed': True, 'cores': get_core_cost(options), **process_monitor.stop()}
+                metrics['chains'] = {
+                    str(chain_id): read_chain_elapsed_times(csv_file)
+                    for chain_id, csv_file in enumerate(fit.runset.csv_files, start=1)
+                }
+                draws_writer.stop(complete=True)
+                try:
+                    save_warm_start(analysis_dir, analysis_output_dir, csv_files=fit.runset.csv_files)
+                except Exception as err:
+                    print(f'WARNING: Unable to save the sampler state: {err}')
+                print(f'====================')
+                elapsed = time.time() - timer
+                print(f'Elapsed time: {elapsed} seconds')
+                print('Finished sampling')
+    except Exception as err:
+        if not sampling_failed:
+            raise
+        # the cause is usually in the last lines of the cmdstan output, which
+        # have all been written out now that the capture has ended
+        console_tail = '\n'.join(console.tail(20))
+        raise Exception(f'{err}\nLast lines of the console output:\n{console_tail}') from err
 
-    model = CmdStanModel(stan_file=model_fname)
-
-    # load the data from data.json
-    data_fname = f'{analysis_dir}/data.json'
-    with open(data_fname, 'r') as f:
-        data = json.load(f)
-    
-    with open(f'{analysis_dir}/options.yaml', 'r') as f:
-        options = yaml.safe_load(f.read())
-    iter_sampling = options.get('iter_sampling', None)
-    iter_warmup = options.get('iter_warmup', None)
-    chains = options.get('chains', 4)
-    save_warmup = options.get('save_warmup', True)
-    seed = options.get('seed', None)
-
-    if iter_sampling is None:
-        raise Exception('iter_sampling not specified in options.yaml')
-    if iter_warmup is None:
-        raise Exception('iter_warmup not specified in options.yaml')
-
-    # Start sampling the posterior for this model/data
-    logger = setup_logger(f'{analysis_dir}/run.console.txt')
-    with capture_console_output(logger):
-        print(f'Starting sampling for analysis: {analysis_id}')
-        # Print a timestamp
-        print(f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())}')
-        print(f'====================')
-        timer = time.time()
-        fit = model.sample(
-            data=data,
-            output_dir=analysis_output_dir,
-            iter_sampling=iter_sampling,
-            iter_warmup=iter_warmup,
-            chains=chains,
-            seed=seed,
-            save_warmup=save_warmup,
-            show_console=True
-        )
-        print(f'====================')
-        elapsed = time.time() - timer
-        print(f'Elapsed time: {elapsed} seconds')
-        print('Finished sampling')
\ No newline at end of file
+    # the summary is computed after the capture has ended, so that the
+    # processes of its pool do not inherit the console pipe of the run
+    summary_timer = time.time()
+    try:
+        # the cores that were used by the chains are free now
+        create_posterior_summary(analysis_output_dir, num_workers=_get_analysis_core_cost(analysis_id, dir=dir))
+    except Exception as err:
+        # the draws are still usable without the summary
+        print(f'WARNING: Unable to create posterior summary: {err}')
+    metrics['posterior_summary'] = {'elapsed_sec': time.time() - summary_timer}
+    metrics['output_bytes'] = get_dir_size(analysis_output_dir)
+    write_run_metrics(analysis_output_dir, metrics)
@@ -0,0 +1,206 @@
+import os
+import re
+import json
+import mmap
+import hashlib
+from typing import Dict, List, Union
+from .draws_store import read_draws_header, read_draws_range
+from .cache_utils import canonicalize_stan_source
+
+
+# The adapted state of the sampler at the end of a run is saved to
+# analyses/<id>/.warm_start.json, outside of the output directory, so that it
+# survives deleting the run. It holds, for each chain, the adapted step size,
+# the inverse metric and the last draw (to be used as inits), along with
+# hashes of main.stan and the data (data.json and data.npz): the state is
+# only reused for the same model and data.
+#
+#   {
+#       "stan_hash": "...",
+#       "data_hash": "...",
+#       "chains": {"1": {"step_size": 0.8, "inv_metric": [...], "inits": {"theta": 0.1, ...}}, ...}
+#   }
+
+_csv_chain_regex = re.compile(r'_(\d+)\.csv$')
+
+def save_warm_start(analysis_dir: str, output_dir: str, *, csv_files: List[str]):
+    """Save the state of the sampler at the end of a run, from its csv files and draws store
+
+    Chains whose csv files hold no adaptation info (runs without warmup) keep
+    the step size and metric of the previously saved state.
+    """
+    header = read_draws_header(output_dir)
+    previous = load_warm_start(analysis_dir)
+    chains = {}
+    for csv_file in csv_files:
+        m = _csv_chain_regex.search(csv_file)
+        if m is None:
+            continue
+        chain_id = int(m.group(1))
+        num_draws = header['chains'].get(str(chain_id), {}).get('num_draws', 0)
+        if num_draws == 0:
+            continue
+        chain = _read_adaptation_info(csv_file)
+        if 'step_size' not in chain and previous is not None:
+            previous_chain = _get_chain_state(previous, chain_id)
+            for k in ['step_size', 'inv_metric']:
+                if k in previous_chain:
+                    chain[k] = previous_chain[k]
+        values = [
+            float(read_draws_range(output_dir, i, chain_id=chain_id, header=header, start=num_draws - 1, end=num_draws)[0])
+            for i in range(len(header['columns']))
+        ]
+        chain['inits'] = _get_stan_variables(header['columns'], values)
+        chains[str(chain_id)] = chain
+    if len(chains) == 0:
+        return
+    warm_start = {
+        'stan_hash': _get_file_hash(f'{analysis_dir}/main.stan', stan=True),
+        'data_hash': _get_data_hash(analysis_dir),
+        'chains': chains
+    }
+    path = f'{analysis_dir}/.warm_start.json'
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'w') as f:
+        json.dump(warm_start, f)
+    os.rename(tmp_path, path)
+
+def load_warm_start(analysis_dir: str) -> Union[dict, None]:
+    """Return the saved state of the sampler, or None if there is none for the current model and data"""
+    path = f'{analysis_dir}/.warm_start.json'
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            warm_start = json.load(f)
+    except json.JSONDecodeError:
+        return None
+    if warm_start.get('stan_hash') != _get_file_hash(f'{analysis_dir}/main.stan', stan=True):
+        return None
+    if warm_start.get('data_hash') != _get_data_hash(analysis_dir):
+        return None
+    if len(warm_start.get('chains', {})) == 0:
+        return None
+    return warm_start
+
+def get_warm_start_sample_args(warm_start: dict, *, chains: int, work_dir: str) -> dict:
+    """Return the step_size, metric and inits arguments of CmdStanModel.sample for a warm start
+
+    The inits and metric files are written to work_dir. If the number of
+    chains changed, the saved chains are reused in turn.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    states = [_get_chain_state(warm_start, chain_id) for chain_id in range(1, chains + 1)]
+    args = {}
+    inits = []
+    for chain_id, state in enumerate(states, start=1):
+        path = f'{work_dir}/inits_{chain_id}.json'
+        with open(path, 'w') as f:
+            json.dump(state['inits'], f)
+        inits.append(path)
+    args['inits'] = inits
+    if all('step_size' in state for state in states):
+        args['step_size'] = [state['step_size'] for state in states]
+    if all('inv_metric' in state for state in states):
+        metric = []
+        for chain_id, state in enumerate(states, start=1):
+            path = f'{work_dir}/metric_{chain_id}.json'
+            with open(path, 'w') as f:
+                json.dump({'inv_metric': state['inv_metric']}, f)
+            metric.append(path)
+        args['metric'] = metric
+    return args
+
+def _get_chain_state(warm_start: dict, chain_id: int) -> dict:
+    chains = warm_start['chains']
+    if str(chain_id) in chains:
+        return chains[str(chain_id)]
+    keys = sorted(chains.keys(), key=int)
+    return chains[keys[(chain_id - 1) % len(keys)]]
+
+def _read_adaptation_info(csv_file: str) -> dict:
+    # CmdStan writes the adaptation info as comments after the warmup draws:
+    #
+    #   # Adaptation terminated
+    #   # Step size = 0.8
+    #   # Diagonal elements of inverse mass matrix:
+    #   # 1.02, 0.98
+    #
+    # or "# Elements of inverse mass matrix:" followed by one line per row for
+    # a dense metric. Search for it rather than parsing the whole file.
+    with open(csv_file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return {}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            i = mm.find(b'\n# Step size = ')
+            if i < 0:
+                return {}
+            mm.seek(i + 1)
+            lines = []
+            while True:
+                line = mm.readline()
+                if not line.startswith(b'#'):
+                    break
+                lines.append(line[1:].decode('utf-8').strip())
+    ret = {'step_size': float(lines[0].split('=')[1])}
+    if len(lines) >= 3 and lines[1].startswith('Diagonal elements of inverse mass matrix'):
+        ret['inv_metric'] = _parse_numbers(lines[2])
+    elif len(lines) >= 3 and lines[1].startswith('Elements of inverse mass matrix'):
+        rows = []
+        for line in lines[2:]:
+            if not line:
+                break
+            rows.append(_parse_numbers(line))
+        ret['inv_metric'] = rows
+    return ret
+
+def _parse_numbers(line: str) -> List[float]:
+    return [float(x) for x in line.split(',')]
+
+def _get_stan_variables(columns: List[str], values: List[float]) -> Dict[str, Union[float, list]]:
+    # the csv columns are the flattened variables (e.g. theta.2.3), sampler
+    # diagnostics end with __
+    shapes: Dict[str, List[int]] = {}
+    elements = []
+    for column, value in zip(columns, values):
+        if column.endswith('__'):
+            continue
+        name, *indices = column.split('.')
+        if not all(i.isdigit() for i in indices):
+            continue # complex numbers and tuples are left to random inits
+        indices = [int(i) for i in indices]
+        shape = shapes.setdefault(name, [0] * len(indices))
+        if len(shape) != len(indices):
+            continue
+        for k, i in enumerate(indices):
+            shape[k] = max(shape[k], i)
+        elements.append((name, indices, value))
+    variables = {name: _zeros(shape) for name, shape in shapes.items()}
+    for name, indices, value in elements:
+        if len(indices) == 0:
+            variables[name] = value
+            continue
+        x = variables[name]
+        for i in indices[:-1]:
+            x = x[i - 1]
+        x[indices[-1] - 1] = value
+    return variables
+
+def _zeros(shape: List[int]) -> Union[float, list]:
+    if len(shape) == 0:
+        return 0.0
+    return [_zeros(shape[1:]) for _ in range(shape[0])]
+
+def _get_data_hash(analysis_dir: str) -> str:
+    # the data is data.json, and data.npz if there is one
+    return ':'.join(str(_get_file_hash(f'{analysis_dir}/{fname}')) for fname in ['data.json', 'data.npz'])
+
+def _get_file_hash(path: str, *, stan: bool=False) -> Union[str, None]:
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        content = f.read()
+    if stan:
+        # whitespace-only edits do not invalidate the state
+        content = canonicalize_stan_source(content.decode('utf-8')).encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
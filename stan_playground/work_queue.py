@@ -0,0 +1,111 @@
+import os
+import time
+import errno
+import select
+from typing import List, Union
+from .metadata_index import get_index_connection, get_indexed_analyses, transaction
+
+
+# Queued analyses are kept in a FIFO table of the metadata index. Whenever an
+# analysis is enqueued, a byte is written to a named pipe in the data
+# directory so that an idle worker blocked on the pipe wakes up immediately.
+
+def enqueue_analysis(analysis_id: str, *, dir: str) -> None:
+    """Append an analysis to the work queue (no-op if it is already queued) and wake up the worker"""
+    conn = get_index_connection(dir=dir)
+    with transaction(conn):
+        conn.execute('INSERT OR IGNORE INTO analysis_queue (analysis_id, timestamp_queued) VALUES (?, ?)', (analysis_id, time.time()))
+    _notify_queue_listeners(dir=dir)
+
+def remove_analysis_from_queue(analysis_id: str, *, dir: str) -> None:
+    conn = get_index_connection(dir=dir)
+    with transaction(conn):
+        conn.execute('DELETE FROM analysis_queue WHERE analysis_id = ?', (analysis_id,))
+
+def get_queued_analysis_ids(*, dir: str) -> List[str]:
+    """Return the ids of the queued analyses in the order in which they will be processed"""
+    conn = get_index_connection(dir=dir)
+    return [analysis_id for analysis_id, in conn.execute('SELECT analysis_id FROM analysis_queue ORDER BY seq')]
+
+def peek_next_queued_analysis(*, dir: str) -> Union[str, None]:
+    """Return the id of the analysis at the head of the queue without removing it, or None if the queue is empty"""
+    conn = get_index_connection(dir=dir)
+    row = conn.execute('SELECT analysis_id FROM analysis_queue ORDER BY seq LIMIT 1').fetchone()
+    return row[0] if row is not None else None
+
+def claim_queued_analysis(analysis_id: str, *, dir: str) -> bool:
+    """Atomically remove an analysis from the queue
+
+    Returns True if this caller removed it, so that when several workers race
+    for the same analysis exactly one of them gets to run it.
+    """
+    conn = get_index_connection(dir=dir)
+    with transaction(conn):
+        cursor = conn.execute('DELETE FROM analysis_queue WHERE analysis_id = ?', (analysis_id,))
+        return cursor.rowcount == 1
+
+def enqueue_queued_analyses_from_index(*, dir: str) -> None:
+    """Make sure that every analysis with status queued is in the work queue
+
+    This picks up analyses that were queued while no worker was running, in
+    the order in which they were queued.
+    """
+    queued = get_indexed_analyses(dir=dir, status='queued')
+    queued.sort(key=lambda a: (a[1].get('timestamp_queued', None) or 0, a[0]))
+    conn = get_index_connection(dir=dir)
+    with transaction(conn):
+        for analysis_id, info in queued:
+            conn.execute('INSERT OR IGNORE INTO analysis_queue (analysis_id, timestamp_queued) VALUES (?, ?)', (analysis_id, info.get('timestamp_queued', None) or time.time()))
+
+class QueueListener:
+    """Blocks until the work queue is notified, without using any CPU while waiting"""
+    def __init__(self, *, dir: str):
+        fifo_path = _get_queue_fifo_path(dir=dir)
+        if not os.path.exists(fifo_path):
+            try:
+                os.mkfifo(fifo_path)
+            except FileExistsError:
+                pass
+        self._read_fd = os.open(fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+        # hold a write end ourselves so that the pipe does not report EOF
+        # (readable forever) once the last notifier has closed it
+        self._write_fd = os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+    def fileno(self) -> int:
+        return self._read_fd
+    def wait(self, timeout: Union[float, None]=None) -> bool:
+        """Wait for a notification; returns False if the timeout elapsed first"""
+        readable, _, _ = select.select([self._read_fd], [], [], timeout)
+        if len(readable) == 0:
+            return False
+        self.drain()
+        return True
+    def drain(self):
+        while True:
+            try:
+                if not os.read(self._read_fd, 4096):
+                    return
+            except BlockingIOError:
+                return
+    def close(self):
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+def _notify_queue_listeners(*, dir: str) -> None:
+    fifo_path = _get_queue_fifo_path(dir=dir)
+    try:
+        fd = os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+    except FileNotFoundError:
+        return # no worker has been started yet
+    except OSError as e:
+        if e.errno == errno.ENXIO:
+            return # no worker is listening
+        raise
+    try:
+        os.write(fd, b'\n')
+    except BlockingIOError:
+        pass # the pipe is full, so the worker has plenty of pending notifications
+    finally:
+        os.close(fd)
+
+def _get_queue_fifo_path(*, dir: str) -> str:
+    return f'{dir}/.stan_playground_queue.fifo'
@@ -0,0 +1,25 @@
+import os
+import pytest
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """An empty stan-playground data directory, also served as rtcshare://"""
+    dir = str(tmp_path / 'data')
+    os.makedirs(f'{dir}/analyses')
+    os.makedirs(f'{dir}/projects')
+    monkeypatch.setenv('RTCSHARE_DIR', dir)
+    return dir
+
+@pytest.fixture
+def write_cmdstan_csv():
+    """Write a CmdStan csv file with the given columns and rows of draws"""
+    def write(path: str, columns: list, rows: list):
+        with open(path, 'w') as f:
+            f.write('# model = main_model\n# method = sample (Default)\n')
+            f.write(','.join(columns) + '\n')
+            f.write('# Adaptation terminated\n# Step size = 0.9\n')
+            for row in rows:
+                f.write(','.join(repr(float(x)) for x in row) + '\n')
+            f.write('# \n#  Elapsed Time: 0.01 seconds (Warm-up)\n')
+    return write
@@ -0,0 +1,72 @@
+import os
+import json
+import time
+import importlib
+import multiprocessing
+import pytest
+
+# the package exports the generate_access_code function under the name of the module
+access_codes = importlib.import_module('stan_playground.generate_access_code')
+check_valid_access_code = access_codes.check_valid_access_code
+create_access_code = access_codes.create_access_code
+generate_access_code = access_codes.generate_access_code
+
+
+def _write_access_codes(data_dir: str, codes: list):
+    # as another process would, by replacing the file
+    with open(f'{data_dir}/.access_codes.json.tmp', 'w') as f:
+        json.dump(codes, f)
+    os.rename(f'{data_dir}/.access_codes.json.tmp', f'{data_dir}/.access_codes.json')
+
+def test_generated_code_is_valid_until_it_expires(data_dir, monkeypatch):
+    code = generate_access_code(dir=data_dir)
+    assert check_valid_access_code(code, dir=data_dir)
+    t = time.time()
+    monkeypatch.setattr(access_codes.time, 'time', lambda: t + 60 * 60 + 1)
+    assert not check_valid_access_code(code, dir=data_dir)
+
+def test_expired_codes_are_dropped_when_a_code_is_added(data_dir):
+    expired_code = create_access_code(-10)
+    _write_access_codes(data_dir, [expired_code])
+    assert not check_valid_access_code(expired_code, dir=data_dir)
+    code = generate_access_code(dir=data_dir)
+    with open(f'{data_dir}/.access_codes.json', 'r') as f:
+        assert json.load(f) == [code]
+
+@pytest.mark.parametrize('code', ['', None, 123, 'abc', 'abc.def'])
+def test_invalid_codes(data_dir, code):
+    generate_access_code(dir=data_dir)
+    assert not check_valid_access_code(code, dir=data_dir)
+
+def test_code_with_a_changed_expiration_is_invalid(data_dir):
+    code = generate_access_code(dir=data_dir)
+    random_str, expiration = code.split('.')
+    assert not check_valid_access_code(f'{random_str}.{int(expiration) + 1000}', dir=data_dir)
+
+def test_file_replaced_by_another_writer_is_reloaded(data_dir):
+    code = generate_access_code(dir=data_dir)
+    assert check_valid_access_code(code, dir=data_dir)
+    other_code = create_access_code(60)
+    _write_access_codes(data_dir, [other_code])
+    assert check_valid_access_code(other_code, dir=data_dir)
+    assert not check_valid_access_code(code, dir=data_dir)
+
+def _generate(args):
+    data_dir, num_codes = args
+    return [generate_access_code(dir=data_dir) for _ in range(num_codes)]
+
+def test_concurrent_generation_keeps_all_codes(data_dir):
+    num_workers = 8
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(num_workers) as pool:
+        results = pool.map(_generate, [(data_dir, 5)] * num_workers)
+    codes = [code for r in results for code in r]
+    assert len(set(codes)) == num_workers * 5
+    with open(f'{data_dir}/.access_codes.json', 'r') as f:
+        assert sorted(json.load(f)) == sorted(codes)
+    assert all(check_valid_access_code(code, dir=data_dir) for code in codes)
+
+def test_generation_outside_of_a_data_directory(tmp_path):
+    (tmp_path / 'other.txt').write_text('')
+    with pytest.raises(Exception, match='root of the stan-playground data directory'):
+        generate_access_code(dir=str(tmp_path))
@@ -0,0 +1,109 @@
+import os
+import json
+import stat
+from stan_playground.blob_store import BLOB_MIN_BYTES, clone_file, collect_blob_garbage, intern_file
+from stan_playground.data_cache import make_private_copy
+from stan_playground.metadata_store import set_analysis_info
+from stan_playground.RtcsharePlugin import StanPlaygroundService
+
+
+LARGE_DATA = json.dumps({'N': BLOB_MIN_BYTES, 'y': list(range(BLOB_MIN_BYTES // 4))})
+
+def _query(query: dict, *, user_id: str='user1') -> dict:
+    resp, _ = StanPlaygroundService.handle_query(query, dir='rtcshare://', user_id=user_id)
+    assert resp['success'], resp
+    return resp
+
+def _create_analysis(data_dir: str, analysis_id: str):
+    path = f'{data_dir}/analyses/{analysis_id}'
+    os.makedirs(path)
+    for fname, text in [('description.md', '# Large data\n'), ('main.stan', 'data { int N; }\n'), ('data.json', '{}')]:
+        with open(f'{path}/{fname}', 'w') as f:
+            f.write(text)
+    set_analysis_info(analysis_id, {'analysis_id': analysis_id, 'status': 'none', 'owner_id': 'user1'}, dir=data_dir)
+    return path
+
+def _read(path: str) -> str:
+    with open(path, 'r') as f:
+        return f.read()
+
+def test_clone_shares_the_interned_data(data_dir):
+    path = _create_analysis(data_dir, 'a')
+    _query({'type': 'set_analysis_text_file', 'analysis_id': 'a', 'name': 'data.json', 'text': LARGE_DATA})
+    st = os.stat(f'{path}/data.json')
+    # interned when written: linked from the store, and read-only
+    assert st.st_nlink == 2
+    assert not st.st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+    assert len(os.listdir(f'{data_dir}/.blobs')) == 1
+
+    new_analysis_id = _query({'type': 'clone_analysis', 'analysis_id': 'a'})['newAnalysisId']
+    clone_path = f'{data_dir}/analyses/{new_analysis_id}'
+    clone_st = os.stat(f'{clone_path}/data.json')
+    assert clone_st.st_ino == st.st_ino
+    assert clone_st.st_nlink == 3
+    assert not clone_st.st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+    assert _read(f'{clone_path}/data.json') == LARGE_DATA
+    # small files are copied
+    assert os.stat(f'{clone_path}/main.stan').st_ino != os.stat(f'{path}/main.stan').st_ino
+
+    # replacing the data of the original leaves the clone untouched
+    _query({'type': 'set_analysis_text_file', 'analysis_id': 'a', 'name': 'data.json', 'text': '{"N": 1}'})
+    assert _read(f'{path}/data.json') == '{"N": 1}'
+    assert _read(f'{clone_path}/data.json') == LARGE_DATA
+    assert os.stat(f'{clone_path}/data.json').st_nlink == 2
+
+def test_identical_files_share_a_blob(data_dir):
+    paths = []
+    for name in ['a', 'b']:
+        path = f'{data_dir}/{name}.json'
+        with open(path, 'w') as f:
+            f.write(LARGE_DATA)
+        intern_file(path, dir=data_dir)
+        paths.append(path)
+    assert os.stat(paths[0]).st_ino == os.stat(paths[1]).st_ino
+    assert len(os.listdir(f'{data_dir}/.blobs')) == 1
+    assert [fname for fname in os.listdir(data_dir) if '.tmp-' in fname] == []
+
+def test_file_written_before_interning_is_interned_on_its_first_clone(data_dir):
+    src = f'{data_dir}/src.json'
+    with open(src, 'w') as f:
+        f.write(LARGE_DATA)
+    clone_file(src, f'{data_dir}/dst.json', dir=data_dir)
+    assert os.stat(src).st_ino == os.stat(f'{data_dir}/dst.json').st_ino
+    assert os.stat(src).st_nlink == 3
+
+def test_small_files_are_copied(data_dir):
+    src = f'{data_dir}/src.json'
+    with open(src, 'w') as f:
+        f.write('{}')
+    intern_file(src, dir=data_dir)
+    clone_file(src, f'{data_dir}/dst.json', dir=data_dir)
+    assert os.stat(src).st_nlink == 1
+    assert os.stat(f'{data_dir}/dst.json').st_ino != os.stat(src).st_ino
+    assert not os.path.exists(f'{data_dir}/.blobs')
+
+def test_private_copy_is_writable_and_leaves_the_blob_untouched(data_dir):
+    path = f'{data_dir}/a.json'
+    with open(path, 'w') as f:
+        f.write(LARGE_DATA)
+    intern_file(path, dir=data_dir)
+    blob_path = f'{data_dir}/.blobs/{os.listdir(f"{data_dir}/.blobs")[0]}'
+    make_private_copy(path)
+    with open(path, 'w') as f:
+        f.write('{}')
+    assert _read(blob_path) == LARGE_DATA
+    assert os.stat(blob_path).st_nlink == 1
+
+def test_garbage_collection_removes_unused_blobs(data_dir):
+    paths = []
+    for i, text in enumerate([LARGE_DATA, LARGE_DATA + ' ']):
+        path = f'{data_dir}/{i}.json'
+        with open(path, 'w') as f:
+            f.write(text)
+        intern_file(path, dir=data_dir)
+        paths.append(path)
+    assert collect_blob_garbage(dir=data_dir) == 0
+    os.remove(paths[0])
+    assert collect_blob_garbage(dir=data_dir) == len(LARGE_DATA)
+    assert len(os.listdir(f'{data_dir}/.blobs')) == 1
+    assert _read(paths[1]) == LARGE_DATA + ' '
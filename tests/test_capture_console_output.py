@@ -0,0 +1,49 @@
+import os
+import sys
+import time
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+from stan_playground.capture_console_output import capture_console_output
+
+
+def _double(x: int) -> int:
+    return 2 * x
+
+# the output is written to the file descriptors, since pytest replaces sys.stdout
+
+def _read_lines(path: str):
+    with open(path, 'r') as f:
+        # without the timestamps
+        return [line.split(' - ', 1)[1] for line in f.read().splitlines()]
+
+def test_output_of_the_process_and_its_children_is_captured(tmp_path):
+    path = f'{tmp_path}/run.console.txt'
+    with capture_console_output(path) as console:
+        os.write(1, b'from the process\n')
+        subprocess.run([sys.executable, '-c', 'import sys; print("from a child"); print("to stderr", file=sys.stderr)'])
+    assert _read_lines(path) == ['from the process', 'from a child', 'to stderr']
+    assert console.tail(1)[0].endswith(' - to stderr')
+
+def test_capture_ends_promptly_when_a_descendant_outlives_it(tmp_path):
+    # the spawn pool starts the resource tracker of multiprocessing, which
+    # inherits stdout and stderr and keeps running after the capture
+    path = f'{tmp_path}/run.console.txt'
+    timer = time.time()
+    with capture_console_output(path):
+        with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn')) as pool:
+            os.write(1, f'{list(pool.map(_double, [1, 2, 3]))}\n'.encode('utf-8'))
+        os.write(2, b'done\n')
+    assert time.time() - timer < 5
+    assert _read_lines(path) == ['[2, 4, 6]', 'done']
+
+def test_only_one_capture_per_process(tmp_path):
+    with capture_console_output(f'{tmp_path}/a.txt'):
+        with pytest.raises(Exception, match='already being captured'):
+            with capture_console_output(f'{tmp_path}/b.txt'):
+                pass
+    # and a new capture can start after the first one has ended
+    with capture_console_output(f'{tmp_path}/b.txt'):
+        os.write(1, b'b\n')
+    assert _read_lines(f'{tmp_path}/b.txt') == ['b']
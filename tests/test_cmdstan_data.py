@@ -0,0 +1,76 @@
+import os
+import json
+import pytest
+from stan_playground.cmdstan_data import NPZ_CACHE_FNAME, get_cmdstan_data_file, validate_json_data_file
+
+
+def _write(path: str, text: str) -> str:
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+@pytest.mark.parametrize('text', [
+    '{}',
+    ' {"N": 3, "y": [1, 2.5, -3e-2]}\n',
+    '{"x": [[1, 2], [3, 4]], "s": "a \\"b\\" \\u00e9", "z": {"a": [true, false, null]}, "e": []}',
+    '{"y": [NaN, Infinity, -Infinity]}',
+    '{"y": [' + ','.join(str(i) for i in range(100000)) + ']}'
+])
+def test_valid_data_files(tmp_path, text):
+    validate_json_data_file(_write(f'{tmp_path}/data.json', text))
+
+@pytest.mark.parametrize('text,error', [
+    ('', 'empty file'),
+    ('  \n', 'unexpected end of file'),
+    ('[1, 2]', 'the data must be a json object'),
+    ('{"N": 3} {}', 'unexpected content after the data at byte 9'),
+    ('{"N": 3', 'unexpected end of file'),
+    ('{"N": 3,}', 'expected a variable name'),
+    ('{"N" 3}', 'expected ":"'),
+    ('{N: 3}', 'invalid json at byte 1'),
+    ('{"N": 3, 4}', 'unexpected ","'),
+    ('{"y": [1, 2}', 'unexpected "}"'),
+    ('{"y": [1, 2,]}', 'unexpected "]"'),
+    ('{"y": 01}', 'unexpected "1" at byte 7'),
+    ('{"y": tru}', 'invalid json')
+])
+def test_invalid_data_files(tmp_path, text, error):
+    with pytest.raises(Exception, match=error):
+        validate_json_data_file(_write(f'{tmp_path}/data.json', text))
+
+def test_missing_data_file(tmp_path):
+    with pytest.raises(Exception, match='Data file not found'):
+        get_cmdstan_data_file(str(tmp_path))
+
+def test_npz_arrays_are_merged_with_data_json(tmp_path):
+    np = pytest.importorskip('numpy')
+    analysis_dir = str(tmp_path)
+    _write(f'{analysis_dir}/data.json', '{"N": 2}')
+    np.savez(f'{analysis_dir}/data.npz', y=np.array([1.5, float('nan')]), x=np.arange(6).reshape(2, 3), b=np.array([True, False]))
+    path = get_cmdstan_data_file(analysis_dir)
+    assert path == f'{analysis_dir}/{NPZ_CACHE_FNAME}'
+    validate_json_data_file(path)
+    with open(path, 'r') as f:
+        data = json.load(f)
+    assert data['N'] == 2
+    assert data['y'][0] == 1.5 and data['y'][1] != data['y'][1]
+    assert data['x'] == [[0, 1, 2], [3, 4, 5]]
+    assert data['b'] == [1, 0]
+
+    # the converted file is reused until data.json or data.npz change
+    mtime = os.stat(path).st_mtime_ns
+    assert get_cmdstan_data_file(analysis_dir) == path
+    assert os.stat(path).st_mtime_ns == mtime
+    os.remove(f'{analysis_dir}/data.json')
+    _write(f'{analysis_dir}/data.json', '{"N": 3}')
+    with open(get_cmdstan_data_file(analysis_dir), 'r') as f:
+        assert json.load(f)['N'] == 3
+
+def test_npz_variable_also_in_data_json(tmp_path):
+    np = pytest.importorskip('numpy')
+    analysis_dir = str(tmp_path)
+    _write(f'{analysis_dir}/data.json', '{"y": 2}')
+    np.savez(f'{analysis_dir}/data.npz', y=np.array([1.0]))
+    with pytest.raises(Exception, match='both data.json and data.npz'):
+        get_cmdstan_data_file(analysis_dir)
+    assert not os.path.exists(f'{analysis_dir}/{NPZ_CACHE_FNAME}')
@@ -0,0 +1,114 @@
+import os
+import pytest
+import stan_playground.capture_console_output as capture_console_output
+from stan_playground.capture_console_output import ConsoleSink
+from stan_playground.RtcsharePlugin import StanPlaygroundService
+
+
+def _get_console_output(**kwargs):
+    return StanPlaygroundService.handle_query({'type': 'get_console_output', 'analysis_id': 'a', 'name': 'run.console.txt', **kwargs}, dir='rtcshare://')
+
+@pytest.fixture
+def console_path(data_dir):
+    os.makedirs(f'{data_dir}/analyses/a')
+    return f'{data_dir}/analyses/a/run.console.txt'
+
+def _append(path: str, text: str):
+    with open(path, 'a') as f:
+        f.write(text)
+
+def test_missing_console_output(console_path):
+    resp, data = _get_console_output()
+    assert resp == {'success': True, 'file_id': None, 'size': 0, 'offset': 0, 'end': 0, 'reset': False}
+    assert data == b''
+    # a client that had read some of a file that no longer exists starts over
+    resp, _ = _get_console_output(offset=10)
+    assert resp['reset']
+
+def test_tail_starts_at_a_line_boundary(console_path):
+    _append(console_path, 'line 1\nline 2\nline 3\n')
+    resp, data = _get_console_output(tail=10)
+    assert data == b'line 3\n'
+    assert (resp['offset'], resp['end'], resp['size']) == (14, 21, 21)
+    assert not resp['reset']
+
+def test_reads_continue_from_the_offset(console_path):
+    _append(console_path, 'line 1\n')
+    resp, data = _get_console_output(tail=1000)
+    assert data == b'line 1\n'
+    file_id = resp['file_id']
+    _append(console_path, 'line 2\n')
+    resp, data = _get_console_output(offset=resp['end'], file_id=file_id, tail=1000)
+    assert data == b'line 2\n'
+    assert (resp['offset'], resp['end'], resp['reset']) == (7, 14, False)
+    resp, data = _get_console_output(offset=resp['end'], file_id=file_id, max_bytes=3)
+    assert data == b''
+    assert resp['end'] == 14
+
+def test_max_bytes_limits_a_read(console_path):
+    _append(console_path, 'line 1\nline 2\n')
+    resp, data = _get_console_output(offset=2, max_bytes=3)
+    assert data == b'ne '
+    assert (resp['offset'], resp['end']) == (2, 5)
+
+def test_replaced_file_resets_the_reader(console_path):
+    _append(console_path, 'old line 1\nold line 2\n')
+    resp, _ = _get_console_output()
+    os.rename(console_path, f'{console_path}.old') # keeps the inode in use
+    # longer than the offset, so only the file_id tells that it was replaced
+    _append(console_path, 'new line 1\nnew line 2\nnew line 3\n')
+    resp2, data = _get_console_output(offset=resp['end'], file_id=resp['file_id'])
+    assert resp2['reset']
+    assert resp2['file_id'] != resp['file_id']
+    assert (resp2['offset'], data) == (0, b'new line 1\nnew line 2\nnew line 3\n')
+
+def test_offset_beyond_the_end_resets_the_reader(console_path):
+    _append(console_path, 'line 1\n')
+    resp, data = _get_console_output(offset=100)
+    assert resp['reset']
+    assert data == b'line 1\n'
+
+def test_invalid_queries(console_path):
+    resp, _ = _get_console_output(name='analysis.yaml')
+    assert resp == {'success': False, 'error': 'Unexpected file name: analysis.yaml'}
+    resp, _ = StanPlaygroundService.handle_query({'type': 'get_console_output', 'analysis_id': '../a', 'name': 'run.console.txt'}, dir='rtcshare://')
+    assert not resp['success']
+    resp, _ = _get_console_output(offset=-1)
+    assert not resp['success']
+
+def test_rotation_keeps_the_head_and_the_tail(console_path, monkeypatch):
+    monkeypatch.setattr(capture_console_output, 'CONSOLE_MAX_BYTES', 2000)
+    monkeypatch.setattr(capture_console_output, 'CONSOLE_HEAD_BYTES', 300)
+    monkeypatch.setattr(capture_console_output, 'CONSOLE_TAIL_BYTES', 500)
+    sink = ConsoleSink(console_path)
+    sink.write(b'line 0\n')
+    sink.close()
+    resp, _ = _get_console_output()
+    file_id = resp['file_id']
+
+    sink = ConsoleSink(console_path)
+    for i in range(200):
+        sink.write(f'line {i}\n'.encode('utf-8'))
+    sink.close()
+    assert sink.tail(2)[-1].endswith(' - line 199')
+
+    with open(console_path, 'r') as f:
+        lines = f.read().splitlines()
+    assert os.path.getsize(console_path) <= 2000
+    assert lines[0].endswith(' - line 0')
+    assert lines[-1].endswith(' - line 199')
+    notes = [line for line in lines if line.startswith('... ')]
+    assert len(notes) == 1 and notes[0].endswith(' bytes of console output omitted ...')
+    # the head is followed by the note, and the tail by no gap
+    i = lines.index(notes[0])
+    head_numbers = [int(line.split(' - line ')[1]) for line in lines[:i]]
+    tail_numbers = [int(line.split(' - line ')[1]) for line in lines[i + 1:]]
+    assert head_numbers == list(range(len(head_numbers)))
+    assert tail_numbers == list(range(tail_numbers[0], 200))
+    assert os.path.exists(f'{console_path}.1')
+
+    # a reader of the previous file starts over
+    resp, data = _get_console_output(offset=resp['end'], file_id=file_id)
+    assert resp['reset']
+    assert resp['file_id'] != file_id
+    assert data.decode('utf-8').splitlines() == lines
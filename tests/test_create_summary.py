@@ -0,0 +1,134 @@
+import os
+import json
+import shutil
+from stan_playground.create_summary import create_summary, deferred_summary_updates, update_analysis_summary
+from stan_playground.RtcsharePlugin import StanPlaygroundService
+from stan_playground.metadata_store import set_analysis_info, update_analysis_info
+
+
+def _create_analysis(data_dir: str, analysis_id: str, *, title: str, listed: bool=True, **info):
+    path = f'{data_dir}/analyses/{analysis_id}'
+    os.makedirs(path)
+    with open(f'{path}/description.md', 'w') as f:
+        f.write(f'# {title}\n\nAn analysis.\n')
+    with open(f'{path}/main.stan', 'w') as f:
+        f.write('parameters { real x; }\nmodel { x ~ normal(0, 1); }\n')
+    with open(f'{path}/data.json', 'w') as f:
+        f.write('{}')
+    set_analysis_info(analysis_id, {'analysis_id': analysis_id, 'status': 'none', 'listed': listed, **info}, dir=data_dir)
+
+def _read_summary_files(data_dir: str) -> dict:
+    # the index, the detail shards and the manifest
+    files = {}
+    for path in ['stan_playground_summary_index.json', '.stan_playground_summary_manifest.json'] + [f'summary/analyses/{fname}' for fname in sorted(os.listdir(f'{data_dir}/summary/analyses'))]:
+        with open(f'{data_dir}/{path}', 'r') as f:
+            files[path] = json.load(f)
+    return files
+
+def _rebuild(data_dir: str) -> dict:
+    os.remove(f'{data_dir}/stan_playground_summary_index.json')
+    os.remove(f'{data_dir}/.stan_playground_summary_manifest.json')
+    shutil.rmtree(f'{data_dir}/summary')
+    create_summary(data_dir)
+    return _read_summary_files(data_dir)
+
+def _make_changes(data_dir: str):
+    # edit, unlist, remove and add analyses
+    with open(f'{data_dir}/analyses/a1/description.md', 'w') as f:
+        f.write('# A new title\n')
+    update_analysis_info('a2', dir=data_dir, update={'listed': False})
+    shutil.rmtree(f'{data_dir}/analyses/a3')
+    _create_analysis(data_dir, 'a5', title='Five')
+    update_analysis_info('a4', dir=data_dir, update={'status': 'queued'})
+
+def _create_analyses(data_dir: str):
+    for i, title in enumerate(['One', 'Two', 'Three', 'Four'], start=1):
+        _create_analysis(data_dir, f'a{i}', title=title)
+    _create_analysis(data_dir, 'a9', title='Unlisted', listed=False)
+    create_summary(data_dir)
+
+def test_incremental_updates_match_a_full_rebuild(data_dir):
+    _create_analyses(data_dir)
+    _make_changes(data_dir)
+    for analysis_id in ['a1', 'a2', 'a3', 'a4', 'a5', 'a9']:
+        update_analysis_summary(analysis_id, dir=data_dir)
+    incremental = _read_summary_files(data_dir)
+    assert [a['title'] for a in incremental['stan_playground_summary_index.json']['analyses']] == ['A new title', 'Four', 'Five']
+    assert incremental == _rebuild(data_dir)
+
+def test_deferred_updates_match_a_full_rebuild(data_dir):
+    _create_analyses(data_dir)
+    with deferred_summary_updates(dir=data_dir):
+        _make_changes(data_dir)
+        for analysis_id in ['a1', 'a2', 'a3', 'a4', 'a5']:
+            update_analysis_summary(analysis_id, dir=data_dir)
+        # nothing is written until the end of the batch
+        assert 'a5' not in _read_summary_files(data_dir)['.stan_playground_summary_manifest.json']
+    assert _read_summary_files(data_dir) == _rebuild(data_dir)
+
+def test_unchanged_analysis_is_not_rebuilt(data_dir):
+    _create_analyses(data_dir)
+    index_path = f'{data_dir}/stan_playground_summary_index.json'
+    st = os.stat(index_path)
+    update_analysis_summary('a1', dir=data_dir)
+    assert os.stat(index_path).st_ino == st.st_ino
+
+def test_update_without_a_manifest_does_a_full_rebuild(data_dir):
+    _create_analyses(data_dir)
+    os.remove(f'{data_dir}/.stan_playground_summary_manifest.json')
+    _make_changes(data_dir)
+    update_analysis_summary('a1', dir=data_dir)
+    assert _read_summary_files(data_dir) == _rebuild(data_dir)
+
+def _get_page(**kwargs):
+    resp, _ = StanPlaygroundService.handle_query({'type': 'get_analyses_summary', **kwargs}, dir='rtcshare://')
+    assert resp['success'], resp
+    return resp
+
+def test_index_holds_the_listed_analyses_and_the_shards_their_details(data_dir):
+    _create_analyses(data_dir)
+    files = _read_summary_files(data_dir)
+    index = files['stan_playground_summary_index.json']['analyses']
+    assert [a['analysis_id'] for a in index] == ['a1', 'a2', 'a3', 'a4']
+    entry = index[0]
+    assert (entry['title'], entry['status'], entry['data_size']) == ('One', 'none', 2)
+    assert entry['description_size'] == len('# One\n\nAn analysis.\n')
+    # the contents of the files are only in the shards
+    assert 'description' not in entry and 'stan_program' not in entry
+    assert sorted(path for path in files if path.startswith('summary/')) == [f'summary/analyses/a{i}.json' for i in [1, 2, 3, 4]]
+    details = files['summary/analyses/a1.json']
+    assert details['description'] == '# One\n\nAn analysis.\n'
+    assert details['stan_program'].startswith('parameters')
+    assert details['info']['listed']
+
+    update_analysis_info('a1', dir=data_dir, update={'listed': False})
+    update_analysis_summary('a1', dir=data_dir)
+    assert not os.path.exists(f'{data_dir}/summary/analyses/a1.json')
+
+def test_pages_of_the_summary(data_dir):
+    for i, title in enumerate(['b', 'd', 'a', 'c', 'e'], start=1):
+        _create_analysis(data_dir, f'a{i}', title=title, timestamp_modified=None if i == 3 else i)
+    create_summary(data_dir)
+
+    page = _get_page(sort_by='title', sort_order='asc', offset=1, limit=2)
+    assert (page['total'], page['offset']) == (5, 1)
+    assert [a['title'] for a in page['analyses']] == ['b', 'c']
+    page = _get_page(sort_by='title', sort_order='desc', offset=3, limit=10)
+    assert [a['title'] for a in page['analyses']] == ['b', 'a']
+    # missing values sort first in ascending order
+    page = _get_page(sort_by='timestamp_modified', sort_order='asc', limit=3)
+    assert [a['analysis_id'] for a in page['analyses']] == ['a3', 'a1', 'a2']
+    assert _get_page(sort_by='title', offset=10)['analyses'] == []
+
+    # the next page reflects an update of the summary
+    _create_analysis(data_dir, 'a6', title='f', timestamp_modified=6)
+    update_analysis_summary('a6', dir=data_dir)
+    page = _get_page(limit=1)
+    assert page['total'] == 6
+    assert page['analyses'][0]['analysis_id'] == 'a6'
+
+def test_invalid_summary_queries(data_dir):
+    resp, _ = StanPlaygroundService.handle_query({'type': 'get_analyses_summary', 'sort_by': 'description'}, dir='rtcshare://')
+    assert resp == {'success': False, 'error': 'Unexpected sort_by: description'}
+    resp, _ = StanPlaygroundService.handle_query({'type': 'get_analyses_summary', 'limit': 100000}, dir='rtcshare://')
+    assert not resp['success']
@@ -0,0 +1,93 @@
+import os
+import json
+import pytest
+from stan_playground.draws_store import DRAWS_FORMAT_VERSION, DrawsWriter, convert_csv_draws, get_draws_path, read_draws_header
+
+np = pytest.importorskip('numpy')
+from stan_playground.draws_store import read_draws, read_draws_range # noqa: E402
+
+
+COLUMNS = ['lp__', 'accept_stat__', 'theta.1', 'theta.2']
+
+def _rows(chain_id: int, num_rows: int, start: int=0):
+    return [[-i - chain_id, 0.5, chain_id + i / 7, 1e-300 * i] for i in range(start, start + num_rows)]
+
+def _read_csv_values(path: str):
+    with open(path, 'r') as f:
+        lines = [line for line in f.read().splitlines() if line and not line.startswith('#')]
+    return np.array([[float(x) for x in line.split(',')] for line in lines[1:]])
+
+def test_draws_read_back_equal_the_csv_values(tmp_path, write_cmdstan_csv):
+    output_dir = str(tmp_path)
+    for chain_id in [1, 2]:
+        write_cmdstan_csv(f'{output_dir}/main-20240101000000_{chain_id}.csv', COLUMNS, _rows(chain_id, 30))
+    convert_csv_draws(output_dir, num_warmup_draws=10)
+
+    header = read_draws_header(output_dir)
+    assert header == {
+        'format_version': DRAWS_FORMAT_VERSION,
+        'dtype': '<f8',
+        'columns': COLUMNS,
+        'num_warmup_draws': 10,
+        'chains': {'1': {'num_draws': 30}, '2': {'num_draws': 30}},
+        'complete': True
+    }
+    for chain_id in [1, 2]:
+        values = _read_csv_values(f'{output_dir}/main-20240101000000_{chain_id}.csv')
+        for i, column in enumerate(COLUMNS):
+            draws = read_draws(output_dir, column, chain_id=chain_id)
+            # exact, since the csv values are parsed as doubles in both cases
+            assert draws.tolist() == values[:, i].tolist()
+            assert not draws.flags.writeable
+            assert read_draws_range(output_dir, i, chain_id=chain_id, header=header, start=10, end=30).tolist() == values[10:, i].tolist()
+            assert os.path.getsize(get_draws_path(output_dir, i, chain_id=chain_id)) == 30 * 8
+
+def test_rows_are_added_as_the_csv_files_are_written(tmp_path):
+    output_dir = str(tmp_path)
+    csv_path = f'{output_dir}/main-20240101000000_1.csv'
+    rows = [','.join(repr(x) for x in row) for row in _rows(1, 5)]
+    with open(csv_path, 'w') as f:
+        f.write('# model = main_model\n' + ','.join(COLUMNS) + '\n' + '\n'.join(rows[:3]) + '\n' + rows[3][:5])
+    writer = DrawsWriter(output_dir)
+    assert writer.poll()
+    # the partial row is not in the store yet
+    header = read_draws_header(output_dir)
+    assert (header['chains'], header['complete']) == ({'1': {'num_draws': 3}}, False)
+    assert not writer.poll()
+    with open(csv_path, 'a') as f:
+        f.write(rows[3][5:] + '\n' + rows[4] + '\n')
+    writer.poll(complete=True)
+    header = read_draws_header(output_dir)
+    assert (header['chains'], header['complete']) == ({'1': {'num_draws': 5}}, True)
+    assert read_draws(output_dir, 'theta.1', chain_id=1).tolist() == [row[2] for row in _rows(1, 5)]
+
+def test_continued_run_is_appended_to_the_chains(tmp_path, write_cmdstan_csv):
+    output_dir = str(tmp_path)
+    write_cmdstan_csv(f'{output_dir}/main-20240101000000_1.csv', COLUMNS, _rows(1, 10))
+    convert_csv_draws(output_dir)
+    os.makedirs(f'{output_dir}/continue_1')
+    write_cmdstan_csv(f'{output_dir}/continue_1/main-20240101000001_1.csv', COLUMNS, _rows(1, 5, start=10))
+    writer = DrawsWriter(output_dir, csv_dir=f'{output_dir}/continue_1', append=True)
+    writer.poll(complete=True)
+    assert read_draws_header(output_dir)['chains'] == {'1': {'num_draws': 15}}
+    assert read_draws(output_dir, 'lp__', chain_id=1).tolist() == [row[0] for row in _rows(1, 15)]
+
+def test_store_errors(tmp_path, write_cmdstan_csv):
+    output_dir = str(tmp_path)
+    write_cmdstan_csv(f'{output_dir}/main-20240101000000_1.csv', COLUMNS, _rows(1, 2))
+    convert_csv_draws(output_dir)
+    with pytest.raises(Exception, match='already exists'):
+        convert_csv_draws(output_dir)
+    with pytest.raises(Exception, match='Column not found'):
+        read_draws(output_dir, 'sigma', chain_id=1)
+    with pytest.raises(Exception, match='Chain not found'):
+        read_draws(output_dir, 'lp__', chain_id=2)
+    with pytest.raises(Exception, match='Not enough draws'):
+        read_draws_range(output_dir, 0, chain_id=1, header=read_draws_header(output_dir), start=0, end=3)
+    # a chain of a continued run that is not in the store
+    os.makedirs(f'{output_dir}/continue_1')
+    write_cmdstan_csv(f'{output_dir}/continue_1/main-20240101000001_2.csv', COLUMNS, _rows(2, 2))
+    with pytest.raises(Exception, match='Unable to append chain 2'):
+        DrawsWriter(output_dir, csv_dir=f'{output_dir}/continue_1', append=True).poll()
+    with open(f'{output_dir}/draws/header.json', 'r') as f:
+        assert json.load(f)['chains'] == {'1': {'num_draws': 2}}
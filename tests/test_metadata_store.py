@@ -0,0 +1,48 @@
+import os
+import multiprocessing
+import pytest
+from stan_playground.metadata_store import read_analysis_info, set_analysis_info, update_analysis_info
+
+
+def _create_analysis(data_dir: str, analysis_id: str, info: dict):
+    os.makedirs(f'{data_dir}/analyses/{analysis_id}')
+    set_analysis_info(analysis_id, info, dir=data_dir)
+
+def test_update_applies_when_expected_values_match(data_dir):
+    _create_analysis(data_dir, 'a', {'analysis_id': 'a', 'status': 'queued'})
+    info = update_analysis_info('a', dir=data_dir, update={'status': 'running'}, expected={'status': 'queued'})
+    assert info['status'] == 'running'
+    assert read_analysis_info('a', dir=data_dir)['status'] == 'running'
+
+def test_update_is_not_written_when_expected_values_differ(data_dir):
+    _create_analysis(data_dir, 'a', {'analysis_id': 'a', 'status': 'completed'})
+    mtime = os.stat(f'{data_dir}/analyses/a/analysis.yaml').st_mtime_ns
+    assert update_analysis_info('a', dir=data_dir, update={'status': 'running'}, expected={'status': 'queued'}) is None
+    assert os.stat(f'{data_dir}/analyses/a/analysis.yaml').st_mtime_ns == mtime
+    assert read_analysis_info('a', dir=data_dir)['status'] == 'completed'
+
+def test_missing_status_is_compared_as_none(data_dir):
+    _create_analysis(data_dir, 'a', {'analysis_id': 'a'})
+    assert update_analysis_info('a', dir=data_dir, update={'status': 'queued'}, expected={'status': 'none'}) is not None
+
+def _increment(args):
+    data_dir, num_increments = args
+    num_done = 0
+    while num_done < num_increments:
+        count = read_analysis_info('a', dir=data_dir)['count']
+        if update_analysis_info('a', dir=data_dir, update={'count': count + 1}, expected={'count': count}) is not None:
+            num_done += 1
+
+def test_concurrent_compare_and_swap_loses_no_updates(data_dir):
+    num_workers = 4
+    num_increments = 25
+    _create_analysis(data_dir, 'a', {'analysis_id': 'a', 'count': 0})
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(num_workers) as pool:
+        pool.map(_increment, [(data_dir, num_increments)] * num_workers)
+    assert read_analysis_info('a', dir=data_dir)['count'] == num_workers * num_increments
+
+def test_update_of_missing_analysis_raises_and_creates_nothing(data_dir):
+    with pytest.raises(FileNotFoundError):
+        update_analysis_info('missing', dir=data_dir, update={'status': 'queued'})
+    assert os.listdir(f'{data_dir}/analyses') == []
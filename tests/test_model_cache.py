@@ -0,0 +1,56 @@
+import os
+import sys
+import multiprocessing
+import pytest
+import stan_playground.model_cache as model_cache
+from stan_playground.model_cache import use_compiled_model
+
+
+@pytest.fixture
+def cmdstan_stub(tmp_path, monkeypatch):
+    # the stand-in for cmdstanpy of the benchmarks, with a makefile that
+    # "compiles" a model into a 1000-byte executable
+    monkeypatch.syspath_prepend(os.path.join(os.path.dirname(__file__), '..', 'benchmarks', 'stubs'))
+    monkeypatch.delitem(sys.modules, 'cmdstanpy', raising=False)
+    cmdstan_dir = str(tmp_path / 'cmdstan')
+    os.makedirs(cmdstan_dir)
+    with open(f'{cmdstan_dir}/makefile', 'w') as f:
+        f.write('%:\n\thead -c 1000 /dev/zero > $@\n')
+    monkeypatch.setenv('STUB_CMDSTAN_DIR', cmdstan_dir)
+
+def _write_program(data_dir: str, name: str) -> str:
+    path = f'{data_dir}/{name}.stan'
+    with open(path, 'w') as f:
+        f.write(f'// {name}\nparameters {{ real x; }}\nmodel {{ x ~ normal(0, 1); }}\n')
+    return path
+
+def _compile(data_dir: str, stan_file: str):
+    with use_compiled_model(stan_file, dir=data_dir) as (exe_path, _):
+        assert os.path.exists(exe_path)
+
+def test_compiled_model_is_reused(data_dir, cmdstan_stub):
+    stan_file = _write_program(data_dir, 'a')
+    with use_compiled_model(stan_file, dir=data_dir) as (exe_path, cache_hit):
+        assert not cache_hit
+    with open(stan_file, 'a') as f:
+        f.write('\n\n') # trailing whitespace does not change the model
+    with use_compiled_model(stan_file, dir=data_dir) as (exe_path2, cache_hit):
+        assert cache_hit
+        assert exe_path2 == exe_path
+
+def test_model_in_use_is_not_evicted(data_dir, cmdstan_stub, monkeypatch):
+    # room for one model
+    monkeypatch.setattr(model_cache, 'MODEL_CACHE_MAX_BYTES', 1500)
+    ctx = multiprocessing.get_context('fork')
+    with use_compiled_model(_write_program(data_dir, 'a'), dir=data_dir) as (exe_path, _):
+        # another worker compiles a different model, which would evict this one
+        p = ctx.Process(target=_compile, args=(data_dir, _write_program(data_dir, 'b')))
+        p.start()
+        p.join()
+        assert p.exitcode == 0
+        assert os.path.exists(exe_path)
+    p = ctx.Process(target=_compile, args=(data_dir, _write_program(data_dir, 'c')))
+    p.start()
+    p.join()
+    assert p.exitcode == 0
+    assert not os.path.exists(exe_path)
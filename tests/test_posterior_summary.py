@@ -0,0 +1,47 @@
+import json
+import time
+import pytest
+from stan_playground.capture_console_output import capture_console_output
+from stan_playground.draws_store import convert_csv_draws
+
+np = pytest.importorskip('numpy')
+from stan_playground.posterior_summary import create_posterior_summary # noqa: E402
+
+
+@pytest.fixture
+def output_dir(tmp_path, write_cmdstan_csv):
+    rng = np.random.default_rng(0)
+    for chain_id in [1, 2, 3, 4]:
+        rows = np.column_stack([rng.normal(size=200), rng.normal(loc=chain_id, size=200), rng.exponential(size=200)])
+        write_cmdstan_csv(f'{tmp_path}/main-20240101000000_{chain_id}.csv', ['lp__', 'mu', 'sigma'], rows)
+    convert_csv_draws(str(tmp_path), num_warmup_draws=50)
+    return str(tmp_path)
+
+def _read_summary(output_dir: str) -> dict:
+    with open(f'{output_dir}/summary.json', 'r') as f:
+        return json.load(f)
+
+def test_summary_of_the_draws_after_warmup(output_dir):
+    create_posterior_summary(output_dir)
+    summary = _read_summary(output_dir)
+    assert summary['columns'] == ['lp__', 'mu', 'sigma']
+    assert (summary['num_chains'], summary['num_draws_per_chain']) == (4, 150)
+    x = np.stack([np.loadtxt(f'{output_dir}/main-20240101000000_{chain_id}.csv', delimiter=',', comments='#', skiprows=3)[50:] for chain_id in [1, 2, 3, 4]], axis=1)
+    assert summary['mean'] == pytest.approx(x.reshape(-1, 3).mean(axis=0).tolist())
+    assert summary['sd'] == pytest.approx(x.reshape(-1, 3).std(axis=0, ddof=1).tolist())
+    assert summary['q50'] == pytest.approx(np.quantile(x.reshape(-1, 3), 0.5, axis=0).tolist())
+    # the chains of mu have different locations
+    assert summary['rhat'][1] > 1.5
+    assert summary['rhat'][0] < 1.05 and summary['rhat'][2] < 1.05
+
+def test_summary_in_parallel_matches_the_serial_one(output_dir, monkeypatch):
+    create_posterior_summary(output_dir)
+    serial_summary = _read_summary(output_dir)
+    create_posterior_summary(output_dir, num_workers=3)
+    assert _read_summary(output_dir) == serial_summary
+
+def test_capture_containing_the_summary_finishes_promptly(output_dir):
+    timer = time.time()
+    with capture_console_output(f'{output_dir}/run.console.txt'):
+        create_posterior_summary(output_dir, num_workers=2)
+    assert time.time() - timer < 5
@@ -0,0 +1,30 @@
+import multiprocessing
+from stan_playground.work_queue import claim_queued_analysis, enqueue_analysis, get_queued_analysis_ids, peek_next_queued_analysis
+
+
+def test_queue_is_fifo_and_enqueue_is_idempotent(data_dir):
+    for analysis_id in ['b', 'a', 'c', 'a']:
+        enqueue_analysis(analysis_id, dir=data_dir)
+    assert get_queued_analysis_ids(dir=data_dir) == ['b', 'a', 'c']
+    assert peek_next_queued_analysis(dir=data_dir) == 'b'
+
+def test_claim_removes_the_analysis_once(data_dir):
+    enqueue_analysis('a', dir=data_dir)
+    assert claim_queued_analysis('a', dir=data_dir)
+    assert not claim_queued_analysis('a', dir=data_dir)
+    assert peek_next_queued_analysis(dir=data_dir) is None
+
+def _claim(args):
+    data_dir, analysis_id, barrier = args
+    barrier.wait()
+    return claim_queued_analysis(analysis_id, dir=data_dir)
+
+def test_exactly_one_of_racing_workers_claims_an_analysis(data_dir):
+    num_workers = 8
+    enqueue_analysis('a', dir=data_dir)
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Manager() as manager:
+        barrier = manager.Barrier(num_workers)
+        with ctx.Pool(num_workers) as pool:
+            results = pool.map(_claim, [(data_dir, 'a', barrier)] * num_workers)
+    assert sorted(results) == [False] * (num_workers - 1) + [True]